@@ -0,0 +1,80 @@
+import os
+import json
+import hashlib
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from uav.setup.chunked_download import DownloadError, chunked_download
+
+
+PAYLOAD = os.urandom(10 * 1024 + 123)
+CHUNK_SIZE = 1024
+
+
+class RangeHandler(BaseHTTPRequestHandler):
+    """Serves PAYLOAD with range request support, failing the ranges that start at server.failing."""
+    def do_GET(self):
+        start, end = 0, len(PAYLOAD) - 1
+        if "Range" in self.headers:
+            start, end = (int(value) for value in self.headers["Range"].removeprefix("bytes=").split("-"))
+        self.server.requested.append(start)
+        if start in self.server.failing:
+            self.send_error(500)
+            return
+        self.send_response(206 if "Range" in self.headers else 200)
+        self.send_header("Content-Length", str(end - start + 1))
+        self.send_header("Content-Range", f"bytes {start}-{end}/{len(PAYLOAD)}")
+        self.send_header("ETag", '"payload"')
+        self.end_headers()
+        self.wfile.write(PAYLOAD[start:end + 1])
+
+    def log_message(self, *args):
+        pass
+
+@pytest.fixture
+def server():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), RangeHandler)
+    server.requested, server.failing = [], set()
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+def url(server) -> str:
+    return f"http://127.0.0.1:{server.server_address[1]}/archive.zip"
+
+def test_download_verifies_checksum(server, tmp_path):
+    target_path = str(tmp_path / "archive.zip")
+    chunked_download(url(server), target_path, False, connections=3, chunk_size=CHUNK_SIZE, checksum=hashlib.sha256(PAYLOAD).hexdigest(), retries=0)
+    with open(target_path, "rb") as f:
+        assert f.read() == PAYLOAD
+    assert not os.path.exists(target_path + ".part") and not os.path.exists(target_path + ".part.json")
+
+def test_download_resumes_after_failed_chunk(server, tmp_path):
+    target_path = str(tmp_path / "archive.zip")
+    server.failing = {3 * CHUNK_SIZE}
+    with pytest.raises(DownloadError):
+        chunked_download(url(server), target_path, False, connections=1, chunk_size=CHUNK_SIZE, retries=0)
+    # The queued chunks are cancelled instead of fetched, at most the one taken up meanwhile still runs
+    assert max(server.requested) <= 4 * CHUNK_SIZE
+    with open(target_path + ".part.json") as f:
+        done = json.load(f)["done"]
+    assert set(done) >= {0, 1, 2} and 3 not in done
+
+    server.failing, server.requested = set(), []
+    chunked_download(url(server), target_path, False, connections=2, chunk_size=CHUNK_SIZE, retries=0)
+    assert 3 * CHUNK_SIZE in server.requested
+    assert not {chunk * CHUNK_SIZE for chunk in done} & set(server.requested[1:])
+    with open(target_path, "rb") as f:
+        assert f.read() == PAYLOAD
+
+def test_download_rejects_checksum_mismatch(server, tmp_path):
+    target_path = str(tmp_path / "archive.zip")
+    with pytest.raises(DownloadError, match="Checksum mismatch"):
+        chunked_download(url(server), target_path, False, chunk_size=CHUNK_SIZE, checksum="0" * 64, retries=0)
+    assert not os.path.exists(target_path)
+    # The next attempt starts over, the state cannot tell which chunk is corrupt
+    assert not os.path.exists(target_path + ".part.json")
@@ -0,0 +1,51 @@
+import numpy as np
+from sklearn.model_selection import StratifiedShuffleSplit
+
+from uav.experiments import create
+from uav.experiments.create import combine_strata
+from uav.experiments.data import Modality, TempTrainingContext
+from uav.experiments.splits import load_folds, save_folds
+
+
+def test_combine_strata_keeps_frequent_combinations():
+    objects = np.array([0] * 5 + [1] * 10)
+    sizes = np.array([0] * 5 + [1] * 5 + [2] * 5)
+    y_stratify = combine_strata([objects, sizes], 5)
+    assert np.array_equal(np.bincount(y_stratify), [5, 5, 5])
+
+def test_combine_strata_rare_combination_joins_largest_sibling():
+    objects = np.array([0] * 7 + [1] * 20)
+    sizes = np.array([0] * 6 + [1] + [0] * 10 + [1] * 9 + [2])
+    y_stratify = combine_strata([objects, sizes], 5)
+    assert y_stratify[6] == y_stratify[0]
+    assert y_stratify[26] == y_stratify[7]
+    assert np.array_equal(np.bincount(y_stratify), [7, 11, 9])
+
+def test_combine_strata_leaves_no_class_below_min_count():
+    objects = np.array([0] * 10 + [1] * 10 + [2])
+    sizes = np.array(list(range(10)) * 2 + [0])
+    y_stratify = combine_strata([objects, sizes], 5)
+    assert np.bincount(y_stratify).min() >= 5
+    # Raised on a class of one before
+    next(StratifiedShuffleSplit(n_splits=1, train_size=10, random_state=0).split(y_stratify, y_stratify))
+
+def test_combine_strata_pools_everything_if_all_rare():
+    y_stratify = combine_strata([np.array([0, 1, 2])], 5)
+    assert np.array_equal(y_stratify, [0, 0, 0])
+
+def test_extend_experiments_keeps_hybrid_split(tmp_path, monkeypatch):
+    X = np.array([f"datasets/anti-uav300/images/seqA/seqA-vz-{i:08d}.jpg" for i in range(10)])
+    X_new = [f"datasets/anti-uav300/images/seqB/seqB-vz-{i:08d}.jpg" for i in range(6)]
+    folds = [{'fold': i, 'filepaths': X, 'train_idx': np.setdiff1d(np.arange(10), test_idx), 'test_idx': test_idx} for i, test_idx in enumerate(np.array_split(np.arange(10), 2))]
+    monkeypatch.setattr(create, "list_frames_from_label_tables", lambda source_dir, sequence_names: (X_new, np.array([0, 1] * 3)))
+
+    for splits_filepath in [str(tmp_path / "splits.npy"), str(tmp_path / "splits")]:
+        save_folds(folds, splits_filepath)
+        create.extend_experiments(splits_filepath, "datasets/anti-uav300", ["seqB"], seed=0)
+        extended = load_folds(splits_filepath)
+        assert len(extended[0]['filepaths']) == 16
+        assert all(fold['hybrid_split'] == 5 for fold in extended)
+
+        context = TempTrainingContext(extended[0]['filepaths'], Modality.HYBRID, extended[0]['train_idx'], extended[0]['test_idx'], hybrid_split=extended[0]['hybrid_split'])
+        assert "-vz-" in context.img_filepaths[4] and "-ir-" in context.img_filepaths[5]
+        assert context.img_filepaths[:10] == TempTrainingContext(X, Modality.HYBRID, [], []).img_filepaths
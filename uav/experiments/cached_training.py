@@ -0,0 +1,85 @@
+from ultralytics.data.dataset import YOLODataset # type: ignore
+from ultralytics.models.yolo.detect import DetectionTrainer, DetectionValidator # type: ignore
+from ultralytics.utils import colorstr # type: ignore
+
+from uav.experiments.image_cache import ImageCache
+
+
+class CachedYOLODataset(YOLODataset):
+    """YOLO dataset that serves images and labels from an image cache instead of decoding JPEGs and parsing label files.
+    ultralytics never writes into the arrays returned by load_image (its RAM cache relies on that), so they are passed as read-only views."""
+    def __init__(self, *args, image_cache: ImageCache, **kwargs):
+        self.image_cache = image_cache
+        if kwargs.get("imgsz") != image_cache.imgsz:
+            raise ValueError(f"The image cache was built for imgsz {image_cache.imgsz}, not {kwargs.get('imgsz')}.")
+        super().__init__(*args, **kwargs)
+
+    def get_labels(self) -> list[dict]:
+        labels = []
+        for im_file in self.im_files:
+            cls, bboxes = self.image_cache.labels(im_file)
+            _, shape, _ = self.image_cache.load_image(im_file)
+            labels.append({
+                "im_file": im_file,
+                "shape": shape,
+                "cls": cls,
+                "bboxes": bboxes,
+                "segments": [],
+                "keypoints": None,
+                "normalized": True,
+                "bbox_format": "xywh",
+            })
+        return labels
+
+    def load_image(self, i: int, rect_mode: bool = True, resize_short: bool = False):
+        if not rect_mode or resize_short:
+            raise ValueError("The image cache only holds images resized by their long side, load them with rect_mode and without resize_short.")
+        if self.ims[i] is not None:
+            return self.ims[i], self.im_hw0[i], self.im_hw[i]
+
+        im, hw_original, hw_resized = self.image_cache.load_image(self.im_files[i])
+        # Mosaic draws its partner images from the buffer of recently loaded ones, as in BaseDataset.load_image
+        if self.augment:
+            self.ims[i], self.im_hw0[i], self.im_hw[i] = im, hw_original, hw_resized
+            self.buffer.append(i)
+            if 1 < len(self.buffer) >= self.max_buffer_length:
+                j = self.buffer.pop(0)
+                self.ims[j], self.im_hw0[j], self.im_hw[j] = None, None, None
+        return im, hw_original, hw_resized
+
+def build_cached_dataset(cfg, img_path: str, batch: int, data: dict, mode: str, rect: bool, stride: int, image_cache: ImageCache) -> CachedYOLODataset:
+    """Builds the dataset like ultralytics' build_yolo_dataset, reading from the image cache."""
+    return CachedYOLODataset(
+        img_path=img_path,
+        imgsz=cfg.imgsz,
+        batch_size=batch,
+        augment=mode == "train",
+        hyp=cfg,
+        rect=cfg.rect or rect,
+        cache=None, # already decoded
+        single_cls=cfg.single_cls or False,
+        stride=int(stride),
+        pad=0.0 if mode == "train" else 0.5,
+        prefix=colorstr(f"{mode}: "),
+        task=cfg.task,
+        classes=cfg.classes,
+        data=data,
+        fraction=cfg.fraction if mode == "train" else 1.0,
+        image_cache=image_cache,
+    )
+
+def cached_trainer(image_cache: ImageCache) -> type:
+    """Returns a detection trainer class whose train and val datasets read from the image cache, for YOLO.train(trainer=...)."""
+    class CachedDetectionTrainer(DetectionTrainer):
+        def build_dataset(self, img_path, mode="train", batch=None):
+            model = self.model.module if hasattr(self.model, "module") else self.model
+            stride = max(int(model.stride.max() if model else 0), 32)
+            return build_cached_dataset(self.args, img_path, batch, self.data, mode, mode == "val", stride, image_cache)
+    return CachedDetectionTrainer
+
+def cached_validator(image_cache: ImageCache) -> type:
+    """Returns a detection validator class whose dataset reads from the image cache, for YOLO.val(validator=...)."""
+    class CachedDetectionValidator(DetectionValidator):
+        def build_dataset(self, img_path, mode="val", batch=None):
+            return build_cached_dataset(self.args, img_path, batch, self.data, mode, False, self.stride, image_cache)
+    return CachedDetectionValidator
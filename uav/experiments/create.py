@@ -1,14 +1,21 @@
 import numpy as np
 import os
 from tqdm import tqdm
-from sklearn.model_selection import StratifiedShuffleSplit, RepeatedStratifiedKFold
+from sklearn.model_selection import StratifiedShuffleSplit, RepeatedStratifiedKFold, StratifiedKFold
 
+from uav.setup.frame_source import FrameSource
+from uav.setup.frame_store import parse_frame_filename
+from uav.setup.hash_index import HashIndex, sample_dissimilar
+from uav.setup.label_index import LABEL_INDEX_DIRNAME, MODALITIES, LabelIndex, load_label_index, load_label_table
+from uav.experiments.splits import build_splits, infer_fold_layout, is_splits_dir, load_folds, load_splits, save_folds, save_splits
 
-def create_experiments(seeds: list[int], source_dir: str, target_filepath: str, fold_size: int, n_splits: int = 5, n_repeats: int = 2) -> None:
-    """Create the 'experiments.yml' file to allow later execution of the experiments one by one."""
 
-    assert len(seeds) == 2
+STRATA = ["object", "size", "sequence"]
+SIZE_STRATA_BINS = [32**2, 96**2] # pixel areas, COCO small/medium/large objects
+
 
+def list_frames_from_directory(source_dir: str) -> tuple[list[str], list[int]]:
+    """List VZ image paths and binary stratification labels by scanning the label files of an extracted dataset."""
     dataset_images_dir = os.path.join(source_dir, "images")
     dataset_labels_dir = os.path.join(source_dir, "labels")
     
@@ -19,12 +26,12 @@ def create_experiments(seeds: list[int], source_dir: str, target_filepath: str,
         sequence_images_dir = os.path.join(dataset_images_dir, sequence_name)
         sequence_labels_dir = os.path.join(dataset_labels_dir, sequence_name)
 
-        image_files = sorted([f for f in os.listdir(sequence_images_dir) if f.endswith('.jpg') and '-vz-' in f])
-        for img_file in image_files:
-            img_path = os.path.join(sequence_images_dir, img_file)
+        # List via the labels so that sequences packed into frame shards yield the same image paths
+        label_files = sorted([f for f in os.listdir(sequence_labels_dir) if f.endswith('.txt') and '-vz-' in f])
+        for label_file in label_files:
+            img_path = os.path.join(sequence_images_dir, label_file.replace('.txt', '.jpg'))
             X.append(img_path)
             
-            label_file = img_file.replace('.jpg', '.txt')
             label_path = os.path.join(sequence_labels_dir, label_file)
             
             # Create binary stratification labels: 1 for object, 0 for empty
@@ -32,6 +39,87 @@ def create_experiments(seeds: list[int], source_dir: str, target_filepath: str,
                 y_stratify.append(0) 
             else:
                 y_stratify.append(1)
+
+    return X, y_stratify
+
+def list_frames_from_label_index(source_dir: str) -> tuple[list[str], np.ndarray]:
+    """List VZ image paths and binary stratification labels from the label index of an extracted dataset."""
+    dataset_images_dir = os.path.join(source_dir, "images")
+    label_index = load_label_index(os.path.join(source_dir, LABEL_INDEX_DIRNAME))
+
+    rows = np.flatnonzero(label_index.modality == MODALITIES.index("vz"))
+    sequence_names = label_index.sequences[label_index.sequence[rows]]
+    X = [os.path.join(dataset_images_dir, name, f"{name}-vz-{frame_idx:08d}.jpg") for name, frame_idx in zip(sequence_names, label_index.frame[rows])]
+    y_stratify = label_index.labelled()[rows].astype(int)
+
+    return X, y_stratify
+
+def list_frames_from_source(source_dir: str, frame_source: FrameSource) -> tuple[list[str], list[int]]:
+    """List VZ image paths (as they would be extracted to source_dir) and binary stratification labels from the raw videos and annotations."""
+    dataset_images_dir = os.path.join(source_dir, "images")
+    X, y_stratify = [], []
+
+    for sequence_name in tqdm(frame_source.sequences(), desc="Processing Sequences"):
+        for frame_idx in range(frame_source.frame_count(sequence_name, "vz")):
+            X.append(os.path.join(dataset_images_dir, sequence_name, f"{sequence_name}-vz-{frame_idx:08d}.jpg"))
+            y_stratify.append(0 if frame_source.label(sequence_name, "vz", frame_idx) == "" else 1)
+
+    return X, y_stratify
+
+def list_frames_from_label_tables(source_dir: str, sequence_names: list[str]) -> tuple[list[str], np.ndarray]:
+    """List VZ image paths and binary stratification labels of only the given sequences from their label tables."""
+    dataset_images_dir = os.path.join(source_dir, "images")
+    X, y_stratify = [], []
+
+    for sequence_name in sorted(sequence_names):
+        tables = load_label_table(os.path.join(source_dir, "labels", sequence_name))
+        if tables is None:
+            raise FileNotFoundError(f"Sequence {sequence_name} has no label table.")
+        labelled = ~np.isnan(tables["vz"]["xywh"][:, 0])
+        X.extend(os.path.join(dataset_images_dir, sequence_name, f"{sequence_name}-vz-{frame_idx:08d}.jpg") for frame_idx in range(len(labelled)))
+        y_stratify.append(labelled.astype(int))
+
+    return X, np.concatenate(y_stratify) if y_stratify else np.empty(0, dtype=int)
+
+def sample_frames_dissimilar(X: np.ndarray, y_stratify: np.ndarray, n_samples: int, seed: int, hash_index: HashIndex | None, min_hash_distance: int | None, min_frame_stride: int | None) -> np.ndarray:
+    """Stratified sample of frame paths without near-duplicates within a sequence, see sample_dissimilar."""
+    parsed = [parse_frame_filename(filepath) for filepath in X]
+    sequence_names = np.array([sequence for sequence, _, _ in parsed])
+    frame_indices = np.array([frame_idx for _, _, frame_idx in parsed])
+    _, sequence_ids = np.unique(sequence_names, return_inverse=True)
+
+    hashes = hash_index.hash[hash_index.rows(sequence_names, frame_indices)] if hash_index is not None else None
+    sample_idx = sample_dissimilar(sequence_ids, frame_indices, y_stratify, n_samples, seed, hashes, min_hash_distance, min_frame_stride)
+    if len(sample_idx) < n_samples:
+        print(f"Warning: Only {len(sample_idx)} of {n_samples} frames satisfy the dissimilarity constraints.")
+    return sample_idx
+
+def create_experiments(
+    seeds: list[int],
+    source_dir: str,
+    target_filepath: str,
+    fold_size: int,
+    n_splits: int = 5,
+    n_repeats: int = 2,
+    frame_source: FrameSource | None = None,
+    hash_index: HashIndex | None = None,
+    min_hash_distance: int | None = None,
+    min_frame_stride: int | None = None,
+) -> None:
+    """Create the split file to allow later execution of the experiments one by one. A target_filepath ending with .npy is saved
+    as pickled fold dicts, any other as split directory with its seeds and sizes (see uav.experiments.splits).
+    If a frame_source is given, frames and labels are enumerated from the raw videos and annotations instead of the extracted dataset at source_dir.
+    Otherwise the label index of the dataset is used if it exists, falling back to scanning the label files.
+    If min_hash_distance (with the VZ hash_index) or min_frame_stride is given, the sample keeps frames of a sequence at least that many bits or frames apart."""
+
+    assert len(seeds) == 2
+
+    if frame_source is not None:
+        X, y_stratify = list_frames_from_source(source_dir, frame_source)
+    elif os.path.exists(os.path.join(source_dir, LABEL_INDEX_DIRNAME)):
+        X, y_stratify = list_frames_from_label_index(source_dir)
+    else:
+        X, y_stratify = list_frames_from_directory(source_dir)
               
     X = np.array(X)
     y_stratify = np.array(y_stratify)
@@ -41,7 +129,11 @@ def create_experiments(seeds: list[int], source_dir: str, target_filepath: str,
         
     total_images = n_splits * fold_size
 
-    if len(X) > total_images:
+    if len(X) > total_images and (min_hash_distance is not None or min_frame_stride is not None):
+        sample_idx = sample_frames_dissimilar(X, y_stratify, total_images, seeds[0], hash_index, min_hash_distance, min_frame_stride)
+        X = X[sample_idx]
+        y_stratify = y_stratify[sample_idx]
+    elif len(X) > total_images:
         sss = StratifiedShuffleSplit(n_splits=1, train_size=total_images, random_state=seeds[0]) 
         
         for sample_idx, _ in sss.split(X, y_stratify):
@@ -63,5 +155,175 @@ def create_experiments(seeds: list[int], source_dir: str, target_filepath: str,
         })
     
     
-    np.save(target_filepath, folds)
+    metadata = {
+        "seeds": [int(seed) for seed in seeds],
+        "n_splits": n_splits,
+        "n_repeats": n_repeats,
+        "fold_size": fold_size,
+        "min_hash_distance": min_hash_distance,
+        "min_frame_stride": min_frame_stride,
+    }
+    save_folds(folds, target_filepath, metadata)
     print("Saved RSKF config to %s." % target_filepath)
+
+def extend_experiments(splits_filepath: str, source_dir: str, sequence_names: list[str], seed: int, target_filepath: str | None = None, max_new_frames: int | None = None) -> None:
+    """Extends an existing split file with the frames of new sequences without touching the existing assignment.
+    Per repeat, the new frames are split into n_splits stratified parts; each fold tests on one part and trains on the others.
+    Existing indices and folds stay unchanged, the cost only depends on the new frames. The hybrid split point of the original frames is stored
+    in the folds, so the new frames are infrared in hybrid runs."""
+    folds = load_folds(splits_filepath)
+    metadata = load_splits(splits_filepath).metadata if is_splits_dir(splits_filepath) else {}
+    X = folds[0]['filepaths']
+    n_splits, n_repeats = infer_fold_layout(folds)
+    hybrid_split = int(folds[0].get('hybrid_split', len(X) / 2))
+
+    X_new, y_new = list_frames_from_label_tables(source_dir, sequence_names)
+    X_new = np.array(X_new)
+
+    if max_new_frames is not None and len(X_new) > max_new_frames:
+        sss = StratifiedShuffleSplit(n_splits=1, train_size=max_new_frames, random_state=seed)
+        sample_idx = np.sort(next(sss.split(X_new, y_new))[0])
+        X_new, y_new = X_new[sample_idx], y_new[sample_idx]
+
+    if len(X_new) < n_splits:
+        raise ValueError(f"{len(X_new)} new frames cannot be split into {n_splits} folds.")
+
+    print(f"Extending {len(folds)} folds of {len(X)} frames with {len(X_new)} new frames: {np.unique(y_new, return_counts=True)}")
+
+    new_idx = np.arange(len(X), len(X) + len(X_new))
+    filepaths = np.concatenate([X, X_new])
+
+    for repeat in range(n_repeats):
+        skf = StratifiedKFold(n_splits=n_splits, shuffle=True, random_state=seed + repeat)
+        for split_idx, (new_train, new_test) in enumerate(skf.split(X_new, y_new)):
+            fold = folds[repeat * n_splits + split_idx]
+            fold['filepaths'] = filepaths
+            fold['hybrid_split'] = hybrid_split
+            fold['train_idx'] = np.concatenate([fold['train_idx'], new_idx[new_train]])
+            fold['test_idx'] = np.concatenate([fold['test_idx'], new_idx[new_test]])
+
+    target_filepath = target_filepath if target_filepath is not None else splits_filepath
+    save_folds(folds, target_filepath, {**metadata, "extended_seed": seed, "hybrid_split": hybrid_split})
+    print("Saved extended RSKF config to %s." % target_filepath)
+
+def stratification_columns(label_index: LabelIndex, rows: np.ndarray, strata: list[str], size_bins: list[float] = SIZE_STRATA_BINS) -> list[np.ndarray]:
+    """Vectorized stratum columns of label index rows: 'object' (empty or labelled), 'size' (bbox pixel area bucket, 0 for empty frames)
+    and 'sequence' (sequence id)."""
+    columns = []
+    for stratum in strata:
+        if stratum == "object":
+            columns.append((~np.isnan(label_index.xywh[rows, 0])).astype(np.int64))
+        elif stratum == "size":
+            xywh, resolution = label_index.xywh[rows], label_index.resolution[rows]
+            area = np.nan_to_num(xywh[:, 2] * xywh[:, 3] * resolution[:, 0] * resolution[:, 1], nan=-1.0)
+            columns.append(np.where(area < 0, 0, np.digitize(area, size_bins) + 1).astype(np.int64))
+        elif stratum == "sequence":
+            columns.append(label_index.sequence[rows].astype(np.int64))
+        else:
+            raise ValueError(f"Unknown stratum '{stratum}', expected one of {', '.join(STRATA)}.")
+    return columns
+
+def largest_classes(keys: np.ndarray, depth: np.ndarray, rows: np.ndarray, prefix_length: int) -> dict[tuple, int]:
+    """Returns a representative row of the largest class among the given rows per prefix of their first prefix_length columns.
+    A class is a depth with the columns up to it, ties go to the lowest class."""
+    truncated = np.where(np.arange(keys.shape[1]) < depth[rows, None], keys[rows], -1)
+    _, first, counts = np.unique(np.column_stack([depth[rows], truncated]), axis=0, return_index=True, return_counts=True)
+    largest = {}
+    for i in np.argsort(-counts, kind="stable"):
+        largest.setdefault(tuple(keys[rows[first[i]], :prefix_length]), rows[first[i]])
+    return largest
+
+def combine_strata(columns: list[np.ndarray], min_count: int) -> np.ndarray:
+    """Combines stratum columns into integer class labels. A combination with fewer than min_count members joins the largest
+    class that shares all its columns but the last one, e.g. a rare size bucket of an object class joins its largest size bucket.
+    Without such a class, the rare combinations of the shorter prefix are pooled and handled the same way one column up,
+    so that no class stays below min_count unless all rows together are fewer."""
+    keys = np.stack(columns, axis=1)
+    depth = np.full(len(keys), len(columns))
+    for k in range(len(columns), 0, -1):
+        active = np.flatnonzero(depth == k)
+        if len(active) == 0:
+            continue
+        groups, inverse, counts = np.unique(keys[active, :k], axis=0, return_inverse=True, return_counts=True)
+        inverse = inverse.ravel()
+        rare = counts[inverse] < min_count
+        if not rare.any():
+            continue
+
+        # Classes of deeper rows and the large combinations of this depth are final, rare ones join the largest of their prefix
+        final = depth > k
+        final[active[~rare]] = True
+        largest = largest_classes(keys, depth, np.flatnonzero(final), k - 1)
+        order = np.argsort(inverse, kind="stable")
+        for group, members in zip(range(len(groups)), np.split(active[order], np.cumsum(counts)[:-1])):
+            if counts[group] >= min_count:
+                continue
+            representative = largest.get(tuple(groups[group, :k - 1]))
+            if representative is None:
+                depth[members] = k - 1
+            else:
+                depth[members] = depth[representative]
+                keys[members] = keys[representative]
+
+    # Drop the columns beyond each row's depth, the depth itself keeps the pooled classes apart
+    truncated = np.where(np.arange(len(columns)) < depth[:, None], keys, -1)
+    _, y_stratify = np.unique(np.column_stack([depth, truncated]), axis=0, return_inverse=True)
+    return y_stratify.ravel()
+
+def create_experiments_from_index(
+    seeds: list[int],
+    source_dir: str,
+    target_dir: str,
+    fold_size: int,
+    n_splits: int = 5,
+    n_repeats: int = 2,
+    strata: list[str] = ["object"],
+    hash_index: HashIndex | None = None,
+    min_hash_distance: int | None = None,
+    min_frame_stride: int | None = None,
+) -> None:
+    """Creates a split directory like create_experiments, driven by the label index of the dataset at source_dir.
+    Frames are handled as label index rows and integer (sequence, frame) pairs, paths are never built. The stratification
+    labels combine the given strata (see stratification_columns), classes too small for the folds join larger ones (see combine_strata).
+    With strata ['object'] the folds equal those of create_experiments."""
+
+    assert len(seeds) == 2
+
+    label_index = load_label_index(os.path.join(source_dir, LABEL_INDEX_DIRNAME))
+    rows = np.flatnonzero(label_index.modality == MODALITIES.index("vz"))
+    total_images = n_splits * fold_size
+    print(f"Original frames: {len(rows)}")
+
+    # Both the sample and the folds need at least n_splits members per class
+    y_stratify = combine_strata(stratification_columns(label_index, rows, strata), n_splits)
+
+    if len(rows) > total_images and (min_hash_distance is not None or min_frame_stride is not None):
+        hashes = hash_index.hash[hash_index.rows(label_index.sequences[label_index.sequence[rows]], label_index.frame[rows])] if hash_index is not None else None
+        sample_idx = sample_dissimilar(label_index.sequence[rows], label_index.frame[rows], y_stratify, total_images, seeds[0], hashes, min_hash_distance, min_frame_stride)
+        if len(sample_idx) < total_images:
+            print(f"Warning: Only {len(sample_idx)} of {total_images} frames satisfy the dissimilarity constraints.")
+        rows = rows[sample_idx]
+    elif len(rows) > total_images:
+        sss = StratifiedShuffleSplit(n_splits=1, train_size=total_images, random_state=seeds[0])
+        sample_idx, _ = next(sss.split(np.zeros(len(rows)), y_stratify))
+        rows = rows[sample_idx]
+
+    # Re-derive the classes on the sample, rare classes of the full dataset may have shrunk below n_splits
+    y_stratify = combine_strata(stratification_columns(label_index, rows, strata), n_splits)
+    print(f"Sampled frames: {len(rows)} in {len(np.unique(y_stratify))} strata")
+
+    rskf = RepeatedStratifiedKFold(n_splits=n_splits, n_repeats=n_repeats, random_state=seeds[1])
+    folds = [(fold_idx, train_idx, test_idx) for fold_idx, (train_idx, test_idx) in enumerate(rskf.split(np.zeros(len(rows)), y_stratify))]
+
+    metadata = {
+        "image_root": os.path.join(source_dir, "images"),
+        "seeds": [int(seed) for seed in seeds],
+        "n_splits": n_splits,
+        "n_repeats": n_repeats,
+        "fold_size": fold_size,
+        "strata": list(strata),
+        "min_hash_distance": min_hash_distance,
+        "min_frame_stride": min_frame_stride,
+    }
+    save_splits(build_splits(label_index.sequences, label_index.sequence[rows], label_index.frame[rows], folds, metadata), target_dir)
+    print("Saved RSKF config to %s." % target_dir)
@@ -1,17 +1,56 @@
 import tempfile
 import os
+import time
 from enum import Enum
 import shutil
 import yaml
+import numpy as np
+
+from uav.setup.frame_store import FrameStore
+from uav.setup.frame_source import FrameSource
+from uav.setup.label_index import LabelIndex
+from uav.setup.frame_store import parse_frame_filename
+from uav.experiments.fold_cache import FoldCache
 
 class Modality(Enum):
     VISIBLE = "vz"
     INFRARED = "ir"
     HYBRID = "hy"
 
+class Materialization(Enum):
+    COPY = "copy"           # copy images and labels into the scratch directory
+    HARDLINK = "hardlink"   # hardlink them, falls back to copying across filesystems
+    SYMLINK = "symlink"     # symlink them
+    MANIFEST = "manifest"   # only write train.txt/val.txt image lists pointing at the originals, labels are read next to them
+
+def fold_source(frame_store: FrameStore | None = None, frame_source: FrameSource | None = None, label_index: LabelIndex | None = None) -> str:
+    """Names where the images and labels of a fold dataset come from, as part of its fold cache key."""
+    if frame_source is not None:
+        return "raw"
+    images = "store" if frame_store is not None else "files"
+    labels = "index" if label_index is not None else "files"
+    return f"{images}-{labels}"
+
+
 class TempTrainingContext:
-    def __init__(self, filepaths: list[str], modality: Modality, train_idx: list[int], test_idx: list[int]):
+    def __init__(self, filepaths: list[str], modality: Modality, train_idx: list[int], test_idx: list[int], frame_store: FrameStore | None = None, frame_source: FrameSource | None = None, label_index: LabelIndex | None = None, materialization: Materialization = Materialization.COPY, scratch_root: str | None = None, fold_cache: FoldCache | None = None, cache_key: str | None = None, hybrid_split: int | None = None):
+        if materialization != Materialization.COPY and (frame_store is not None or frame_source is not None):
+            raise ValueError(f"{materialization.value} materialization needs loose image files, frames from shards or raw videos can only be written.")
+        if materialization == Materialization.MANIFEST and label_index is not None:
+            raise ValueError("manifest materialization reads the label files next to the images and cannot use the label index.")
+        if fold_cache is not None and cache_key is None:
+            raise ValueError("A fold cache needs the cache key of the fold.")
+
         self.temp_dir = None
+        self.materialization = materialization
+        self.scratch_root = scratch_root # parent of the temporary dataset, on the dataset's filesystem for hardlinks
+        self.fold_cache = fold_cache # keep the dataset in a persistent cache under cache_key instead of a temporary directory
+        self.cache_key = cache_key
+        self.cached = False
+        self.setup_time_ms = None
+        self.label_index = label_index # write labels from the label index instead of copying label files
+        self.frame_store = frame_store # read images from packed shards instead of loose files
+        self.frame_source = frame_source # decode images and labels from the raw videos instead of loose files
         self.filepaths = filepaths
         self.modality = modality
         self.train_idx = train_idx
@@ -22,47 +61,104 @@ class TempTrainingContext:
         elif modality == Modality.INFRARED:
             self.img_filepaths = [path.replace("vz", "ir") for path in self.filepaths]        
         elif modality == Modality.HYBRID:
-            split_idx = int(len(filepaths)/2)
-            self.img_filepaths = self.filepaths[:split_idx] + [path.replace("vz", "ir") for path in self.filepaths[split_idx:]]   
+            # Split files store the split point, appending frames to an existing split file must not move it
+            split_idx = hybrid_split if hybrid_split is not None else int(len(filepaths)/2)
+            self.img_filepaths = list(self.filepaths[:split_idx]) + [path.replace("vz", "ir") for path in self.filepaths[split_idx:]]   
 
         self.label_filepaths = [path.replace("images", "labels").replace(".jpg", ".txt") for path in self.img_filepaths]
 
+    def link(self, source: str, target: str) -> None:
+        """Places a file in the temporary dataset according to the materialization strategy."""
+        if self.materialization == Materialization.SYMLINK:
+            os.symlink(os.path.abspath(source), target)
+        elif self.materialization == Materialization.HARDLINK:
+            try:
+                os.link(source, target)
+            except OSError:
+                # Hardlinks cannot cross filesystems, put the scratch root next to the dataset to avoid the copies
+                self.materialization = Materialization.COPY
+                print(f"Warning: Could not hardlink {source} into the fold dataset, copying instead.")
+                shutil.copy2(source, target)
+        else:
+            shutil.copy2(source, target)
+
     def __enter__(self):
-        self.temp_dir = tempfile.mkdtemp()
+        start = time.perf_counter()
+        if self.fold_cache is not None:
+            self.temp_dir, self.cached = self.fold_cache.acquire(self.cache_key, self.build)
+        else:
+            if self.scratch_root is not None:
+                os.makedirs(self.scratch_root, exist_ok=True)
+            self.temp_dir = tempfile.mkdtemp(dir=self.scratch_root)
+            self.build(self.temp_dir)
 
-        dataset_name = self.temp_dir.split('/')[-1]
+        self.setup_time_ms = round((time.perf_counter() - start) * 1000)
+        return self.temp_dir
+
+    def build(self, dataset_dir: str) -> None:
+        """Writes the YOLO dataset of the fold with its cfg.yaml into an empty directory."""
+        split_targets = {}
 
         for split, idx in zip(["train", "val"],[self.train_idx, self.test_idx]):
 
-            split_images = [self.img_filepaths[i] for i in range(len(self.img_filepaths)) if i in idx]
-            split_labels = [self.label_filepaths[i] for i in range(len(self.label_filepaths)) if i in idx] 
+            # Boolean mask instead of a membership test per file, keeps the file order of the split file
+            mask = np.zeros(len(self.img_filepaths), dtype=bool)
+            mask[np.asarray(idx, dtype=np.int64)] = True
+            selected = np.flatnonzero(mask)
+
+            split_images = [self.img_filepaths[i] for i in selected]
+            split_labels = [self.label_filepaths[i] for i in selected]
+
+            if self.materialization == Materialization.MANIFEST:
+                # YOLO derives each label path from its image path, so the originals are used in place
+                list_filename = f"{split}.txt"
+                with open(os.path.join(dataset_dir, list_filename), "w") as f:
+                    f.writelines(os.path.abspath(img) + "\n" for img in split_images)
+                split_targets[split] = list_filename
+                continue
+            split_targets[split] = split
 
-            images_dir = os.path.join(self.temp_dir, split, "images")
-            labels_dir = os.path.join(self.temp_dir, split, "labels")
+            images_dir = os.path.join(dataset_dir, split, "images")
+            labels_dir = os.path.join(dataset_dir, split, "labels")
 
             os.makedirs(images_dir)
             os.makedirs(labels_dir)
 
+            if self.frame_source is not None:
+                self.frame_source.materialize_many(
+                    split_images,
+                    [os.path.join(images_dir, img.split('/')[-1]) for img in split_images],
+                    [os.path.join(labels_dir, lbl.split('/')[-1]) for lbl in split_labels],
+                )
+                continue
+
             for img, lbl in zip(split_images, split_labels):
                 img_name = img.split('/')[-1]
                 lbl_name = lbl.split('/')[-1]
 
-                shutil.copy2(img, os.path.join(images_dir, img_name))
-                shutil.copy2(lbl, os.path.join(labels_dir, lbl_name))
+                if self.frame_store is not None:
+                    self.frame_store.materialize(img, os.path.join(images_dir, img_name))
+                else:
+                    self.link(img, os.path.join(images_dir, img_name))
+                if self.label_index is not None:
+                    with open(os.path.join(labels_dir, lbl_name), "w") as f:
+                        f.write(self.label_index.label(self.label_index.row(*parse_frame_filename(lbl))))
+                else:
+                    self.link(lbl, os.path.join(labels_dir, lbl_name))
 
         data = {
-            'path': self.temp_dir,
-            'train': 'train',
-            'val': 'val',
+            'path': dataset_dir,
+            'train': split_targets["train"],
+            'val': split_targets["val"],
             'names': [{0: 'uav'}]
         }
 
-        with open(os.path.join(self.temp_dir, 'cfg.yaml'), 'w') as outfile:
+        with open(os.path.join(dataset_dir, 'cfg.yaml'), 'w') as outfile:
             yaml.dump(data, outfile)
-
-        return self.temp_dir
     
     def __exit__(self, exc_type, exc_val, exc_tb):
-        if self.temp_dir and os.path.exists(self.temp_dir):
+        if self.fold_cache is not None:
+            self.fold_cache.release(self.cache_key)
+        elif self.temp_dir and os.path.exists(self.temp_dir):
             import shutil
             shutil.rmtree(self.temp_dir)
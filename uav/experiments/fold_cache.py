@@ -0,0 +1,173 @@
+import os
+import json
+import time
+import shutil
+import hashlib
+from contextlib import contextmanager
+from typing import Callable, Iterator
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+
+CACHE_INDEX_FILENAME = "index.json"
+CACHE_LOCK_FILENAME = ".lock"
+BUILD_POLL_SECONDS = 1.0
+
+
+def file_digest(filepath: str) -> str:
+    """Returns the content hash of a file, e.g. of a split file, or of the names and contents of the files in a split directory."""
+    filepaths = [os.path.join(filepath, name) for name in sorted(os.listdir(filepath))] if os.path.isdir(filepath) else [filepath]
+    digest = hashlib.blake2b(digest_size=16)
+    for path in filepaths:
+        if os.path.isdir(filepath):
+            digest.update(os.path.basename(path).encode())
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(1 << 20), b""):
+                digest.update(chunk)
+    return digest.hexdigest()
+
+def fold_key(split_hash: str, fold: int, modality_str: str, materialization_str: str, source_str: str) -> str:
+    """Cache key of a materialized fold dataset. Datasets of other materializations or image and label sources differ in content
+    (e.g. a manifest only lists the loose files), so they are cached apart."""
+    return f"{split_hash}-f{fold}-{modality_str}-{materialization_str}-{source_str}"
+
+def directory_size(directory: str) -> int:
+    """Returns the bytes used by the regular files below a directory, links are not followed."""
+    size = 0
+    for root, _, files in os.walk(directory):
+        for name in files:
+            path = os.path.join(root, name)
+            if not os.path.islink(path):
+                size += os.stat(path).st_size
+    return size
+
+def pid_alive(pid: int) -> bool:
+    """Returns whether a process of this host is still running."""
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+class FoldCache:
+    """Persistent cache of materialized fold datasets, shared by all model seeds and runs on a host.
+
+    Entries are directories named by their key. The index tracks per entry the processes holding it, its size and last use.
+    Once the cache exceeds max_bytes, unused entries are evicted least recently used first. Everything written into an
+    entry while it is held, like the labels.cache of ultralytics, is kept with it. All index updates are serialized by a lock file,
+    so that several training processes can share one cache."""
+    def __init__(self, cache_dir: str, max_bytes: int):
+        self.cache_dir = os.path.abspath(cache_dir)
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+    def entry_dir(self, key: str) -> str:
+        """Returns the directory of a cache entry."""
+        return os.path.join(self.cache_dir, key)
+
+    @contextmanager
+    def locked_index(self) -> Iterator[dict]:
+        """Yields the index under the cache lock and writes it back atomically."""
+        with open(os.path.join(self.cache_dir, CACHE_LOCK_FILENAME), "a") as lock:
+            if fcntl is not None:
+                fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                index_path = os.path.join(self.cache_dir, CACHE_INDEX_FILENAME)
+                index = {}
+                if os.path.exists(index_path):
+                    with open(index_path, "r") as f:
+                        index = json.load(f)
+
+                # Holders that died without releasing do not pin entries
+                for entry in index.values():
+                    entry["holders"] = [pid for pid in entry["holders"] if pid_alive(pid)]
+
+                yield index
+
+                tmp_path = f"{index_path}.tmp"
+                with open(tmp_path, "w") as f:
+                    json.dump(index, f, indent=4)
+                os.replace(tmp_path, index_path)
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def acquire(self, key: str, build: Callable[[str], None]) -> tuple[str, bool]:
+        """Returns the directory of an entry and whether it was cached, building it with build(directory) on a miss.
+        If another process is building the entry, waits for it. The entry is held until release(key)."""
+        directory = self.entry_dir(key)
+        while True:
+            with self.locked_index() as index:
+                entry = index.get(key)
+                if entry is not None and entry["complete"]:
+                    entry["holders"].append(os.getpid())
+                    entry["last_used"] = time.time()
+                    self.hits += 1
+                    return directory, True
+                if entry is None or not entry["holders"]:
+                    # Missing, or left incomplete by a crashed builder
+                    shutil.rmtree(directory, ignore_errors=True)
+                    index[key] = {"complete": False, "holders": [os.getpid()], "size": 0, "last_used": time.time()}
+                    break
+            time.sleep(BUILD_POLL_SECONDS)
+
+        self.misses += 1
+        try:
+            os.makedirs(directory)
+            build(directory)
+        except BaseException:
+            with self.locked_index() as index:
+                index.pop(key, None)
+            shutil.rmtree(directory, ignore_errors=True)
+            raise
+
+        size = directory_size(directory)
+        with self.locked_index() as index:
+            index[key].update(complete=True, size=size, last_used=time.time())
+            self.evict(index)
+        return directory, False
+
+    def release(self, key: str) -> None:
+        """Drops the hold of this process on an entry, updating its size with what was written into it meanwhile."""
+        size = directory_size(self.entry_dir(key))
+        with self.locked_index() as index:
+            entry = index.get(key)
+            if entry is None:
+                return
+            if os.getpid() in entry["holders"]:
+                entry["holders"].remove(os.getpid())
+            entry.update(size=size, last_used=time.time())
+            self.evict(index)
+
+    def evict(self, index: dict) -> list[str]:
+        """Removes unheld entries, least recently used first, until the cache fits max_bytes. Returns the evicted keys."""
+        total = sum(entry["size"] for entry in index.values())
+        evicted = []
+        for key in sorted((key for key, entry in index.items() if entry["complete"] and not entry["holders"]), key=lambda key: index[key]["last_used"]):
+            if total <= self.max_bytes:
+                break
+            total -= index[key]["size"]
+            shutil.rmtree(self.entry_dir(key), ignore_errors=True)
+            del index[key]
+            evicted.append(key)
+        return evicted
+
+    def size(self) -> int:
+        """Returns the bytes used by all entries as last recorded."""
+        with self.locked_index() as index:
+            return sum(entry["size"] for entry in index.values())
+
+    def clear(self) -> None:
+        """Removes all unheld entries."""
+        with self.locked_index() as index:
+            for key in [key for key, entry in index.items() if not entry["holders"]]:
+                shutil.rmtree(self.entry_dir(key), ignore_errors=True)
+                del index[key]
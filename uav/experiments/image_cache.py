@@ -0,0 +1,193 @@
+import os
+import json
+import math
+import shutil
+
+import cv2
+import numpy as np
+from tqdm import tqdm
+
+from uav.setup.frame_store import FrameStore, expand_channels, parse_frame_filename
+from uav.setup.frame_source import MODALITY_FILES, FrameSource
+from uav.setup.label_index import LabelIndex
+from uav.experiments.splits import load_folds
+
+
+IMAGE_CACHE_FORMAT = "uav-image-cache"
+IMAGE_CACHE_VERSION = 2 # 2: resized with INTER_LINEAR like ultralytics, version 1 used INTER_AREA for downscaling
+IMAGE_CACHE_META_FILENAME = "meta.json"
+IMAGE_CACHE_COLUMNS = ["names", "group", "row", "shape", "label_starts", "label_ends", "cls", "bboxes"]
+
+
+def resized_shape(height: int, width: int, imgsz: int) -> tuple[int, int]:
+    """Returns the (height, width) ultralytics resizes an image to before augmentation, the long side becomes imgsz."""
+    r = imgsz / max(height, width)
+    if r == 1:
+        return height, width
+    return min(math.ceil(height * r), imgsz), min(math.ceil(width * r), imgsz)
+
+def parse_label(label: str) -> tuple[np.ndarray, np.ndarray]:
+    """Parses YOLO label lines into float32 (n, 1) classes and (n, 4) normalized xywh boxes."""
+    values = np.array([line.split() for line in label.splitlines() if line.strip()], dtype=np.float32).reshape(-1, 5)
+    return values[:, :1], values[:, 1:]
+
+def sampled_image_paths(splits_filepath: str) -> list[str]:
+    """Returns the VZ and IR image paths of all frames of a split file, ordered by sequence, modality and frame."""
+    filepaths = load_folds(splits_filepath)[0]['filepaths']
+    image_paths = set()
+    for filepath in filepaths:
+        sequence, _, frame_idx = parse_frame_filename(filepath)
+        for modality_str in MODALITY_FILES:
+            image_paths.add(os.path.join(os.path.dirname(filepath), f"{sequence}-{modality_str}-{frame_idx:08d}.jpg"))
+    return sorted(image_paths, key=parse_frame_filename)
+
+def build_image_cache(
+    splits_filepath: str,
+    cache_dir: str,
+    imgsz: int = 640,
+    frame_store: FrameStore | None = None,
+    frame_source: FrameSource | None = None,
+    label_index: LabelIndex | None = None,
+) -> None:
+    """Decodes every VZ and IR image of a split file once, resized as ultralytics loads it, into one uint8 array per image shape,
+    and parses all labels. Images are read from the frame store, the raw videos or the loose files, labels from the label index,
+    the raw annotations or the label files. The cache is built next to cache_dir and renamed into place when complete."""
+    image_paths = sampled_image_paths(splits_filepath)
+    tmp_dir = f"{cache_dir}.tmp"
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    os.makedirs(tmp_dir)
+
+    groups = {} # resized shape : [group id, row count, open file]
+    columns = {name: [] for name in ["group", "row", "shape", "label_counts", "cls", "bboxes"]}
+    try:
+        for image_path in tqdm(image_paths, desc="Caching images"):
+            sequence, modality_str, frame_idx = parse_frame_filename(image_path)
+            if frame_source is not None:
+                image = frame_source.read(sequence, modality_str, frame_idx)
+                label = frame_source.label(sequence, modality_str, frame_idx)
+            else:
+                image = frame_store.read(sequence, modality_str, frame_idx, bgr=True) if frame_store is not None else cv2.imread(image_path)
+                if label_index is not None:
+                    label = label_index.label(label_index.row(sequence, modality_str, frame_idx))
+                else:
+                    with open(image_path.replace("images", "labels").replace(".jpg", ".txt"), "r") as f:
+                        label = f.read()
+            if image is None:
+                raise FileNotFoundError(f"Image {image_path} could not be read.")
+
+            image = expand_channels(image)
+            height, width = image.shape[:2]
+            target_height, target_width = resized_shape(height, width, imgsz)
+            if (target_height, target_width) != (height, width):
+                # BaseDataset.load_image resizes with INTER_LINEAR in both directions, so that cached runs stay pixel-identical
+                image = cv2.resize(image, (target_width, target_height), interpolation=cv2.INTER_LINEAR)
+
+            if image.shape not in groups:
+                groups[image.shape] = [len(groups), 0, open(os.path.join(tmp_dir, f"images-{len(groups)}.u8"), "wb")]
+            group = groups[image.shape]
+            group[2].write(np.ascontiguousarray(image).tobytes())
+
+            cls, bboxes = parse_label(label)
+            columns["group"].append(group[0])
+            columns["row"].append(group[1])
+            columns["shape"].append((height, width))
+            columns["label_counts"].append(len(cls))
+            columns["cls"].append(cls)
+            columns["bboxes"].append(bboxes)
+            group[1] += 1
+    finally:
+        for _, _, f in groups.values():
+            f.close()
+
+    label_offsets = np.zeros(len(image_paths) + 1, dtype=np.int64)
+    label_offsets[1:] = np.cumsum(columns["label_counts"])
+    names = np.array([os.path.basename(image_path) for image_path in image_paths])
+
+    # Rows sorted by file name, so that attaching needs no dictionary; labels stay in image path order
+    order = np.argsort(names)
+    arrays = {
+        "names": names[order],
+        "group": np.asarray(columns["group"], dtype=np.int16)[order],
+        "row": np.asarray(columns["row"], dtype=np.int32)[order],
+        "shape": np.asarray(columns["shape"], dtype=np.int32).reshape(-1, 2)[order],
+        "label_starts": label_offsets[:-1][order],
+        "label_ends": label_offsets[1:][order],
+        "cls": np.concatenate(columns["cls"]) if columns["cls"] else np.empty((0, 1), dtype=np.float32),
+        "bboxes": np.concatenate(columns["bboxes"]) if columns["bboxes"] else np.empty((0, 4), dtype=np.float32),
+    }
+    for name in IMAGE_CACHE_COLUMNS:
+        np.save(os.path.join(tmp_dir, f"{name}.npy"), arrays[name])
+
+    with open(os.path.join(tmp_dir, IMAGE_CACHE_META_FILENAME), "w") as f:
+        json.dump({
+            "format": IMAGE_CACHE_FORMAT,
+            "version": IMAGE_CACHE_VERSION,
+            "imgsz": imgsz,
+            "splits": os.path.abspath(splits_filepath),
+            "groups": [{"file": f"images-{group_id}.u8", "shape": list(shape), "count": count} for shape, (group_id, count, _) in sorted(groups.items(), key=lambda item: item[1][0])],
+        }, f, indent=4)
+
+    shutil.rmtree(cache_dir, ignore_errors=True)
+    os.replace(tmp_dir, cache_dir)
+
+def is_image_cache(cache_dir: str) -> bool:
+    """Returns whether a directory holds a complete image cache of the current version, older ones have to be rebuilt."""
+    meta_path = os.path.join(cache_dir, IMAGE_CACHE_META_FILENAME)
+    if not os.path.exists(meta_path):
+        return False
+    with open(meta_path, "r") as f:
+        meta = json.load(f)
+    return meta.get("format") == IMAGE_CACHE_FORMAT and meta.get("version") == IMAGE_CACHE_VERSION
+
+
+class ImageCache:
+    """Read-only view of an image cache. The image arrays are memory-mapped, so any number of processes attaching to the
+    same cache share one copy in the page cache. Pickling only carries the path, unpickled instances attach again."""
+    def __init__(self, cache_dir: str):
+        self.cache_dir = cache_dir
+        with open(os.path.join(cache_dir, IMAGE_CACHE_META_FILENAME), "r") as f:
+            self.meta = json.load(f)
+        if self.meta.get("format") != IMAGE_CACHE_FORMAT or self.meta["version"] != IMAGE_CACHE_VERSION:
+            raise ValueError(f"'{cache_dir}' is not a supported image cache, rebuild it with build_image_cache.")
+        self.imgsz = self.meta["imgsz"]
+
+        self.images = [
+            np.memmap(os.path.join(cache_dir, group["file"]), dtype=np.uint8, mode="r", shape=(group["count"], *group["shape"]))
+            for group in self.meta["groups"]
+        ]
+        self.names = np.load(os.path.join(cache_dir, "names.npy"))
+        for name in IMAGE_CACHE_COLUMNS[1:]:
+            setattr(self, name, np.load(os.path.join(cache_dir, f"{name}.npy"), mmap_mode="r"))
+
+    def __len__(self) -> int:
+        return len(self.names)
+
+    def __getstate__(self) -> dict:
+        return {"cache_dir": self.cache_dir}
+
+    def __setstate__(self, state: dict) -> None:
+        self.__init__(state["cache_dir"])
+
+    def __contains__(self, filepath: str) -> bool:
+        i = int(np.searchsorted(self.names, os.path.basename(filepath)))
+        return i < len(self.names) and self.names[i] == os.path.basename(filepath)
+
+    def index(self, filepath: str) -> int:
+        """Returns the cache row of an image path, only its file name is used."""
+        name = os.path.basename(filepath)
+        i = int(np.searchsorted(self.names, name))
+        if i >= len(self.names) or self.names[i] != name:
+            raise KeyError(f"{name} is not in the image cache.")
+        return i
+
+    def load_image(self, filepath: str) -> tuple[np.ndarray, tuple[int, int], tuple[int, int]]:
+        """Returns the resized image as read-only view into the cache, its original and its resized (height, width), like ultralytics' load_image."""
+        i = self.index(filepath)
+        image = self.images[self.group[i]][self.row[i]]
+        return image, (int(self.shape[i, 0]), int(self.shape[i, 1])), image.shape[:2]
+
+    def labels(self, filepath: str) -> tuple[np.ndarray, np.ndarray]:
+        """Returns the (n, 1) classes and (n, 4) normalized xywh boxes of an image."""
+        i = self.index(filepath)
+        start, end = self.label_starts[i], self.label_ends[i]
+        return np.array(self.cls[start:end]), np.array(self.bboxes[start:end])
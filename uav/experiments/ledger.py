@@ -0,0 +1,239 @@
+import os
+import csv
+import json
+import time
+import socket
+import sqlite3
+import hashlib
+from contextlib import contextmanager
+from dataclasses import dataclass
+from typing import Iterator
+
+from uav.experiments.data import Modality
+from uav.experiments.fold_cache import pid_alive
+
+
+LEDGER_VERSION = 1
+MODALITY_ORDER = [Modality.VISIBLE, Modality.INFRARED, Modality.HYBRID]
+METRICS_HEADER = ["experiment_name", "precision", "recall", "mAP50", "mAP50-95", "training_time_ms", "eval_time_ms"]
+JOB_STATES = ["pending", "running", "done", "failed"]
+METRIC_COLUMNS = ["precision", "recall", "map50", "map50_95", "training_time_ms", "eval_time_ms"]
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS jobs (
+    modality TEXT NOT NULL,
+    model_seed INTEGER NOT NULL,
+    fold INTEGER NOT NULL,
+    split_idx INTEGER NOT NULL,
+    sort_order INTEGER NOT NULL,
+    priority INTEGER NOT NULL,
+    active INTEGER NOT NULL DEFAULT 1,
+    config_hash TEXT NOT NULL,
+    state TEXT NOT NULL DEFAULT 'pending' CHECK (state IN ('pending', 'running', 'done', 'failed')),
+    worker TEXT,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    claimed_at REAL,
+    finished_at REAL,
+    error TEXT,
+    precision TEXT,
+    recall TEXT,
+    map50 TEXT,
+    map50_95 TEXT,
+    training_time_ms INTEGER,
+    eval_time_ms INTEGER,
+    PRIMARY KEY (modality, model_seed, fold)
+);
+"""
+
+
+@dataclass(frozen=True)
+class Job():
+    """A single training run, identified independently of the worker that runs it."""
+    modality: str       # Modality value
+    model_seed: int
+    split_idx: int      # position in the split file
+    fold: int
+
+    @property
+    def experiment_name(self) -> str:
+        return "%s-%s" % (self.modality, self.model_seed)
+
+def campaign_jobs(splits: list[dict], model_seeds: list[int]) -> list[Job]:
+    """Returns all runs of a campaign in the order of run_experiments, which is the row order uav.evaluation expects."""
+    return [
+        Job(modality.value, int(model_seed), split_idx, int(split['fold']))
+        for modality in MODALITY_ORDER
+        for model_seed in model_seeds
+        for split_idx, split in enumerate(splits)
+    ]
+
+def job_config_hash(split_hash: str, epochs: int, model_weight_path: str, job: Job, imgsz: int = 640) -> str:
+    """Hash of everything a run's result depends on, a changed hash invalidates a finished run."""
+    config = {"splits": split_hash, "epochs": epochs, "weights": os.path.basename(model_weight_path), "imgsz": imgsz, "modality": job.modality, "seed": job.model_seed, "fold": job.fold}
+    return hashlib.blake2b(json.dumps(config, sort_keys=True).encode(), digest_size=16).hexdigest()
+
+def worker_name() -> str:
+    """Identifies the calling process as '<host>:<pid>'."""
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+class RunLedger:
+    """Transactional record of the runs of a campaign in a SQLite database: state (pending/running/done/failed), config hash,
+    worker, attempts, metrics and timings per job. Every process opens its own connection; claims take the database write
+    lock, so that concurrent workers never claim the same job."""
+    def __init__(self, ledger_path: str, timeout: float = 60.0):
+        self.ledger_path = ledger_path
+        self.connection = sqlite3.connect(ledger_path, timeout=timeout, isolation_level=None)
+        self.connection.row_factory = sqlite3.Row
+        with self.transaction() as cursor:
+            for statement in SCHEMA.split(";"):
+                if statement.strip():
+                    cursor.execute(statement)
+            cursor.execute("INSERT OR IGNORE INTO meta (key, value) VALUES ('version', ?)", (str(LEDGER_VERSION),))
+            version = int(cursor.execute("SELECT value FROM meta WHERE key = 'version'").fetchone()[0])
+        if version > LEDGER_VERSION:
+            raise ValueError(f"Ledger version {version} is newer than the supported version {LEDGER_VERSION}.")
+
+    @contextmanager
+    def transaction(self) -> Iterator[sqlite3.Cursor]:
+        """Runs statements in one write transaction, taking the write lock up front."""
+        cursor = self.connection.cursor()
+        cursor.execute("BEGIN IMMEDIATE")
+        try:
+            yield cursor
+        except BaseException:
+            cursor.execute("ROLLBACK")
+            raise
+        cursor.execute("COMMIT")
+
+    def close(self) -> None:
+        self.connection.close()
+
+    def register(self, jobs: list[Job], config_hashes: list[str], priorities: list[int] | None = None) -> None:
+        """Registers the jobs of a campaign in their export order. Jobs run by ascending priority (their order by default).
+        Finished jobs whose config hash changed and failed jobs are reset to pending, jobs not listed are no longer exported."""
+        priorities = priorities if priorities is not None else list(range(len(jobs)))
+        with self.transaction() as cursor:
+            cursor.execute("UPDATE jobs SET active = 0")
+            for sort_order, (job, config_hash, priority) in enumerate(zip(jobs, config_hashes, priorities)):
+                key = (job.modality, job.model_seed, job.fold)
+                existing = cursor.execute("SELECT config_hash, state FROM jobs WHERE modality = ? AND model_seed = ? AND fold = ?", key).fetchone()
+                if existing is None:
+                    cursor.execute(
+                        "INSERT INTO jobs (modality, model_seed, fold, split_idx, sort_order, priority, config_hash) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                        (*key, job.split_idx, sort_order, priority, config_hash),
+                    )
+                    continue
+
+                reset = existing["config_hash"] != config_hash or existing["state"] == "failed"
+                cursor.execute(
+                    "UPDATE jobs SET split_idx = ?, sort_order = ?, priority = ?, active = 1, config_hash = ? WHERE modality = ? AND model_seed = ? AND fold = ?",
+                    (job.split_idx, sort_order, priority, config_hash, *key),
+                )
+                if reset:
+                    self.reset(cursor, key)
+
+    def reset(self, cursor: sqlite3.Cursor, key: tuple) -> None:
+        """Puts a job back to pending and drops its results."""
+        cursor.execute(
+            f"UPDATE jobs SET state = 'pending', worker = NULL, error = NULL, finished_at = NULL, {', '.join(f'{column} = NULL' for column in METRIC_COLUMNS)} WHERE modality = ? AND model_seed = ? AND fold = ?",
+            key,
+        )
+
+    def recover(self) -> list[Job]:
+        """Puts running jobs of dead processes on this host back to pending, e.g. after a crash. Returns the recovered jobs."""
+        host = socket.gethostname()
+        recovered = []
+        with self.transaction() as cursor:
+            for row in cursor.execute("SELECT modality, model_seed, fold, split_idx, worker FROM jobs WHERE state = 'running'").fetchall():
+                worker_host, _, pid = (row["worker"] or "").rpartition(":")
+                if worker_host == host and pid.isdigit() and not pid_alive(int(pid)):
+                    self.reset(cursor, (row["modality"], row["model_seed"], row["fold"]))
+                    recovered.append(Job(row["modality"], row["model_seed"], row["split_idx"], row["fold"]))
+        return recovered
+
+    def claim(self, worker: str | None = None) -> Job | None:
+        """Atomically marks the pending job with the lowest priority as running by a worker and returns it, None if none is left."""
+        with self.transaction() as cursor:
+            row = cursor.execute("SELECT modality, model_seed, fold, split_idx FROM jobs WHERE state = 'pending' AND active = 1 ORDER BY priority, sort_order LIMIT 1").fetchone()
+            if row is None:
+                return None
+            cursor.execute(
+                "UPDATE jobs SET state = 'running', worker = ?, claimed_at = ?, attempts = attempts + 1 WHERE modality = ? AND model_seed = ? AND fold = ?",
+                (worker if worker is not None else worker_name(), time.time(), row["modality"], row["model_seed"], row["fold"]),
+            )
+        return Job(row["modality"], row["model_seed"], row["split_idx"], row["fold"])
+
+    def complete(self, job: Job, result_row: list) -> None:
+        """Records the metrics row of a finished job as returned by run_fold."""
+        _, precision, recall, map50, map50_95, training_time_ms, eval_time_ms = result_row
+        with self.transaction() as cursor:
+            cursor.execute(
+                "UPDATE jobs SET state = 'done', finished_at = ?, error = NULL, precision = ?, recall = ?, map50 = ?, map50_95 = ?, training_time_ms = ?, eval_time_ms = ? WHERE modality = ? AND model_seed = ? AND fold = ?",
+                (time.time(), str(precision), str(recall), str(map50), str(map50_95), int(training_time_ms), int(eval_time_ms), job.modality, job.model_seed, job.fold),
+            )
+
+    def fail(self, job: Job, error: str) -> None:
+        """Records a failed job, it is retried on the next registration."""
+        with self.transaction() as cursor:
+            cursor.execute("UPDATE jobs SET state = 'failed', finished_at = ?, error = ? WHERE modality = ? AND model_seed = ? AND fold = ?", (time.time(), error, job.modality, job.model_seed, job.fold))
+
+    def release(self, job: Job) -> None:
+        """Puts a claimed job back to pending without results, e.g. when its run was cancelled."""
+        with self.transaction() as cursor:
+            self.reset(cursor, (job.modality, job.model_seed, job.fold))
+
+    def counts(self) -> dict[str, int]:
+        """Returns the amount of active jobs per state."""
+        counts = dict(self.connection.execute("SELECT state, COUNT(*) FROM jobs WHERE active = 1 GROUP BY state").fetchall())
+        return {state: counts.get(state, 0) for state in JOB_STATES}
+
+    def jobs(self, state: str | None = None) -> list[sqlite3.Row]:
+        """Returns the rows of the active jobs in export order, optionally of one state only."""
+        if state is None:
+            return self.connection.execute("SELECT * FROM jobs WHERE active = 1 ORDER BY sort_order").fetchall()
+        return self.connection.execute("SELECT * FROM jobs WHERE active = 1 AND state = ? ORDER BY sort_order", (state,)).fetchall()
+
+    def result_rows(self) -> list[list]:
+        """Returns the metrics rows of the finished jobs in export order."""
+        return [
+            ["%s-%s" % (row["modality"], row["model_seed"]), row["precision"], row["recall"], row["map50"], row["map50_95"], row["training_time_ms"], row["eval_time_ms"]]
+            for row in self.jobs("done")
+        ]
+
+    def export_metrics(self, metrics_file_txt: str) -> int:
+        """Writes the metrics csv of all finished jobs, ordered by modality, seed and fold as uav.evaluation expects.
+        The file is replaced atomically, so concurrent exports never interleave rows. Returns the amount of rows."""
+        rows = self.result_rows()
+        tmp_path = f"{metrics_file_txt}.{os.getpid()}.tmp"
+        with open(tmp_path, "w", newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(METRICS_HEADER)
+            writer.writerows(rows)
+        os.replace(tmp_path, metrics_file_txt)
+        return len(rows)
+
+    def import_metrics(self, metrics_file_txt: str) -> int:
+        """Marks registered jobs as done from a metrics csv of the sequential runner, whose rows of an experiment are in fold order.
+        Returns the amount of imported rows."""
+        with open(metrics_file_txt, "r", newline='') as f:
+            rows = list(csv.reader(f))[1:]
+
+        imported, seen = 0, {}
+        with self.transaction() as cursor:
+            for row in rows:
+                experiment_name = row[0]
+                split_idx = seen.get(experiment_name, 0)
+                seen[experiment_name] = split_idx + 1
+
+                modality, model_seed = experiment_name.split("-")
+                updated = cursor.execute(
+                    "UPDATE jobs SET state = 'done', finished_at = ?, error = NULL, precision = ?, recall = ?, map50 = ?, map50_95 = ?, training_time_ms = ?, eval_time_ms = ? WHERE modality = ? AND model_seed = ? AND split_idx = ? AND active = 1 AND state != 'done'",
+                    (time.time(), *row[1:5], int(row[5]), int(row[6]), modality, int(model_seed), split_idx),
+                ).rowcount
+                imported += updated
+        return imported
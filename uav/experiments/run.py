@@ -1,93 +1,222 @@
 import os
 import csv
+import json
 import shutil
+import hashlib
 import time
 
 import numpy as np
 import pandas as pd
 
-from uav.experiments.data import TempTrainingContext, Modality
+from uav.experiments.data import TempTrainingContext, Modality, Materialization, fold_source
+from uav.experiments.fold_cache import FoldCache, file_digest, fold_key
+from uav.experiments.splits import load_folds
+from uav.experiments.image_cache import ImageCache, build_image_cache, is_image_cache
+from uav.experiments.cached_training import cached_trainer, cached_validator
+from uav.experiments.ledger import METRICS_HEADER, RunLedger, campaign_jobs, job_config_hash
+from uav.experiments.shared_queue import SharedQueue
+from uav.setup.frame_store import FrameStore
+from uav.setup.frame_source import FrameSource
+from uav.setup.label_index import LabelIndex, load_label_index
 
 from ultralytics import YOLO # type: ignore
 
 
+RUN_METADATA_FILENAME = "run.json"
+RESULT_METRICS = [
+    'metrics/precision(B)',
+    'metrics/recall(B)',
+    'metrics/mAP50(B)',
+    'metrics/mAP50-95(B)'
+]
+
+
 def current_milli_time() -> int:
     """Returns current time in milliseconds."""
     return round(time.time() * 1000)
 
-# run 5x5 fold rskf for single seed
-def run_repeated_k_fold(model_seed: int, splits: list, experiment_name: str, epochs: int, model_weight_path: str, run_dir: str):
-    """Trains and evaluates YOLO model on all RSKF splits, yielding metrics for each fold."""
-    for split in splits:
-        fold = split['fold']
-        print(f"Processing fold {fold}")
-        
-        def exp_name(template: str, fold_idx: str, ending: str) -> str:
-            """Generates experiment name with fold index and train/val suffix."""
-            return "%s-f_%s_%s" % (template, fold_idx, ending)
-        
-        expname_train = exp_name(experiment_name, fold, "train")
-        expname_val = exp_name(experiment_name, fold, "val")
+def fold_run_paths(run_dir: str, experiment_name: str, fold: int) -> tuple[str, str]:
+    """Returns the ultralytics train and val run directories of a fold."""
+    def exp_name(template: str, fold_idx: str, ending: str) -> str:
+        """Generates experiment name with fold index and train/val suffix."""
+        return "%s-f_%s_%s" % (template, fold_idx, ending)
 
-        tpath = os.path.join(run_dir, expname_train)
-        vpath = os.path.join(run_dir, expname_val)
+    return os.path.join(run_dir, exp_name(experiment_name, fold, "train")), os.path.join(run_dir, exp_name(experiment_name, fold, "val"))
 
-        if os.path.exists(os.path.join(tpath, "results.csv")) and os.path.exists(os.path.join(vpath, "predictions.json")):
-            continue
-        elif os.path.exists(tpath) or os.path.exists(vpath):
-            if os.path.exists(tpath):
-                try:
-                    shutil.rmtree(tpath)
-                except OSError as e:
-                    print(f"Warning: Could not remove {tpath}: {e}")
-            if os.path.exists(vpath):
-                try:
-                    shutil.rmtree(vpath)
-                except OSError as e:
-                    print(f"Warning: Could not remove {vpath}: {e}")
+def fold_completed(run_dir: str, experiment_name: str, fold: int) -> bool:
+    """Returns whether training and evaluation of a fold finished."""
+    tpath, vpath = fold_run_paths(run_dir, experiment_name, fold)
+    return os.path.exists(os.path.join(tpath, "results.csv")) and os.path.exists(os.path.join(vpath, "predictions.json"))
+
+def remove_run_dir(path: str) -> None:
+    """Removes an ultralytics run directory, warning if that fails."""
+    if os.path.exists(path):
+        try:
+            shutil.rmtree(path)
+        except OSError as e:
+            print(f"Warning: Could not remove {path}: {e}")
+
+def split_data_hash(split: dict) -> str:
+    """Hash of the train and test images of a split, identical data gives an identical hash."""
+    filepaths = np.asarray(split['filepaths'])
+    digest = hashlib.blake2b(digest_size=16)
+    for idx in [split['train_idx'], split['test_idx']]:
+        digest.update("\n".join(filepaths[np.asarray(idx)].tolist()).encode())
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+def read_run_metadata(tpath: str) -> dict | None:
+    """Returns the run metadata of a train run directory, None if it has none."""
+    metadata_path = os.path.join(tpath, RUN_METADATA_FILENAME)
+    if not os.path.exists(metadata_path):
+        return None
+    with open(metadata_path, "r") as f:
+        return json.load(f)
+
+def write_run_metadata(tpath: str, metadata: dict) -> None:
+    """Writes the run metadata of a train run directory atomically."""
+    metadata_path = os.path.join(tpath, RUN_METADATA_FILENAME)
+    with open(f"{metadata_path}.tmp", "w") as f:
+        json.dump(metadata, f, indent=4)
+    os.replace(f"{metadata_path}.tmp", metadata_path)
+
+def completed_epochs(tpath: str) -> int:
+    """Returns the last epoch logged in a train run's results.csv, 0 if none."""
+    results_path = os.path.join(tpath, "results.csv")
+    if not os.path.exists(results_path):
+        return 0
+    df = pd.read_csv(results_path)
+    df.columns = df.columns.str.strip()
+    return int(df["epoch"].max()) if not df.empty else 0
+
+def check_results(df: pd.DataFrame, epochs: int, results_path: str) -> None:
+    """Confirms that a train run's results.csv holds the metric columns of the metrics file and reached the last epoch."""
+    missing = [metric for metric in RESULT_METRICS if metric not in df.columns]
+    if missing:
+        raise ValueError(f"{results_path} lacks the columns {missing}.")
+    if df.empty or ("epoch" in df.columns and int(df["epoch"].max()) != epochs):
+        raise ValueError(f"{results_path} ends before epoch {epochs}.")
+
+def run_fold(model_seed: int, split: dict, experiment_name: str, epochs: int, model_weight_path: str, run_dir: str, frame_store: FrameStore | None = None, frame_source: FrameSource | None = None, label_index: LabelIndex | None = None, materialization: Materialization = Materialization.COPY, scratch_root: str | None = None, fold_cache: FoldCache | None = None, split_hash: str | None = None, image_cache: ImageCache | None = None, device: str = "mps", skip_completed: bool = True) -> list | None:
+    """Trains and evaluates YOLO model on a single RSKF split, returning its metrics row or None if it was already completed.
+    With a fold_cache, the fold dataset is kept under the split_hash for the other seeds and modalities.
+    With an image_cache, the fold is only an image list and ultralytics reads the pre-decoded images and labels from the cache.
+    Without skip_completed, the fold always runs again, e.g. when a ledger decides which runs are completed.
+    An interrupted training of the same seed, epochs, weights and data is resumed from its last.pt instead of started over,
+    and an interrupted evaluation of a finished training only evaluates again. Resumes are recorded in the run's run.json,
+    and the training time of the row sums up all attempts."""
+    fold = split['fold']
+    print(f"Processing fold {fold}")
+
+    tpath, vpath = fold_run_paths(run_dir, experiment_name, fold)
+    expname_train, expname_val = os.path.basename(tpath), os.path.basename(vpath)
+    config = {
+        "experiment_name": experiment_name,
+        "model_seed": model_seed,
+        "fold": int(fold),
+        "epochs": epochs,
+        "weights": os.path.basename(model_weight_path),
+        "data": split_data_hash(split),
+    }
+
+    if fold_completed(run_dir, experiment_name, fold):
+        if skip_completed:
+            return None
+        remove_run_dir(tpath)
+    metadata = read_run_metadata(tpath)
+    last_checkpoint = os.path.join(tpath, "weights", "last.pt")
+    if metadata is None or metadata["config"] != config or not os.path.exists(last_checkpoint):
+        remove_run_dir(tpath)
+        metadata = {"config": config, "attempts": []}
+    remove_run_dir(vpath)
+
+    resume_epoch = completed_epochs(tpath) if metadata["attempts"] else 0
+    # Also when it ended after the last epoch but before train returned, ultralytics refuses to resume a finished training
+    training_finished = any(previous["training_finished"] for previous in metadata["attempts"]) or (bool(metadata["attempts"]) and resume_epoch >= epochs)
+    if resume_epoch:
+        print(f"Resuming {experiment_name} fold {fold} after epoch {resume_epoch}{', evaluation only' if training_finished else ''}.")
+    attempt = {"started_at": time.time(), "resumed_from_epoch": resume_epoch or None, "training_time_ms": 0, "training_finished": training_finished}
+    metadata["attempts"].append(attempt)
+    os.makedirs(tpath, exist_ok=True)
+    write_run_metadata(tpath, metadata)
+    
+    modality = Modality.VISIBLE
+    if image_cache is not None:
+        # The lists only name the images, nothing is read from the listed paths
+        cache_key = fold_key(split_hash, fold, modality.value, Materialization.MANIFEST.value, fold_source()) if fold_cache is not None else None
+        context = TempTrainingContext(split['filepaths'], modality, split['train_idx'], split['test_idx'], materialization=Materialization.MANIFEST, scratch_root=scratch_root, fold_cache=fold_cache, cache_key=cache_key, hybrid_split=split.get('hybrid_split'))
+    else:
+        cache_key = fold_key(split_hash, fold, modality.value, materialization.value, fold_source(frame_store, frame_source, label_index)) if fold_cache is not None else None
+        context = TempTrainingContext(split['filepaths'], modality, split['train_idx'], split['test_idx'], frame_store, frame_source, label_index, materialization, scratch_root, fold_cache, cache_key, split.get('hybrid_split'))
+    with context as temp_ctx:
+        print(f"Fold {fold} setup took {context.setup_time_ms} ms ({context.materialization.value}{', cached' if context.cached else ''}).")
+
+        cfg = os.path.join(temp_ctx, "cfg.yaml")
+        trainer = cached_trainer(image_cache) if image_cache is not None else None
+
+        print("Running", experiment_name, "...")
+        pre_train_timestamp = current_milli_time()
+
+        def record_training_time(*_) -> None:
+            """Records the elapsed training time of this attempt, so that a killed attempt still counts up to its last epoch."""
+            attempt["training_time_ms"] = current_milli_time() - pre_train_timestamp
+            write_run_metadata(tpath, metadata)
+
+        if training_finished:
+            model = YOLO(os.path.join(tpath, "weights", "best.pt"))
+        else:
+            # The checkpoint carries the seed and all other train arguments; the fold's data is materialized anew
+            model = YOLO(last_checkpoint if resume_epoch else model_weight_path)
+            model.add_callback("on_fit_epoch_end", record_training_time)
+            try:
+                if resume_epoch:
+                    model.train(data=cfg, device=device, resume=True, trainer=trainer)
+                else:
+                    model.train(
+                        data=cfg, 
+                        epochs=epochs,  
+                        imgsz=640,  
+                        device=device,  
+                        seed=model_seed,
+                        name=expname_train,
+                        project=run_dir,
+                        exist_ok=True, # holds run.json already
+                        trainer=trainer,
+                    )
+                attempt["training_finished"] = True
+            finally:
+                record_training_time()
+        post_train_timestamp = current_milli_time()
+        model.val(
+            data=cfg,
+            imgsz=640,
+            device=device,
+            seed=model_seed,
+            name=expname_val,
+            project=run_dir,
+            save_json=True,
+            validator=cached_validator(image_cache) if image_cache is not None else None,
+        )   
+        post_eval_timestamp = current_milli_time()
+
+        results_path = os.path.join(tpath, "results.csv")
+        df = pd.read_csv(results_path)
+        df.columns = df.columns.str.strip()
+        check_results(df, epochs, results_path)
+        last_row = df.iloc[-1]
         
-        with TempTrainingContext(split['filepaths'], Modality.VISIBLE, split['train_idx'], split['test_idx']) as temp_ctx:
-
-            cfg = os.path.join(temp_ctx, "cfg.yaml")
-            model = YOLO(model_weight_path)
-
-            print("Running", experiment_name, "...")
-            pre_train_timestamp = current_milli_time()
-            model.train(
-                data=cfg, 
-                epochs=epochs,  
-                imgsz=640,  
-                device="mps",  
-                seed=model_seed,
-                name=expname_train,
-                project=run_dir,
-            )
-            post_train_timestamp = current_milli_time()
-            model.val(
-                data=cfg,
-                imgsz=640,
-                device="mps",
-                seed=model_seed,
-                name=expname_val,
-                project=run_dir,
-                save_json=True
-            )   
-            post_eval_timestamp = current_milli_time()
-
-            df = pd.read_csv(os.path.join(tpath, "results.csv"))
-            last_row = df.iloc[-1]
-
-            metrics = [
-                'metrics/precision(B)',
-                'metrics/recall(B)',
-                'metrics/mAP50(B)',
-                'metrics/mAP50-95(B)'
-            ]
-            
-            metric_values = [f"{last_row[metric]:.6f}" for metric in metrics]
-            training_time_ms = post_train_timestamp - pre_train_timestamp
-            eval_time_ms = post_eval_timestamp - post_train_timestamp
-            yield [experiment_name] + metric_values + [training_time_ms, eval_time_ms]
+        metric_values = [f"{last_row[metric]:.6f}" for metric in RESULT_METRICS]
+        training_time_ms = sum(previous["training_time_ms"] for previous in metadata["attempts"])
+        eval_time_ms = post_eval_timestamp - post_train_timestamp
+        return [experiment_name] + metric_values + [training_time_ms, eval_time_ms]
+
+# run 5x5 fold rskf for single seed
+def run_repeated_k_fold(model_seed: int, splits: list, experiment_name: str, epochs: int, model_weight_path: str, run_dir: str, frame_store: FrameStore | None = None, frame_source: FrameSource | None = None, label_index: LabelIndex | None = None, materialization: Materialization = Materialization.COPY, scratch_root: str | None = None, fold_cache: FoldCache | None = None, split_hash: str | None = None, image_cache: ImageCache | None = None, device: str = "mps"):
+    """Trains and evaluates YOLO model on all RSKF splits, yielding metrics for each fold (see run_fold)."""
+    for split in splits:
+        result_row = run_fold(model_seed, split, experiment_name, epochs, model_weight_path, run_dir, frame_store, frame_source, label_index, materialization, scratch_root, fold_cache, split_hash, image_cache, device)
+        if result_row is not None:
+            yield result_row
 
 def append_results(results_csv_filepath: str, result_row: list) -> None:
     """Appends experiment result row to CSV file, creating header if file doesn't exist."""
@@ -97,24 +226,113 @@ def append_results(results_csv_filepath: str, result_row: list) -> None:
         writer = csv.writer(f)
 
         if not file_exists:
-            header = [
-                "experiment_name",
-                "precision",
-                "recall",
-                "mAP50",
-                "mAP50-95",
-                "training_time_ms",
-                "eval_time_ms",
-            ]
-            writer.writerow(header)
+            writer.writerow(METRICS_HEADER)
             
         writer.writerow(result_row)
 
-def run_experiments(experiment_rskf_file_npy: str, metrics_file_txt: str, model_seeds: list[int], epochs: int, model_weight_path: str, run_dir: str) -> None:
-    """Runs experiments for all modalities and model seeds."""
+def load_run_resources(experiment_rskf_file_npy: str, frame_store_dir: str | None = None, raw_source_dir: str | None = None, label_index_dir: str | None = None, fold_cache_dir: str | None = None, fold_cache_gb: float = 50.0, image_cache_dir: str | None = None) -> dict:
+    """Opens the frame store, frame source, label index, fold cache and image cache of a campaign, building the image cache if missing.
+    Returns them as keyword arguments of run_fold."""
+    frame_store = FrameStore(frame_store_dir) if frame_store_dir is not None else None
+    frame_source = FrameSource(raw_source_dir) if raw_source_dir is not None else None
+    label_index = load_label_index(label_index_dir) if label_index_dir is not None else None
+    fold_cache = FoldCache(fold_cache_dir, int(fold_cache_gb * 1024**3)) if fold_cache_dir is not None else None
+    split_hash = file_digest(experiment_rskf_file_npy) if fold_cache is not None else None
+    image_cache = None
+    if image_cache_dir is not None:
+        if not is_image_cache(image_cache_dir):
+            build_image_cache(experiment_rskf_file_npy, image_cache_dir, 640, frame_store, frame_source, label_index)
+        image_cache = ImageCache(image_cache_dir)
+
+    return {
+        "frame_store": frame_store,
+        "frame_source": frame_source,
+        "label_index": label_index,
+        "fold_cache": fold_cache,
+        "split_hash": split_hash,
+        "image_cache": image_cache,
+    }
+
+def open_ledger(ledger_path: str, metrics_file_txt: str, experiment_rskf_file_npy: str, splits: list[dict], model_seeds: list[int], epochs: int, model_weight_path: str, priorities: list[int] | None = None) -> RunLedger:
+    """Opens the ledger of a campaign, puts the runs of crashed processes back to pending and registers all (modality, seed, fold) runs.
+    A new ledger takes over the rows of an existing metrics file, which is kept next to it as '.pre-ledger' copy."""
+    new_ledger = not os.path.exists(ledger_path)
+    ledger = RunLedger(ledger_path)
+    for job in ledger.recover():
+        print(f"Warning: Run {job.experiment_name} fold {job.fold} was left running by a crashed process and is pending again.")
+
+    split_hash = file_digest(experiment_rskf_file_npy)
+    jobs = campaign_jobs(splits, model_seeds)
+    ledger.register(jobs, [job_config_hash(split_hash, epochs, model_weight_path, job) for job in jobs], priorities)
+
+    if new_ledger and os.path.exists(metrics_file_txt):
+        shutil.copy2(metrics_file_txt, f"{metrics_file_txt}.pre-ledger")
+        print(f"Imported {ledger.import_metrics(metrics_file_txt)} completed runs from {metrics_file_txt}.")
+    return ledger
+
+def run_claimed_jobs(ledger: RunLedger | SharedQueue, splits: list[dict], metrics_file_txt: str, epochs: int, model_weight_path: str, run_dir: str, worker: str | None = None, **run_kwargs) -> int:
+    """Claims and runs pending jobs of a ledger or shared queue until none is left, recording each result and exporting
+    the metrics file after every finished run. Returns the amount of finished runs."""
+    finished = 0
+    while (job := ledger.claim(worker)) is not None:
+        try:
+            result_row = run_fold(job.model_seed, splits[job.split_idx], job.experiment_name, epochs, model_weight_path, run_dir, skip_completed=False, **run_kwargs)
+        except KeyboardInterrupt:
+            ledger.release(job)
+            raise
+        except Exception as e:
+            ledger.fail(job, repr(e))
+            print(f"Warning: Run {job.experiment_name} fold {job.fold} failed: {e!r}")
+            continue
+
+        ledger.complete(job, result_row)
+        ledger.export_metrics(metrics_file_txt)
+        finished += 1
+    return finished
+
+def run_experiments(experiment_rskf_file_npy: str, metrics_file_txt: str, model_seeds: list[int], epochs: int, model_weight_path: str, run_dir: str, frame_store_dir: str | None = None, raw_source_dir: str | None = None, label_index_dir: str | None = None, materialization: Materialization = Materialization.COPY, scratch_root: str | None = None, fold_cache_dir: str | None = None, fold_cache_gb: float = 50.0, image_cache_dir: str | None = None, ledger_path: str | None = None, queue_dir: str | None = None) -> None:
+    """Runs experiments for all modalities and model seeds. Images are read from packed frame shards if frame_store_dir is given,
+    or decoded on demand from the raw Anti-UAV videos if raw_source_dir is given. Labels are written from the label index if label_index_dir is given.
+    Loose files are placed into each fold's temporary dataset under scratch_root according to materialization.
+    If fold_cache_dir is given, fold datasets are kept there across seeds, modalities and runs, using at most fold_cache_gb.
+    If image_cache_dir is given, all sampled images are decoded into an image cache there once (if not yet done) and every run reads from it.
+    If ledger_path is given, the state and results of all runs are kept in a SQLite ledger instead of probing the run directories,
+    and the metrics file is exported from it after every run.
+    If queue_dir is given, runs are claimed from a queue in that directory shared with the other hosts of the campaign, e.g. on NFS,
+    and the metrics file is merged from the result shards of all hosts after every run."""
+    if ledger_path is not None and queue_dir is not None:
+        raise ValueError("Runs are either tracked by a ledger or by a shared queue, not both.")
 
     # len: n_repeats * n_splits of {fold idx, filepaths, train indices, test indices}
-    splits = np.load(experiment_rskf_file_npy, allow_pickle=True)
+    splits = load_folds(experiment_rskf_file_npy)
+    resources = load_run_resources(experiment_rskf_file_npy, frame_store_dir, raw_source_dir, label_index_dir, fold_cache_dir, fold_cache_gb, image_cache_dir)
+
+    if ledger_path is not None:
+        ledger = open_ledger(ledger_path, metrics_file_txt, experiment_rskf_file_npy, splits, model_seeds, epochs, model_weight_path)
+        ledger.export_metrics(metrics_file_txt)
+        try:
+            run_claimed_jobs(ledger, splits, metrics_file_txt, epochs, model_weight_path, run_dir, materialization=materialization, scratch_root=scratch_root, **resources)
+        except KeyboardInterrupt:
+            print("Run cancelled via KeyboardInterrupt.")
+        finally:
+            ledger.close()
+        return
+
+    if queue_dir is not None:
+        work_queue = SharedQueue(queue_dir)
+        split_hash = file_digest(experiment_rskf_file_npy)
+        jobs = campaign_jobs(splits, model_seeds)
+        work_queue.register(jobs, [job_config_hash(split_hash, epochs, model_weight_path, job) for job in jobs])
+        try:
+            run_claimed_jobs(work_queue, splits, metrics_file_txt, epochs, model_weight_path, run_dir, materialization=materialization, scratch_root=scratch_root, **resources)
+        except KeyboardInterrupt:
+            print("Run cancelled via KeyboardInterrupt.")
+        finally:
+            work_queue.close()
+        counts = work_queue.counts()
+        print(f"{counts['done']} runs done, {counts['running']} running on other hosts, {counts['failed']} failed.")
+        work_queue.export_metrics(metrics_file_txt)
+        return
 
     for modality in [
         Modality.VISIBLE,
@@ -124,7 +342,7 @@ def run_experiments(experiment_rskf_file_npy: str, metrics_file_txt: str, model_
         for model_seed in model_seeds:
             experiment_name = "%s-%s" % (modality.value, model_seed)
             try:
-                for result_row in run_repeated_k_fold(model_seed, splits, experiment_name, epochs, model_weight_path, run_dir):
+                for result_row in run_repeated_k_fold(model_seed, splits, experiment_name, epochs, model_weight_path, run_dir, materialization=materialization, scratch_root=scratch_root, **resources):
                     append_results(metrics_file_txt, result_row)
             except KeyboardInterrupt:
                 print("Run cancelled via KeyboardInterrupt.")
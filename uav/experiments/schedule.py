@@ -0,0 +1,175 @@
+import os
+import time
+import multiprocessing
+from dataclasses import dataclass
+
+import numpy as np
+import pandas as pd
+
+from uav.experiments.data import Materialization
+from uav.experiments.splits import load_folds
+from uav.experiments.ledger import MODALITY_ORDER, Job, RunLedger, campaign_jobs
+from uav.experiments.run import load_run_resources, open_ledger, run_claimed_jobs
+
+
+THREAD_ENV_VARIABLES = ["OMP_NUM_THREADS", "MKL_NUM_THREADS", "OPENBLAS_NUM_THREADS"]
+WORKER_POLL_SECONDS = 5.0
+
+
+@dataclass
+class WorkerSpec():
+    """Resources of one scheduler worker process."""
+    device: str = "mps"             # torch device passed to ultralytics, e.g. "cuda:0", "mps" or "cpu"
+    threads: int | None = None      # torch and BLAS threads, None keeps the defaults
+    cpus: list[int] | None = None   # CPU affinity (Linux only), None keeps the inherited one
+
+def available_cpus() -> list[int]:
+    """Returns the CPUs this process may run on."""
+    if hasattr(os, "sched_getaffinity"):
+        return sorted(os.sched_getaffinity(0))
+    return list(range(os.cpu_count() or 1))
+
+def default_workers(devices: list[str], cpus: list[int] | None = None) -> list[WorkerSpec]:
+    """One worker per device, each pinned to an equal contiguous share of the CPUs with as many threads."""
+    cpus = cpus if cpus is not None else available_cpus()
+    shares = np.array_split(np.asarray(cpus), len(devices))
+    return [WorkerSpec(device, max(len(share), 1), [int(cpu) for cpu in share] or None) for device, share in zip(devices, shares)]
+
+def historical_training_times(metrics_file_txt: str) -> dict[str, float]:
+    """Returns the median training_time_ms per modality of the metrics file, and over all rows under '*'."""
+    if not os.path.exists(metrics_file_txt):
+        return {}
+    df = pd.read_csv(metrics_file_txt)
+    if df.empty:
+        return {}
+    modalities = df["experiment_name"].astype(str).str.split("-").str[0]
+    times = df.groupby(modalities)["training_time_ms"].median().to_dict()
+    times["*"] = float(df["training_time_ms"].median())
+    return times
+
+def order_jobs(jobs: list[Job], splits: list[dict], metrics_file_txt: str) -> list[Job]:
+    """Orders jobs longest first, estimated from the historical training time of their modality scaled by their train set size.
+    Ties keep the modality, seed and fold order, so that the order only depends on the inputs."""
+    times = historical_training_times(metrics_file_txt)
+    mean_train_size = np.mean([len(split['train_idx']) for split in splits])
+
+    def estimate(job: Job) -> float:
+        return times.get(job.modality, times.get("*", 1.0)) * len(splits[job.split_idx]['train_idx']) / mean_train_size
+
+    modality_rank = {modality.value: i for i, modality in enumerate(MODALITY_ORDER)}
+    return sorted(jobs, key=lambda job: (-estimate(job), modality_rank[job.modality], job.model_seed, job.split_idx))
+
+def run_worker(worker_id: int, spec: WorkerSpec, ledger_path: str, metrics_file_txt: str, experiment_rskf_file_npy: str, epochs: int, model_weight_path: str, run_dir: str, run_options: dict) -> None:
+    """Worker process: pins itself to its CPUs and threads, then claims and runs jobs from the ledger until none is left.
+    A job's training only depends on the job (its model seed fixes all ultralytics seeds), not on the worker."""
+    if spec.cpus and hasattr(os, "sched_setaffinity"):
+        try:
+            os.sched_setaffinity(0, spec.cpus)
+        except OSError as e:
+            print(f"Warning: Worker {worker_id} could not be pinned to CPUs {spec.cpus}: {e}")
+    if spec.threads is not None:
+        import torch # type: ignore
+        torch.set_num_threads(spec.threads)
+
+    splits = load_folds(experiment_rskf_file_npy)
+    materialization, scratch_root = run_options.pop("materialization"), run_options.pop("scratch_root")
+    resources = load_run_resources(experiment_rskf_file_npy, **run_options)
+
+    ledger = RunLedger(ledger_path)
+    try:
+        finished = run_claimed_jobs(ledger, splits, metrics_file_txt, epochs, model_weight_path, run_dir, materialization=materialization, scratch_root=scratch_root, device=spec.device, **resources)
+    finally:
+        ledger.close()
+    print(f"Worker {worker_id} ({spec.device}) finished {finished} runs.")
+
+def start_worker(context, worker_id: int, spec: WorkerSpec, args: tuple):
+    """Starts a worker process with its thread limits in the environment, so that they apply before torch is imported.
+    Workers are not daemonic, since daemonic processes cannot start the DataLoader workers of ultralytics; the scheduler terminates and joins them."""
+    previous = {name: os.environ.get(name) for name in THREAD_ENV_VARIABLES}
+    if spec.threads is not None:
+        os.environ.update({name: str(spec.threads) for name in THREAD_ENV_VARIABLES})
+    try:
+        process = context.Process(target=run_worker, args=(worker_id, spec, *args))
+        process.start()
+    finally:
+        for name, value in previous.items():
+            if value is None:
+                os.environ.pop(name, None)
+            else:
+                os.environ[name] = value
+    return process
+
+def schedule_experiments(
+    experiment_rskf_file_npy: str,
+    metrics_file_txt: str,
+    model_seeds: list[int],
+    epochs: int,
+    model_weight_path: str,
+    run_dir: str,
+    workers: list[WorkerSpec],
+    frame_store_dir: str | None = None,
+    raw_source_dir: str | None = None,
+    label_index_dir: str | None = None,
+    materialization: Materialization = Materialization.COPY,
+    scratch_root: str | None = None,
+    fold_cache_dir: str | None = None,
+    fold_cache_gb: float = 50.0,
+    image_cache_dir: str | None = None,
+    ledger_path: str | None = None,
+) -> dict[Job, str]:
+    """Runs the pending (modality, seed, fold) runs of run_experiments as independent jobs on a pool of worker processes,
+    longest first. Workers claim jobs from the run ledger (by default next to the metrics file) and export the metrics file
+    from it after every run, in the row order of run_experiments. Returns the failed jobs with their errors."""
+    ledger_path = ledger_path if ledger_path is not None else f"{os.path.splitext(metrics_file_txt)[0]}.sqlite"
+    splits = load_folds(experiment_rskf_file_npy)
+    jobs = campaign_jobs(splits, model_seeds)
+    priority = {job: i for i, job in enumerate(order_jobs(jobs, splits, metrics_file_txt))}
+
+    ledger = open_ledger(ledger_path, metrics_file_txt, experiment_rskf_file_npy, splits, model_seeds, epochs, model_weight_path, [priority[job] for job in jobs])
+    ledger.export_metrics(metrics_file_txt)
+    pending = ledger.counts()["pending"]
+    if not pending:
+        print("All runs are completed.")
+        ledger.close()
+        return {}
+
+    run_options = {
+        "frame_store_dir": frame_store_dir,
+        "raw_source_dir": raw_source_dir,
+        "label_index_dir": label_index_dir,
+        "fold_cache_dir": fold_cache_dir,
+        "fold_cache_gb": fold_cache_gb,
+        "image_cache_dir": image_cache_dir,
+    }
+    # Builds the image cache once before the workers attach to it
+    load_run_resources(experiment_rskf_file_npy, **run_options)
+
+    # spawn, CUDA cannot be used in forked processes
+    context = multiprocessing.get_context("spawn")
+    print(f"Scheduling {pending} runs on {len(workers)} workers: {', '.join(spec.device for spec in workers)}")
+    args = (ledger_path, metrics_file_txt, experiment_rskf_file_npy, epochs, model_weight_path, run_dir, {**run_options, "materialization": materialization, "scratch_root": scratch_root})
+    processes = []
+    try:
+        for worker_id, spec in enumerate(workers):
+            processes.append(start_worker(context, worker_id, spec, args))
+        while any(process.is_alive() for process in processes):
+            time.sleep(WORKER_POLL_SECONDS)
+    except KeyboardInterrupt:
+        print("Run cancelled via KeyboardInterrupt.")
+    finally:
+        # Only reached with live workers on an interrupt or error, they would otherwise keep the interpreter from exiting
+        for process in processes:
+            if process.is_alive():
+                process.terminate()
+        for process in processes:
+            process.join()
+
+    # Runs of terminated or crashed workers are pending again on the next call
+    ledger.recover()
+    ledger.export_metrics(metrics_file_txt)
+    counts = ledger.counts()
+    if counts["pending"]:
+        print(f"Warning: Workers exited with {counts['pending']} runs left.")
+    failed = {Job(row["modality"], row["model_seed"], row["split_idx"], row["fold"]): row["error"] for row in ledger.jobs("failed")}
+    ledger.close()
+    return failed
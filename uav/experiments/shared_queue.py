@@ -0,0 +1,253 @@
+import os
+import csv
+import glob
+import json
+import time
+import uuid
+import socket
+import threading
+
+from uav.experiments.ledger import METRICS_HEADER, JOB_STATES, Job, worker_name
+
+
+LEASE_DIRNAME = "leases"
+SHARD_DIRNAME = "results"
+FAILED_DIRNAME = "failed"
+CLOCK_DIRNAME = "clock"
+SHARD_HEADER = ["job_id", "config_hash"] + METRICS_HEADER
+
+
+def job_id(job: Job) -> str:
+    """File name safe identifier of a job."""
+    return f"{job.modality}-{job.model_seed}-f{job.fold}"
+
+def write_file(filepath: str, content: str) -> None:
+    """Writes a file completely or not at all, via a unique temporary file renamed into place."""
+    tmp_path = f"{filepath}.{uuid.uuid4().hex}.tmp"
+    with open(tmp_path, "w") as f:
+        f.write(content)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, filepath)
+
+
+class SharedQueue:
+    """Work queue of a campaign in a directory on a filesystem shared by several hosts, e.g. NFS. No service is needed:
+
+    - A job is claimed by hard-linking a lease file into leases/, which fails if it exists on every filesystem, NFS included.
+    - The claiming process refreshes the lease's modification time every heartbeat_seconds while the run is going on.
+    - A lease not refreshed for lease_seconds belongs to a crashed or disconnected host; it is renamed away (which only one
+      host can do) and the job is claimed anew.
+    - Every process appends its results to its own shard in results/, so that no two processes write the same file,
+      also with several workers on one host.
+      A job is done once a shard holds a row of it with its current config hash.
+
+    Lease ages are measured against the filesystem's clock, so that clock differences between hosts do not matter.
+    It has the claim interface of RunLedger, so that run_claimed_jobs works with both."""
+    def __init__(self, queue_dir: str, lease_seconds: float = 600.0, heartbeat_seconds: float = 60.0):
+        if heartbeat_seconds >= lease_seconds:
+            raise ValueError(f"heartbeat_seconds ({heartbeat_seconds}) must be shorter than lease_seconds ({lease_seconds}).")
+        self.queue_dir = queue_dir
+        self.lease_seconds = lease_seconds
+        self.heartbeat_seconds = heartbeat_seconds
+        self.host = socket.gethostname()
+        for dirname in [LEASE_DIRNAME, SHARD_DIRNAME, FAILED_DIRNAME, CLOCK_DIRNAME]:
+            os.makedirs(os.path.join(queue_dir, dirname), exist_ok=True)
+
+        self.registered = []    # (job, config hash) in export order
+        self.priorities = {}    # job : priority
+        self.tokens = {}        # job : token of its lease held by this process
+        self.heartbeats = {}    # job : (stop event, thread)
+
+    def lease_path(self, job: Job) -> str:
+        return os.path.join(self.queue_dir, LEASE_DIRNAME, f"{job_id(job)}.lease")
+
+    def failed_path(self, job: Job) -> str:
+        return os.path.join(self.queue_dir, FAILED_DIRNAME, f"{job_id(job)}.json")
+
+    def shard_path(self) -> str:
+        return os.path.join(self.queue_dir, SHARD_DIRNAME, f"{self.host}-{os.getpid()}.csv")
+
+    def shared_time(self) -> float:
+        """Returns the current time of the shared filesystem, the modification time of a freshly touched file."""
+        clock_path = os.path.join(self.queue_dir, CLOCK_DIRNAME, f"{self.host}-{os.getpid()}")
+        with open(clock_path, "a"):
+            pass
+        os.utime(clock_path) # without explicit times, NFS sets the server's time
+        return os.stat(clock_path).st_mtime
+
+    def register(self, jobs: list[Job], config_hashes: list[str], priorities: list[int] | None = None) -> None:
+        """Registers the jobs of a campaign in their export order. Jobs are claimed by ascending priority (their order by default).
+        Failed jobs are retried. Every host registers the campaign itself, results only count for the same config hash."""
+        priorities = priorities if priorities is not None else list(range(len(jobs)))
+        self.registered = list(zip(jobs, config_hashes))
+        self.priorities = dict(zip(jobs, priorities))
+        for job in jobs:
+            if os.path.exists(self.failed_path(job)):
+                os.remove(self.failed_path(job))
+
+    def results(self) -> dict[Job, list]:
+        """Returns the metrics row of every registered job with a result of its current config hash.
+        If a job finished more than once, e.g. after a lease expired on a slow host, the first shard in name order wins."""
+        config_hashes = {job_id(job): (job, config_hash) for job, config_hash in self.registered}
+        results = {}
+        for shard_path in sorted(glob.glob(os.path.join(self.queue_dir, SHARD_DIRNAME, "*.csv"))):
+            with open(shard_path, "r", newline='') as f:
+                for row in list(csv.reader(f))[1:]:
+                    # A row cut off by a crash while appending is ignored
+                    if len(row) != len(SHARD_HEADER) or row[0] not in config_hashes:
+                        continue
+                    job, config_hash = config_hashes[row[0]]
+                    if row[1] == config_hash and job not in results:
+                        results[job] = row[2:]
+        return results
+
+    def lease_expired(self, lease_path: str) -> bool:
+        """Returns whether a lease was not refreshed for lease_seconds, False if it does not exist."""
+        try:
+            return os.stat(lease_path).st_mtime < self.shared_time() - self.lease_seconds
+        except FileNotFoundError:
+            return False
+
+    def acquire(self, job: Job) -> bool:
+        """Tries to take the lease of a job, reclaiming an expired one. Returns whether this process holds it now."""
+        lease_path = self.lease_path(job)
+        token = uuid.uuid4().hex
+        tmp_path = f"{lease_path}.{token}.tmp"
+        write_file(tmp_path, json.dumps({"worker": worker_name(), "token": token, "claimed_at": time.time()}))
+        try:
+            for _ in range(2):
+                try:
+                    os.link(tmp_path, lease_path)
+                    self.tokens[job] = token
+                    return True
+                except FileExistsError:
+                    if not self.lease_expired(lease_path):
+                        return False
+
+                # Only one host can rename the expired lease away, the others find it missing
+                stale_path = f"{lease_path}.{token}.stale"
+                try:
+                    os.rename(lease_path, stale_path)
+                except FileNotFoundError:
+                    return False
+                if not self.lease_expired(stale_path):
+                    # Refreshed by its holder in the meantime, put it back
+                    try:
+                        os.link(stale_path, lease_path)
+                    except FileExistsError:
+                        pass
+                    os.remove(stale_path)
+                    return False
+                os.remove(stale_path)
+                print(f"Warning: Reclaiming the expired lease of {job.experiment_name} fold {job.fold}.")
+            return False
+        finally:
+            os.remove(tmp_path)
+
+    def holds(self, job: Job) -> bool:
+        """Returns whether the lease of a job is still the one this process took."""
+        try:
+            with open(self.lease_path(job), "r") as f:
+                return json.load(f)["token"] == self.tokens.get(job)
+        except (FileNotFoundError, ValueError):
+            return False
+
+    def start_heartbeat(self, job: Job) -> None:
+        """Refreshes the lease of a job every heartbeat_seconds until it is released."""
+        stop = threading.Event()
+
+        def beat():
+            while not stop.wait(self.heartbeat_seconds):
+                if not self.holds(job):
+                    print(f"Warning: Lost the lease of {job.experiment_name} fold {job.fold}, another host may run it too.")
+                    return
+                try:
+                    os.utime(self.lease_path(job))
+                except FileNotFoundError:
+                    # Another host is renaming the lease away as expired, or it was already replaced
+                    if not self.holds(job):
+                        print(f"Warning: Lost the lease of {job.experiment_name} fold {job.fold}, another host may run it too.")
+                        return
+
+        thread = threading.Thread(target=beat, daemon=True)
+        thread.start()
+        self.heartbeats[job] = (stop, thread)
+
+    def claim(self, worker: str | None = None) -> Job | None:
+        """Takes the lease of the pending job with the lowest priority and returns it, None if none is left.
+        Jobs leased by other hosts are skipped until their lease expires."""
+        done = self.results()
+        for job, _ in sorted(self.registered, key=lambda item: self.priorities[item[0]]):
+            if job in done or os.path.exists(self.failed_path(job)):
+                continue
+            if self.acquire(job):
+                # Finished by another host between reading the shards and taking the lease
+                if job in self.results():
+                    self.release(job)
+                    continue
+                self.start_heartbeat(job)
+                return job
+        return None
+
+    def release(self, job: Job) -> None:
+        """Stops the heartbeat of a job and removes its lease if this process still holds it."""
+        stop, thread = self.heartbeats.pop(job, (None, None))
+        if stop is not None:
+            stop.set()
+            thread.join()
+        if self.holds(job):
+            os.remove(self.lease_path(job))
+        self.tokens.pop(job, None)
+
+    def complete(self, job: Job, result_row: list) -> None:
+        """Appends the metrics row of a finished job as returned by run_fold to this process's shard and releases the job."""
+        config_hash = dict(self.registered)[job]
+        shard_path = self.shard_path()
+        file_exists = os.path.exists(shard_path)
+        with open(shard_path, "a", newline='') as f:
+            writer = csv.writer(f)
+            if not file_exists:
+                writer.writerow(SHARD_HEADER)
+            writer.writerow([job_id(job), config_hash] + list(result_row))
+            f.flush()
+            os.fsync(f.fileno())
+        self.release(job)
+
+    def fail(self, job: Job, error: str) -> None:
+        """Records a failed job, it is retried when a host registers the campaign again."""
+        write_file(self.failed_path(job), json.dumps({"worker": worker_name(), "error": error, "failed_at": time.time()}))
+        self.release(job)
+
+    def counts(self) -> dict[str, int]:
+        """Returns the amount of registered jobs per state, jobs with an unexpired lease count as running."""
+        done = self.results()
+        counts = dict.fromkeys(JOB_STATES, 0)
+        for job, _ in self.registered:
+            if job in done:
+                counts["done"] += 1
+            elif os.path.exists(self.failed_path(job)):
+                counts["failed"] += 1
+            elif os.path.exists(self.lease_path(job)) and not self.lease_expired(self.lease_path(job)):
+                counts["running"] += 1
+            else:
+                counts["pending"] += 1
+        return counts
+
+    def export_metrics(self, metrics_file_txt: str) -> int:
+        """Merges the shards of all hosts into the metrics csv, in the registered order as uav.evaluation expects.
+        The file is replaced atomically, so hosts merging at the same time never interleave rows. Returns the amount of rows."""
+        done = self.results()
+        rows = [done[job] for job, _ in self.registered if job in done]
+        tmp_path = f"{metrics_file_txt}.{self.host}-{os.getpid()}.tmp"
+        with open(tmp_path, "w", newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(METRICS_HEADER)
+            writer.writerows(rows)
+        os.replace(tmp_path, metrics_file_txt)
+        return len(rows)
+
+    def close(self) -> None:
+        """Releases all jobs still held by this process."""
+        for job in list(self.tokens):
+            self.release(job)
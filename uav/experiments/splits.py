@@ -0,0 +1,191 @@
+import os
+import json
+from dataclasses import dataclass, field
+
+import numpy as np
+
+from uav.setup.frame_store import parse_frame_filename
+
+
+SPLITS_FORMAT = "uav-splits"
+SPLITS_VERSION = 1
+SPLITS_META_FILENAME = "meta.json"
+SPLITS_COLUMNS = ["sequence", "frame", "fold", "train_offsets", "train_indices", "test_offsets", "test_indices"]
+MODALITY_POLICY = {
+    "vz": "visible frames at the stored paths",
+    "ir": "infrared frames of the same sequence and frame index",
+    "hy": "visible frames for the first hybrid_split frames, infrared for the rest",
+}
+
+
+@dataclass
+class Splits():
+    """Repeated k-fold splits over a shared table of frames. Each frame is a (sequence id, VZ frame index) pair,
+    the train and test indices of all folds are concatenated int32 arrays with per-fold offsets."""
+    sequences: np.ndarray       # sorted sequence names, indexed by the sequence column
+    sequence: np.ndarray        # int32 sequence id per frame
+    frame: np.ndarray           # int32 frame index per frame
+    fold: np.ndarray            # int32 fold id per fold
+    train_offsets: np.ndarray   # int64 (n_folds + 1) start of each fold in train_indices
+    train_indices: np.ndarray   # int32 frame indices of all train sets
+    test_offsets: np.ndarray    # int64 (n_folds + 1) start of each fold in test_indices
+    test_indices: np.ndarray    # int32 frame indices of all test sets
+    metadata: dict              # image_root, seeds, n_splits, n_repeats, fold_size, modality policy, ...
+    paths: np.ndarray | None = field(default=None, init=False, repr=False)
+
+    def __len__(self) -> int:
+        return len(self.fold)
+
+    def train_idx(self, i: int) -> np.ndarray:
+        """Returns the train indices of the i-th fold."""
+        return self.train_indices[self.train_offsets[i]:self.train_offsets[i + 1]]
+
+    def test_idx(self, i: int) -> np.ndarray:
+        """Returns the test indices of the i-th fold."""
+        return self.test_indices[self.test_offsets[i]:self.test_offsets[i + 1]]
+
+    def filepaths(self) -> np.ndarray:
+        """Returns the VZ image paths of all frames as in the pickled split files, built once on first use."""
+        if self.paths is None:
+            image_root = self.metadata["image_root"]
+            names = self.sequences[self.sequence]
+            self.paths = np.array([os.path.join(image_root, name, f"{name}-vz-{frame_idx:08d}.jpg") for name, frame_idx in zip(names, self.frame)])
+        return self.paths
+
+    def folds(self) -> list[dict]:
+        """Returns the folds as the list of {fold, filepaths, train_idx, test_idx, hybrid_split} dicts of the pickled split files."""
+        filepaths = self.filepaths()
+        hybrid_split = int(self.metadata.get("hybrid_split", len(filepaths) / 2))
+        return [{'fold': int(self.fold[i]), 'filepaths': filepaths, 'train_idx': self.train_idx(i), 'test_idx': self.test_idx(i), 'hybrid_split': hybrid_split} for i in range(len(self))]
+
+def infer_fold_layout(folds: list[dict]) -> tuple[int, int]:
+    """Returns (n_splits, n_repeats) of a split file, the test sets of each repeat partition all filepaths."""
+    n_frames = len(folds[0]['filepaths'])
+    covered = 0
+    for n_splits, fold in enumerate(folds, start=1):
+        covered += len(fold['test_idx'])
+        if covered >= n_frames:
+            return n_splits, len(folds) // n_splits
+    raise ValueError("The test sets of the split file do not cover all filepaths.")
+
+def concatenate_indices(index_arrays: list[np.ndarray]) -> tuple[np.ndarray, np.ndarray]:
+    """Concatenates per-fold index arrays into int32 indices with int64 offsets."""
+    offsets = np.zeros(len(index_arrays) + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum([len(indices) for indices in index_arrays])
+    indices = np.concatenate(index_arrays).astype(np.int32) if index_arrays else np.empty(0, dtype=np.int32)
+    return indices, offsets
+
+def build_splits(sequences: np.ndarray, sequence: np.ndarray, frame: np.ndarray, folds: list[tuple[int, np.ndarray, np.ndarray]], metadata: dict) -> Splits:
+    """Builds splits from the frame table and (fold, train_idx, test_idx) tuples."""
+    train_indices, train_offsets = concatenate_indices([train_idx for _, train_idx, _ in folds])
+    test_indices, test_offsets = concatenate_indices([test_idx for _, _, test_idx in folds])
+    metadata = {
+        **metadata,
+        "n_frames": len(frame),
+        "n_folds": len(folds),
+        "modality_policy": MODALITY_POLICY,
+    }
+    metadata.setdefault("hybrid_split", int(len(frame) / 2)) # as TempTrainingContext splits hybrid folds, kept when frames are appended
+    return Splits(
+        np.asarray(sequences),
+        np.asarray(sequence, dtype=np.int32),
+        np.asarray(frame, dtype=np.int32),
+        np.asarray([fold for fold, _, _ in folds], dtype=np.int32),
+        train_offsets, train_indices, test_offsets, test_indices,
+        metadata,
+    )
+
+def splits_from_folds(folds: list[dict], metadata: dict | None = None) -> Splits:
+    """Converts the fold dicts of a pickled split file, all folds must share the same VZ image paths below one images directory."""
+    filepaths = folds[0]['filepaths']
+    if any(len(fold['filepaths']) != len(filepaths) or not np.array_equal(fold['filepaths'], filepaths) for fold in folds[1:]):
+        raise ValueError("The folds do not share the same filepaths.")
+
+    parsed = [parse_frame_filename(filepath) for filepath in filepaths]
+    if any(modality_str != "vz" for _, modality_str, _ in parsed):
+        raise ValueError("Split files must list VZ image paths.")
+    sequence_names = np.array([sequence_name for sequence_name, _, _ in parsed])
+    sequences, sequence = np.unique(sequence_names, return_inverse=True)
+    frame = np.array([frame_idx for _, _, frame_idx in parsed], dtype=np.int32)
+
+    image_root = os.path.dirname(os.path.dirname(filepaths[0])) if len(filepaths) else ""
+    n_splits, n_repeats = infer_fold_layout(folds)
+    metadata = {"image_root": image_root, "n_splits": n_splits, "n_repeats": n_repeats, **(metadata or {})}
+    if 'hybrid_split' in folds[0]:
+        metadata["hybrid_split"] = int(folds[0]['hybrid_split'])
+    splits = build_splits(sequences, sequence, frame, [(fold['fold'], fold['train_idx'], fold['test_idx']) for fold in folds], metadata)
+    if not np.array_equal(splits.filepaths(), filepaths):
+        raise ValueError(f"The filepaths cannot be rebuilt from '{image_root}', sequence names and frame indices.")
+    return splits
+
+def replace_file(path: str, write) -> None:
+    """Writes a file through write(f) next to its final path and renames it into place, readers that memory-mapped the old file keep it."""
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "wb") as f:
+        write(f)
+    os.replace(tmp_path, path)
+
+def save_splits(splits: Splits, splits_dir: str) -> None:
+    """Saves splits as one .npy file per column and a meta.json, so that they can be memory-mapped."""
+    os.makedirs(splits_dir, exist_ok=True)
+    meta_path = os.path.join(splits_dir, SPLITS_META_FILENAME)
+    if os.path.exists(meta_path):
+        os.remove(meta_path)
+
+    replace_file(os.path.join(splits_dir, "sequences.npy"), lambda f: np.save(f, splits.sequences))
+    for name in SPLITS_COLUMNS:
+        replace_file(os.path.join(splits_dir, f"{name}.npy"), lambda f: np.save(f, np.asarray(getattr(splits, name))))
+
+    # Written last, a directory without it is not a complete split file
+    metadata = json.dumps({"format": SPLITS_FORMAT, "version": SPLITS_VERSION, **splits.metadata}, indent=4)
+    replace_file(meta_path, lambda f: f.write(metadata.encode()))
+
+def load_splits(splits_dir: str, mmap: bool = True) -> Splits:
+    """Loads splits saved by save_splits, memory-mapping the columns by default."""
+    meta_path = os.path.join(splits_dir, SPLITS_META_FILENAME)
+    if not os.path.exists(meta_path):
+        raise FileNotFoundError(f"'{splits_dir}' is not a split directory.")
+    with open(meta_path, "r") as f:
+        metadata = json.load(f)
+
+    if metadata.pop("format", None) != SPLITS_FORMAT:
+        raise ValueError(f"'{splits_dir}' is not a split directory.")
+    version = metadata.pop("version")
+    if version > SPLITS_VERSION:
+        raise ValueError(f"Split format version {version} is newer than the supported version {SPLITS_VERSION}.")
+
+    mmap_mode = "r" if mmap else None
+    return Splits(
+        np.load(os.path.join(splits_dir, "sequences.npy")),
+        **{name: np.load(os.path.join(splits_dir, f"{name}.npy"), mmap_mode=mmap_mode) for name in SPLITS_COLUMNS},
+        metadata=metadata,
+    )
+
+def is_splits_dir(splits_filepath: str) -> bool:
+    """Returns whether a path is a split directory rather than a pickled .npy split file."""
+    return os.path.isdir(splits_filepath) and os.path.exists(os.path.join(splits_filepath, SPLITS_META_FILENAME))
+
+def load_folds(splits_filepath: str) -> list[dict]:
+    """Loads the fold dicts of a split directory or of a pickled .npy split file."""
+    if is_splits_dir(splits_filepath):
+        return load_splits(splits_filepath).folds()
+    return list(np.load(splits_filepath, allow_pickle=True))
+
+def save_folds(folds: list[dict], splits_filepath: str, metadata: dict | None = None) -> None:
+    """Saves fold dicts as a pickled split file if the path ends with .npy, as split directory otherwise."""
+    if splits_filepath.endswith(".npy"):
+        np.save(splits_filepath, folds)
+    else:
+        save_splits(splits_from_folds(folds, metadata), splits_filepath)
+
+def convert_split_file(npy_filepath: str, splits_dir: str, metadata: dict | None = None) -> Splits:
+    """Converts a pickled .npy split file into a split directory and checks that it loads the same folds."""
+    folds = list(np.load(npy_filepath, allow_pickle=True))
+    splits = splits_from_folds(folds, metadata)
+    save_splits(splits, splits_dir)
+
+    converted = load_splits(splits_dir)
+    for i, fold in enumerate(folds):
+        if converted.fold[i] != fold['fold'] or not np.array_equal(converted.train_idx(i), fold['train_idx']) or not np.array_equal(converted.test_idx(i), fold['test_idx']):
+            raise RuntimeError(f"Fold {fold['fold']} differs after conversion.")
+    return converted
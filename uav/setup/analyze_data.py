@@ -1,7 +1,10 @@
+import os
 import json
 
-def analyze_data(stats_path: str = "datasets/anti-uav300/statistics.json") -> None:
-    """Analyzes and prints Anti-UAV300 dataset statistics from JSON file."""
+from uav.setup.profile_data import load_profile, print_profile
+
+def analyze_data(stats_path: str = "datasets/anti-uav300/statistics.json", profile_path: str = "datasets/anti-uav300/profile.json") -> None:
+    """Analyzes and prints Anti-UAV300 dataset statistics from JSON file, followed by the cached dataset profile if there is one."""
     with open(stats_path, "r") as f:
         data = json.load(f)
 
@@ -35,3 +38,7 @@ def analyze_data(stats_path: str = "datasets/anti-uav300/statistics.json") -> No
     print(f"  Annotated Frames:   {annot_vz + annot_ir:,}")
     print(f"  Overall Coverage:   {(annot_vz + annot_ir) / (frames_vz + frames_ir):.2%}\n")
     print(f"{'='*50}\n")
+
+    if os.path.exists(profile_path):
+        print_profile(load_profile(profile_path))
+        print(f"{'='*50}\n")
@@ -1,8 +1,15 @@
-from uav.setup.download_data import download_and_extract
-from uav.setup.process_data import process_dataset
+import os
 
-def automated_setup(verbose: bool) -> None:
-    """Automatically downloads and processes the Anti-UAV300 dataset."""
+from uav.setup.download_data import download_and_extract, download
+from uav.setup.stream_data import process_archive
+from uav.setup.process_data import process_dataset, ConversionOptions
+from uav.setup.frame_source import FrameSource, extract_split_frames
+from uav.experiments.create import create_experiments
+from uav.setup.utils import vprint
+
+def automated_setup(verbose: bool, num_workers: int = 1, options: ConversionOptions | None = None, mirror_url: str | None = None, checksum: str | None = None) -> None:
+    """Automatically downloads and processes the Anti-UAV300 dataset.
+    A direct mirror_url of the archive is fetched with the resumable chunked downloader before falling back to Google Drive."""
     print("Running automated setup.")
 
     print("Downloading...")    
@@ -11,7 +18,9 @@ def automated_setup(verbose: bool) -> None:
         zip_path="datasets/anti-uav300-raw.zip",
         extract_dir="datasets/anti-uav300-raw",
         verbose=verbose,
-        remove_zip = True
+        remove_zip = True,
+        mirror_url=mirror_url,
+        checksum=checksum,
     )
     
     if not success:
@@ -23,9 +32,74 @@ def automated_setup(verbose: bool) -> None:
         target_dir = "datasets/anti-uav300",
         verbose=verbose,
         remove_source = True,
+        num_workers=num_workers,
+        options=options,
     )
 
     if not success:
         print("Dataset formatting failed.")
 
     print("Done!")
+
+def streamed_setup(verbose: bool, num_workers: int = 1, options: ConversionOptions | None = None, mirror_url: str | None = None, checksum: str | None = None) -> None:
+    """Downloads the Anti-UAV300 dataset and converts it straight out of the archive, without extracting the raw tree.
+    A direct mirror_url of the archive is fetched with the resumable chunked downloader before falling back to Google Drive."""
+    print("Running streamed setup.")
+
+    print("Downloading...")
+    os.makedirs("datasets", exist_ok=True)
+    if not os.path.exists("datasets/anti-uav300-raw.zip"):
+        download(
+            url="https://drive.google.com/uc?id=1NPYaop35ocVTYWHOYQQHn8YHsM9jmLGr", # Dataset provided via GitHub: https://github.com/ucas-vg/Anti-UAV
+            zip_path="datasets/anti-uav300-raw.zip",
+            verbose=verbose,
+            mirror_url=mirror_url,
+            checksum=checksum,
+        )
+
+    print("Formatting...")
+    success = process_archive(
+        zip_path="datasets/anti-uav300-raw.zip",
+        target_dir="datasets/anti-uav300",
+        verbose=verbose,
+        remove_zip=True,
+        num_workers=num_workers,
+        options=options,
+    )
+
+    if not success:
+        print("Dataset formatting failed.")
+
+    print("Done!")
+
+def selective_setup(
+    seeds: list[int],
+    fold_size: int,
+    n_splits: int,
+    n_repeats: int,
+    verbose: bool,
+    source_dir: str = "datasets/anti-uav300-raw",
+    target_dir: str = "datasets/anti-uav300",
+    splits_filepath: str = "experiments/rskf_splits.npy",
+) -> None:
+    """Two-phase setup: creates the RSKF splits from the raw annotations, then extracts only the frames referenced by them."""
+    print("Running selective setup.")
+
+    print("Creating splits from annotations...")
+    frame_source = FrameSource(source_dir)
+    create_experiments(
+        seeds=seeds,
+        source_dir=target_dir,
+        target_filepath=splits_filepath,
+        fold_size=fold_size,
+        n_splits=n_splits,
+        n_repeats=n_repeats,
+        frame_source=frame_source,
+    )
+
+    print("Extracting split frames...")
+    amount_frames = extract_split_frames(frame_source, splits_filepath, verbose)
+    frame_source.close()
+
+    vprint(verbose, f"Extracted {amount_frames} frames to {target_dir}.")
+    print("Done!")
@@ -0,0 +1,165 @@
+import os
+import json
+import time
+import hashlib
+import threading
+import urllib.request
+from urllib.error import URLError
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from tqdm import tqdm
+
+from uav.setup.utils import vprint
+
+
+DEFAULT_CHUNK_SIZE = 16 * 1024 * 1024
+READ_BLOCK_SIZE = 1024 * 1024
+
+
+class DownloadError(RuntimeError):
+    pass
+
+def probe_remote(url: str, timeout: float) -> tuple[int, bool, str | None]:
+    """Returns the size of the remote file, whether it supports range requests and its ETag."""
+    request = urllib.request.Request(url, headers={"Range": "bytes=0-0"})
+    with urllib.request.urlopen(request, timeout=timeout) as response:
+        etag = response.headers.get("ETag")
+        if response.status == 206:
+            content_range = response.headers.get("Content-Range", "") # bytes 0-0/<size>
+            return int(content_range.rsplit("/", 1)[1]), True, etag
+        return int(response.headers.get("Content-Length", -1)), False, etag
+
+def load_state(state_path: str, url: str, size: int, chunk_size: int, etag: str | None) -> set[int]:
+    """Returns the completed chunks of a previous attempt, empty if there is none or the remote file changed."""
+    if not os.path.exists(state_path):
+        return set()
+    try:
+        with open(state_path, "r") as f:
+            state = json.load(f)
+    except json.JSONDecodeError:
+        return set()
+
+    if state.get("url") != url or state.get("size") != size or state.get("chunk_size") != chunk_size or state.get("etag") != etag:
+        return set()
+    return set(state.get("done", []))
+
+def save_state(state_path: str, url: str, size: int, chunk_size: int, etag: str | None, done: set[int]) -> None:
+    """Atomically persists the completed chunks next to the partial download."""
+    with open(state_path + ".tmp", "w") as f:
+        json.dump({"url": url, "size": size, "chunk_size": chunk_size, "etag": etag, "done": sorted(done)}, f)
+    os.replace(state_path + ".tmp", state_path)
+
+def file_checksum(filepath: str, algorithm: str = "sha256") -> str:
+    """Streams a file through the hash algorithm and returns its hex digest."""
+    digest = hashlib.new(algorithm)
+    with open(filepath, "rb") as f:
+        for block in iter(lambda: f.read(READ_BLOCK_SIZE), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+def fetch_chunk(url: str, fd: int, start: int, end: int, timeout: float, retries: int, progress: tqdm, stop: threading.Event | None = None) -> None:
+    """Downloads bytes [start, end] with a range request and writes them at their offset of the partial file.
+    Once stop is set, the chunk is abandoned at its next block without retrying."""
+    stop = stop if stop is not None else threading.Event()
+    for attempt in range(retries + 1):
+        offset = start
+        try:
+            request = urllib.request.Request(url, headers={"Range": f"bytes={start}-{end}"})
+            with urllib.request.urlopen(request, timeout=timeout) as response:
+                if response.status != 206:
+                    raise DownloadError(f"Server ignored the range request for bytes {start}-{end}.")
+                for block in iter(lambda: response.read(READ_BLOCK_SIZE), b""):
+                    if stop.is_set():
+                        raise DownloadError("Download cancelled.")
+                    os.pwrite(fd, block, offset)
+                    offset += len(block)
+                    progress.update(len(block))
+            if offset != end + 1:
+                raise DownloadError(f"Chunk {start}-{end} ended after {offset - start} bytes.")
+            return
+        except (URLError, OSError, DownloadError) as e:
+            progress.update(start - offset) # the chunk is fetched again from its start
+            if stop.is_set():
+                raise DownloadError("Download cancelled.") from e
+            if attempt == retries:
+                raise DownloadError(f"Chunk {start}-{end} failed after {retries + 1} attempts: {e}") from e
+            stop.wait(2 ** attempt)
+
+def chunked_download(
+    url: str,
+    target_path: str,
+    verbose: bool,
+    connections: int = 4,
+    chunk_size: int = DEFAULT_CHUNK_SIZE,
+    expected_size: int | None = None,
+    checksum: str | None = None,
+    checksum_algorithm: str = "sha256",
+    timeout: float = 30.0,
+    retries: int = 3,
+) -> None:
+    """Downloads a file over several connections in HTTP range chunks, resumable from the '<target>.part.json' state file.
+    The result is verified against the expected size and checksum before it is moved to target_path."""
+    part_path = target_path + ".part"
+    state_path = target_path + ".part.json"
+
+    size, supports_ranges, etag = probe_remote(url, timeout)
+    if not supports_ranges or size < 0:
+        raise DownloadError(f"Server for {url} does not support range requests.")
+    if expected_size is not None and size != expected_size:
+        raise DownloadError(f"Remote file has {size} bytes, expected {expected_size}.")
+
+    done = load_state(state_path, url, size, chunk_size, etag)
+    if not os.path.exists(part_path):
+        done = set()
+
+    chunks = [(i, i * chunk_size, min(size, (i + 1) * chunk_size) - 1) for i in range((size + chunk_size - 1) // chunk_size)]
+    pending = [chunk for chunk in chunks if chunk[0] not in done]
+    vprint(verbose, f"Downloading {size / 1e9:.2f}GB in {len(chunks)} chunks over {connections} connections ({len(chunks) - len(pending)} chunks already done).")
+
+    with open(part_path, "ab") as f:
+        f.truncate(size)
+
+    lock, stop = threading.Lock(), threading.Event()
+    fd = os.open(part_path, os.O_WRONLY)
+    start_time = time.perf_counter()
+    downloaded_bytes = sum(end - start + 1 for _, start, end in pending)
+
+    def download_chunk(chunk: tuple[int, int, int]) -> None:
+        """Fetches a chunk and records it as done."""
+        chunk_idx, start, end = chunk
+        fetch_chunk(url, fd, start, end, timeout, retries, progress, stop)
+        os.fsync(fd)
+        with lock:
+            done.add(chunk_idx)
+            save_state(state_path, url, size, chunk_size, etag, done)
+
+    executor = ThreadPoolExecutor(max_workers=connections)
+    try:
+        with tqdm(total=size, initial=size - downloaded_bytes, unit="B", unit_scale=True, desc="Downloading", disable=not verbose) as progress:
+            try:
+                for future in as_completed([executor.submit(download_chunk, chunk) for chunk in pending]):
+                    future.result()
+            except BaseException:
+                # Abandon the running chunks and drop the queued ones, the finished ones stay recorded for a resume
+                stop.set()
+                executor.shutdown(wait=True, cancel_futures=True)
+                raise
+    finally:
+        executor.shutdown(wait=True)
+        os.close(fd)
+
+    elapsed = time.perf_counter() - start_time
+    vprint(verbose, f"Downloaded {downloaded_bytes / 1e6:.1f}MB in {elapsed:.1f}s ({downloaded_bytes / 1e6 / max(elapsed, 1e-9):.1f}MB/s).")
+
+    if os.path.getsize(part_path) != size:
+        raise DownloadError(f"Downloaded file has {os.path.getsize(part_path)} bytes, expected {size}.")
+    if checksum is not None:
+        actual = file_checksum(part_path, checksum_algorithm)
+        if actual != checksum.lower():
+            # The state cannot tell which chunk is corrupt, start over on the next attempt
+            os.remove(state_path)
+            raise DownloadError(f"Checksum mismatch: expected {checksum}, got {actual}.")
+        vprint(verbose, f"Verified {checksum_algorithm} checksum.")
+
+    os.replace(part_path, target_path)
+    os.remove(state_path)
@@ -0,0 +1,260 @@
+import os
+import time
+import shutil
+import subprocess
+from abc import ABC, abstractmethod
+from dataclasses import dataclass
+from enum import Enum
+from typing import Iterator
+
+import cv2
+import numpy as np
+
+try:
+    import av # type: ignore
+except ImportError:
+    av = None
+
+
+MATCH_TOLERANCE = 2.0 # max mean absolute pixel difference to the OpenCV reference, backends differ slightly in YUV to BGR conversion
+
+
+class DecoderBackend(Enum):
+    AUTO = "auto"
+    OPENCV = "opencv"
+    PYAV = "pyav"
+    FFMPEG = "ffmpeg"
+
+@dataclass
+class DecoderBenchmarkResult():
+    """Decode speed and correctness of a single backend on a sample of videos."""
+    backend: DecoderBackend
+    frames: int
+    decode_fps: float
+    correct: bool       # exact frame count and frames matching the OpenCV reference
+    error: str | None = None
+
+
+class VideoDecoder(ABC):
+    """Sequential BGR frame reader over a single video, subclassed per backend."""
+    counts_packets = False # whether count_frames only reads the packets instead of decoding every frame
+
+    def __init__(self, path: str):
+        self.path = path
+        # Container metadata is reliable for resolution and fps, the frame count is only an estimate on some encodes
+        cap = cv2.VideoCapture(path)
+        if not cap.isOpened():
+            raise IOError(f"Could not open video '{path}'.")
+        self.width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
+        self.height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+        self.fps = float(cap.get(cv2.CAP_PROP_FPS))
+        self.frame_count_estimate = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+        cap.release()
+
+    @abstractmethod
+    def frames(self, start: int = 0) -> Iterator[np.ndarray]:
+        """Yields the frames from frame index start to the end of the video."""
+
+    @abstractmethod
+    def count_frames(self) -> int:
+        """Returns the exact amount of frames of the video."""
+
+    def frame_count(self, exact: bool = False) -> int:
+        """Returns the exact amount of frames if the backend counts them from packets or exact is set, else the container's estimate."""
+        if exact or self.counts_packets:
+            return self.count_frames()
+        return self.frame_count_estimate
+
+    def read(self, frame_idx: int) -> np.ndarray:
+        """Returns a single frame."""
+        frames = self.frames(frame_idx)
+        try:
+            return next(frames)
+        except StopIteration:
+            raise IndexError(f"Frame {frame_idx} is out of range for '{self.path}'.")
+        finally:
+            frames.close()
+
+    def close(self) -> None:
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+class OpenCVDecoder(VideoDecoder):
+    """Decodes with cv2.VideoCapture, counting frames by grabbing them instead of trusting CAP_PROP_FRAME_COUNT."""
+    def frames(self, start: int = 0) -> Iterator[np.ndarray]:
+        cap = cv2.VideoCapture(self.path)
+        try:
+            position = 0
+            if start > 0:
+                cap.set(cv2.CAP_PROP_POS_FRAMES, start)
+                position = int(cap.get(cv2.CAP_PROP_POS_FRAMES))
+                if position != start:
+                    # Seeking is not supported by this encode, decode forward from the start
+                    cap.release()
+                    cap = cv2.VideoCapture(self.path)
+                    position = 0
+            while position < start:
+                if not cap.grab():
+                    return
+                position += 1
+
+            while True:
+                success, frame = cap.read()
+                if not success:
+                    return
+                yield frame
+        finally:
+            cap.release()
+
+    def count_frames(self) -> int:
+        cap = cv2.VideoCapture(self.path)
+        count = 0
+        while cap.grab():
+            count += 1
+        cap.release()
+        return count
+
+
+class PyAVDecoder(VideoDecoder):
+    """Decodes with PyAV on FFmpeg's frame threads, counting frames from the demuxed packets."""
+    counts_packets = True
+
+    def __init__(self, path: str):
+        if av is None:
+            raise ImportError("PyAV is not installed, install it with 'pip install av'.")
+        super().__init__(path)
+
+    def frames(self, start: int = 0) -> Iterator[np.ndarray]:
+        with av.open(self.path) as container:
+            stream = container.streams.video[0]
+            stream.thread_type = "AUTO"
+            time_base = float(stream.time_base)
+            start_pts = stream.start_time or 0
+
+            if start > 0:
+                # Seek to the keyframe before the target and decode forward to it
+                container.seek(start_pts + int(start / self.fps / time_base), stream=stream, backward=True, any_frame=False)
+
+            for frame in container.decode(stream):
+                if start > 0 and frame.pts is not None and round((frame.pts - start_pts) * time_base * self.fps) < start:
+                    continue
+                yield frame.to_ndarray(format="bgr24")
+
+    def count_frames(self) -> int:
+        with av.open(self.path) as container:
+            stream = container.streams.video[0]
+            return sum(1 for packet in container.demux(stream) if packet.size > 0)
+
+
+class FFmpegDecoder(VideoDecoder):
+    """Decodes in an ffmpeg subprocess that pipes raw BGR frames, keeping decoding off the Python thread."""
+    counts_packets = True
+
+    def __init__(self, path: str, ffmpeg_path: str | None = None):
+        self.ffmpeg_path = ffmpeg_path if ffmpeg_path is not None else find_ffmpeg()
+        if self.ffmpeg_path is None:
+            raise FileNotFoundError("ffmpeg was not found on the PATH.")
+        super().__init__(path)
+
+    def frames(self, start: int = 0) -> Iterator[np.ndarray]:
+        seek = ["-ss", f"{start / self.fps:.6f}"] if start > 0 else []
+        command = [self.ffmpeg_path, "-v", "error", "-nostdin", *seek, "-i", self.path, "-map", "0:v:0", "-vsync", "passthrough", "-f", "rawvideo", "-pix_fmt", "bgr24", "-"]
+        frame_bytes = self.width * self.height * 3
+
+        process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, bufsize=frame_bytes * 4)
+        try:
+            while True:
+                buffer = process.stdout.read(frame_bytes)
+                if len(buffer) < frame_bytes:
+                    return
+                yield np.frombuffer(buffer, dtype=np.uint8).reshape(self.height, self.width, 3)
+        finally:
+            process.stdout.close()
+            process.kill()
+            process.wait()
+
+    def count_frames(self) -> int:
+        # Stream copy into the framecrc muxer writes one line per packet without decoding it
+        command = [self.ffmpeg_path, "-v", "error", "-nostdin", "-i", self.path, "-map", "0:v:0", "-c", "copy", "-f", "framecrc", "-"]
+        output = subprocess.run(command, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, check=True, text=True).stdout
+        return sum(1 for line in output.splitlines() if line and not line.startswith("#"))
+
+
+DECODERS = {
+    DecoderBackend.OPENCV: OpenCVDecoder,
+    DecoderBackend.PYAV: PyAVDecoder,
+    DecoderBackend.FFMPEG: FFmpegDecoder,
+}
+
+
+def find_ffmpeg() -> str | None:
+    """Returns the ffmpeg executable from the FFMPEG_BINARY environment variable or the PATH."""
+    return os.environ.get("FFMPEG_BINARY") or shutil.which("ffmpeg")
+
+def available_backends() -> list[DecoderBackend]:
+    """Returns the backends whose dependencies are installed."""
+    backends = [DecoderBackend.OPENCV]
+    if av is not None:
+        backends.append(DecoderBackend.PYAV)
+    if find_ffmpeg() is not None:
+        backends.append(DecoderBackend.FFMPEG)
+    return backends
+
+def open_decoder(path: str, backend: DecoderBackend = DecoderBackend.OPENCV) -> VideoDecoder:
+    """Opens a video with the given backend, AUTO has to be resolved with select_backend first."""
+    if backend == DecoderBackend.AUTO:
+        raise ValueError("Resolve DecoderBackend.AUTO with select_backend before opening a video.")
+    return DECODERS[backend](path)
+
+def benchmark_decoders(video_paths: list[str], backends: list[DecoderBackend] | None = None, max_frames: int = 300) -> list[DecoderBenchmarkResult]:
+    """Measures the decode fps of each backend over the first max_frames frames of the videos.
+    A backend is correct if its exact frame count matches the decoded frames and its frames match the OpenCV reference."""
+    backends = backends if backends is not None else available_backends()
+
+    reference = {}
+    for path in video_paths:
+        with open_decoder(path, DecoderBackend.OPENCV) as decoder:
+            count = decoder.count_frames()
+            middle = min(max_frames, count) // 2
+            reference[path] = (count, [frame for _, frame in zip(range(max_frames), decoder.frames())], middle, decoder.read(middle))
+
+    results = []
+    for backend in backends:
+        frames, elapsed, correct, error = 0, 0.0, True, None
+        try:
+            for path in video_paths:
+                expected_count, expected_frames, middle, expected_middle = reference[path]
+                with open_decoder(path, backend) as decoder:
+                    start = time.perf_counter()
+                    decoded = [frame for _, frame in zip(range(max_frames), decoder.frames())]
+                    elapsed += time.perf_counter() - start
+                    frames += len(decoded)
+
+                    matches = len(decoded) == len(expected_frames) and all(
+                        np.abs(frame.astype(np.int16) - expected.astype(np.int16)).mean() <= MATCH_TOLERANCE for frame, expected in zip(decoded, expected_frames)
+                    )
+                    seek_matches = np.abs(decoder.read(middle).astype(np.int16) - expected_middle.astype(np.int16)).mean() <= MATCH_TOLERANCE
+                    correct = correct and matches and seek_matches and decoder.count_frames() == expected_count
+        except Exception as e:
+            correct, error = False, str(e)
+
+        results.append(DecoderBenchmarkResult(backend, frames, frames / max(elapsed, 1e-9), correct, error))
+
+    print(f"{'Backend':<10}{'Frames':>8}{'Decode fps':>12}{'Correct':>9}")
+    for result in results:
+        print(f"{result.backend.value:<10}{result.frames:>8}{result.decode_fps:>12.1f}{'yes' if result.correct else 'no':>9}")
+
+    return results
+
+def select_backend(video_paths: list[str], max_frames: int = 300) -> DecoderBackend:
+    """Benchmarks the available backends on the videos and returns the fastest correct one, OpenCV if none is."""
+    results = [result for result in benchmark_decoders(video_paths, max_frames=max_frames) if result.correct]
+    if not results:
+        return DecoderBackend.OPENCV
+    return max(results, key=lambda result: result.decode_fps).backend
@@ -1,13 +1,30 @@
 import gdown
 import zipfile
 import os
+from urllib.error import URLError
 
 from uav.setup.utils import vprint
+from uav.setup.chunked_download import chunked_download, file_checksum, DownloadError
 
 
-def download(url: str, zip_path: str, verbose: bool) -> None:
-    """Downloads file from Google Drive URL to specified path."""
-    gdown.download(url, zip_path, quiet=False)
+def download(url: str, zip_path: str, verbose: bool, mirror_url: str | None = None, checksum: str | None = None, connections: int = 4) -> None:
+    """Downloads file from Google Drive URL to specified path.
+    If a direct mirror_url is given, it is fetched first with the resumable chunked downloader, falling back to Google Drive on failure.
+    With a checksum, the Google Drive download is verified as well and removed on a mismatch."""
+    if mirror_url is not None:
+        try:
+            chunked_download(mirror_url, zip_path, verbose, connections=connections, checksum=checksum)
+        except (DownloadError, URLError, OSError) as e:
+            vprint(verbose, f"Chunked download failed: {e}")
+            vprint(verbose, "Falling back to Google Drive download.")
+
+    if not os.path.exists(zip_path):
+        gdown.download(url, zip_path, quiet=False)
+        if checksum is not None and os.path.exists(zip_path):
+            actual = file_checksum(zip_path)
+            if actual != checksum.lower():
+                vprint(verbose, f"Checksum mismatch: expected {checksum}, got {actual}.")
+                os.remove(zip_path)
 
     if not os.path.exists(zip_path):
         vprint(verbose, "The dataset could not be downloaded sucessfully.")
@@ -36,13 +53,15 @@ def download_and_extract(url: str,
     zip_path: str,
     extract_dir: str,
     verbose: bool,
-    remove_zip: bool
+    remove_zip: bool,
+    mirror_url: str | None = None,
+    checksum: str | None = None,
 ) -> bool:
     """Downloads and extracts dataset from Google Drive, returns True on success."""
     try:
         os.makedirs("datasets", exist_ok=True)
         
-        download(url, zip_path, verbose)
+        download(url, zip_path, verbose, mirror_url, checksum)
         extract(zip_path, extract_dir, verbose, remove_zip)
 
         vprint(verbose, f"Dataset was downloaded and extracted to {extract_dir}.")
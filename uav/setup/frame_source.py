@@ -0,0 +1,263 @@
+import os
+import json
+from collections import OrderedDict
+from dataclasses import dataclass, asdict
+
+import cv2
+import numpy as np
+from tqdm import tqdm
+
+try:
+    import av # type: ignore
+except ImportError:
+    av = None
+
+from uav.setup.utils import vprint
+from uav.setup.process_data import format_label
+from uav.setup.frame_store import parse_frame_filename
+from uav.setup.decoders import OpenCVDecoder
+from uav.setup.label_index import MODALITY_FILES
+from uav.experiments.splits import load_folds
+
+
+@dataclass
+class VideoProbe():
+    """Cached metadata and seek table of a single source video."""
+    path: str
+    size: int
+    mtime: float
+    width: int
+    height: int
+    fps: float
+    frame_count: int
+    keyframes: list[int]
+
+def probe_video(video_path: str) -> VideoProbe:
+    """Probes resolution, fps, frame count and keyframe positions of a video.
+    Keyframes and the frame count are read from the demuxed packets if PyAV is installed, otherwise only frame 0 is known to be seekable."""
+    stat = os.stat(video_path)
+
+    cap = cv2.VideoCapture(video_path)
+    width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
+    height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+    fps = float(cap.get(cv2.CAP_PROP_FPS))
+    frame_count = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+    cap.release()
+
+    keyframes = [0]
+    if av is None:
+        # CAP_PROP_FRAME_COUNT is only an estimate from the container, count by grabbing
+        frame_count = OpenCVDecoder(video_path).count_frames()
+    else:
+        # Demuxing only, no decoding: packets in decode order map to frame indices for the Anti-UAV H.264 streams without B-frame reordering
+        with av.open(video_path) as container:
+            stream = container.streams.video[0]
+            packet_keyframes, packet_count = [], 0
+            for packet in container.demux(stream):
+                if packet.size == 0:
+                    continue
+                if packet.is_keyframe:
+                    packet_keyframes.append(packet_count)
+                packet_count += 1
+        if packet_count > 0:
+            keyframes, frame_count = packet_keyframes or [0], packet_count
+
+    return VideoProbe(video_path, stat.st_size, stat.st_mtime, width, height, fps, frame_count, keyframes)
+
+def load_annotations(json_path: str) -> dict:
+    """Loads the exist flags and bounding boxes of a sequence modality."""
+    with open(json_path, "r") as f:
+        return json.load(f)
+
+
+class FrameSource:
+    """Serves frames and labels straight from the raw Anti-UAV MP4/JSON tree without bulk extraction.
+
+    The videos are probed once and the probes are cached next to the source tree. Frames are decoded on
+    demand from the nearest keyframe, and the most recently decoded frames are kept in an LRU cache."""
+    def __init__(self, source_dir: str, index_path: str | None = None, cache_size: int = 256, max_open_videos: int = 8):
+        self.source_dir = source_dir
+        self.index_path = index_path if index_path is not None else os.path.join(source_dir, "frame_source_index.json")
+        self.cache_size = cache_size
+        self.max_open_videos = max_open_videos
+
+        self.probes: dict[str, dict[str, VideoProbe]] = {}
+        self.sequence_dirs: dict[str, str] = {}
+        self.annotations: dict[tuple[str, str], dict] = {}
+        self.frame_cache: OrderedDict = OrderedDict() # (sequence, modality_str, frame_idx) : frame
+        self.captures: OrderedDict = OrderedDict() # (sequence, modality_str) : [cv2.VideoCapture, next frame_idx]
+
+        self.index()
+
+    def index(self, verbose: bool = False) -> None:
+        """Probes all source videos, reusing cached probes of unchanged videos."""
+        cached = {}
+        if os.path.exists(self.index_path):
+            with open(self.index_path, "r") as f:
+                cached = json.load(f)
+
+        for subset_dirname in ["test", "train", "val"]:
+            subset_dir = os.path.join(self.source_dir, subset_dirname)
+            if not os.path.exists(subset_dir):
+                continue
+            for sequence_dirname in sorted(os.listdir(subset_dir)):
+                if sequence_dirname == ".DS_Store":
+                    continue
+                self.sequence_dirs[sequence_dirname] = os.path.join(subset_dir, sequence_dirname)
+
+        changed = False
+        for sequence, sequence_dir in tqdm(self.sequence_dirs.items(), desc="Indexing videos", disable=not verbose):
+            self.probes[sequence] = {}
+            for modality_str, file_stem in MODALITY_FILES.items():
+                video_path = os.path.join(sequence_dir, f"{file_stem}.mp4")
+                stat = os.stat(video_path)
+
+                probe = cached.get(sequence, {}).get(modality_str)
+                if probe is not None and probe["size"] == stat.st_size and probe["mtime"] == stat.st_mtime:
+                    self.probes[sequence][modality_str] = VideoProbe(**probe)
+                else:
+                    self.probes[sequence][modality_str] = probe_video(video_path)
+                    changed = True
+
+        if changed:
+            with open(self.index_path, "w") as f:
+                json.dump({sequence: {m: asdict(p) for m, p in probes.items()} for sequence, probes in self.probes.items()}, f)
+
+    def sequences(self) -> list[str]:
+        """Returns all indexed sequences."""
+        return sorted(self.probes)
+
+    def frame_count(self, sequence: str, modality_str: str) -> int:
+        """Returns the amount of frames of a sequence modality."""
+        return self.probes[sequence][modality_str].frame_count
+
+    def resolution(self, sequence: str, modality_str: str) -> tuple[int, int]:
+        """Returns the (width, height) of a sequence modality."""
+        probe = self.probes[sequence][modality_str]
+        return probe.width, probe.height
+
+    def sequence_annotations(self, sequence: str, modality_str: str) -> dict:
+        """Returns the cached exist flags and bounding boxes of a sequence modality."""
+        key = (sequence, modality_str)
+        if key not in self.annotations:
+            self.annotations[key] = load_annotations(os.path.join(self.sequence_dirs[sequence], f"{MODALITY_FILES[modality_str]}.json"))
+        return self.annotations[key]
+
+    def label(self, sequence: str, modality_str: str, frame_idx: int) -> str:
+        """Returns the YOLO label line of a frame, empty if no object is present."""
+        data = self.sequence_annotations(sequence, modality_str)
+        if frame_idx >= len(data["exist"]):
+            return ""
+        return format_label(data["exist"][frame_idx], data["gt_rect"][frame_idx], self.resolution(sequence, modality_str))
+
+    def open_capture(self, sequence: str, modality_str: str) -> list:
+        """Returns the open capture of a video and its next frame index, closing the least recently used one if too many are open."""
+        key = (sequence, modality_str)
+        if key in self.captures:
+            self.captures.move_to_end(key)
+            return self.captures[key]
+
+        if len(self.captures) >= self.max_open_videos:
+            _, (cap, _) = self.captures.popitem(last=False)
+            cap.release()
+
+        self.captures[key] = [cv2.VideoCapture(self.probes[sequence][modality_str].path), 0]
+        return self.captures[key]
+
+    def seek(self, sequence: str, modality_str: str, frame_idx: int) -> cv2.VideoCapture:
+        """Positions the capture of a video at frame_idx, decoding forward from the nearest keyframe if necessary."""
+        capture = self.open_capture(sequence, modality_str)
+        cap, position = capture
+
+        keyframes = self.probes[sequence][modality_str].keyframes
+        keyframe = keyframes[int(np.searchsorted(keyframes, frame_idx, side="right")) - 1]
+
+        # Only jump if decoding forward from the current position would pass a closer keyframe
+        if position > frame_idx or position < keyframe:
+            if keyframe == 0:
+                cap.release()
+                cap = cv2.VideoCapture(self.probes[sequence][modality_str].path)
+                capture[0] = cap
+            else:
+                cap.set(cv2.CAP_PROP_POS_FRAMES, keyframe)
+            position = keyframe
+
+        while position < frame_idx:
+            if not cap.grab():
+                raise IndexError(f"Frame {frame_idx} is out of range for {sequence} ({modality_str}).")
+            position += 1
+
+        capture[1] = position
+        return cap
+
+    def read(self, sequence: str, modality_str: str, frame_idx: int) -> np.ndarray:
+        """Returns a single decoded frame."""
+        key = (sequence, modality_str, frame_idx)
+        if key in self.frame_cache:
+            self.frame_cache.move_to_end(key)
+            return self.frame_cache[key]
+
+        cap = self.seek(sequence, modality_str, frame_idx)
+        success, frame = cap.read()
+        if not success:
+            raise IndexError(f"Frame {frame_idx} is out of range for {sequence} ({modality_str}).")
+        self.captures[(sequence, modality_str)][1] = frame_idx + 1
+
+        self.frame_cache[key] = frame
+        if len(self.frame_cache) > self.cache_size:
+            self.frame_cache.popitem(last=False)
+        return frame
+
+    def materialize_many(self, image_filepaths: list[str], target_image_paths: list[str], target_label_paths: list[str] | None = None) -> None:
+        """Writes the frames (and labels) addressed by loose-file image paths, decoding each video once in frame order."""
+        requests = sorted(range(len(image_filepaths)), key=lambda i: parse_frame_filename(image_filepaths[i]))
+
+        for i in requests:
+            sequence, modality_str, frame_idx = parse_frame_filename(image_filepaths[i])
+
+            # Label before image, so that an existing image always comes with its label
+            if target_label_paths is not None:
+                with open(target_label_paths[i], "w") as f:
+                    f.write(self.label(sequence, modality_str, frame_idx))
+
+            cv2.imwrite(target_image_paths[i], self.read(sequence, modality_str, frame_idx))
+
+    def close(self) -> None:
+        """Releases all open captures and drops the frame cache."""
+        for cap, _ in self.captures.values():
+            cap.release()
+        self.captures.clear()
+        self.frame_cache.clear()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+def extract_split_frames(frame_source: FrameSource, splits_filepath: str, verbose: bool) -> int:
+    """Extract only the frames (VZ and IR) and labels referenced by a split file, at the paths stored in it.
+    Frames that already exist are skipped. Returns the amount of frames extracted."""
+    splits = load_folds(splits_filepath)
+
+    image_filepaths = set()
+    for split in splits:
+        for filepath in split['filepaths']:
+            sequence, _, frame_idx = parse_frame_filename(filepath)
+            for modality_str in MODALITY_FILES:
+                image_filepaths.add(os.path.join(os.path.dirname(filepath), f"{sequence}-{modality_str}-{frame_idx:08d}.jpg"))
+
+    pending = sorted(filepath for filepath in image_filepaths if not os.path.exists(filepath))
+    vprint(verbose, f"{len(image_filepaths)} frames referenced by the splits, {len(pending)} remaining to extract.")
+
+    label_filepaths = [filepath.replace("images", "labels").replace(".jpg", ".txt") for filepath in pending]
+    for filepath in pending + label_filepaths:
+        os.makedirs(os.path.dirname(filepath), exist_ok=True)
+
+    # Sorted by sequence, modality and frame, so that every video is decoded forward once
+    batch_size = frame_source.cache_size
+    for start in tqdm(range(0, len(pending), batch_size), desc="Extracting split frames", disable=not verbose):
+        batch = pending[start:start + batch_size]
+        frame_source.materialize_many(batch, batch, label_filepaths[start:start + batch_size])
+    return len(pending)
@@ -0,0 +1,347 @@
+import os
+import json
+import time
+from dataclasses import dataclass
+from enum import Enum
+
+import cv2
+import numpy as np
+
+from uav.setup.decoders import DecoderBackend, open_decoder
+
+
+SHARD_META_FILENAME = "meta.json"
+GRAYSCALE_TOLERANCE = 2 # max channel difference of a frame still considered grayscale, video compression leaves small chroma noise
+
+
+class Codec(Enum):
+    JPEG = "jpg"
+    PNG = "png"
+    WEBP = "webp"
+    RAW = "raw"
+
+@dataclass
+class CodecBenchmarkResult():
+    """Size and speed of a single codec on a sample of frames."""
+    codec: Codec
+    quality: int | None
+    frames: int
+    bytes_per_frame: float
+    encode_fps: float
+    decode_fps: float
+
+@dataclass
+class GrayscaleBenchmarkResult():
+    """Size and speed of a video's frames stored as 3-channel BGR against 1-channel grayscale."""
+    source: str
+    grayscale: bool         # whether the first frame was detected as grayscale
+    frames: int
+    bgr_bytes_per_frame: float
+    gray_bytes_per_frame: float
+    bgr_encode_fps: float
+    gray_encode_fps: float
+    bgr_decode_fps: float
+    gray_decode_fps: float
+
+def encode_params(codec: Codec, quality: int | None) -> list[int]:
+    """Returns the OpenCV imencode parameters for the codec, empty for the OpenCV defaults."""
+    if quality is None:
+        return []
+    if codec == Codec.JPEG:
+        return [cv2.IMWRITE_JPEG_QUALITY, quality]
+    if codec == Codec.WEBP:
+        return [cv2.IMWRITE_WEBP_QUALITY, quality]
+    if codec == Codec.PNG:
+        return [cv2.IMWRITE_PNG_COMPRESSION, quality] # compression level 0-9 instead of a quality
+    return []
+
+def encode_frame(frame: np.ndarray, codec: Codec, quality: int | None = None) -> bytes:
+    """Encodes a decoded frame to bytes with the given codec."""
+    if codec == Codec.RAW:
+        return np.ascontiguousarray(frame).tobytes()
+
+    success, buffer = cv2.imencode(f".{codec.value}", frame, encode_params(codec, quality))
+    if not success:
+        raise IOError(f"Could not encode frame with codec {codec.value}.")
+    return buffer.tobytes()
+
+def decode_frame(buffer: bytes, codec: Codec, shape: tuple[int, ...]) -> np.ndarray:
+    """Decodes bytes produced by encode_frame back into a frame of the given shape."""
+    if codec == Codec.RAW:
+        return np.frombuffer(buffer, dtype=np.uint8).reshape(shape)
+    return cv2.imdecode(np.frombuffer(buffer, dtype=np.uint8), cv2.IMREAD_UNCHANGED)
+
+def resized_resolution(width: int, height: int, long_side: int | None) -> tuple[int, int]:
+    """Returns the resolution of a frame downscaled to the given long side, unchanged if it is already smaller or long_side is None."""
+    if long_side is None or max(width, height) <= long_side:
+        return width, height
+    scale = long_side / max(width, height)
+    return max(1, round(width * scale)), max(1, round(height * scale))
+
+def resize_frame(frame: np.ndarray, long_side: int | None) -> np.ndarray:
+    """Downscales a frame to the given long side keeping its aspect ratio, so that normalized YOLO labels stay valid."""
+    height, width = frame.shape[:2]
+    target_width, target_height = resized_resolution(width, height, long_side)
+    if (target_width, target_height) == (width, height):
+        return frame
+    return cv2.resize(frame, (target_width, target_height), interpolation=cv2.INTER_AREA)
+
+def is_grayscale(frame: np.ndarray, tolerance: int = GRAYSCALE_TOLERANCE) -> bool:
+    """Returns whether all channels of a BGR frame are equal up to the tolerance."""
+    if frame.ndim == 2:
+        return True
+    return int(cv2.absdiff(frame[:, :, 0], frame[:, :, 1]).max()) <= tolerance and int(cv2.absdiff(frame[:, :, 1], frame[:, :, 2]).max()) <= tolerance
+
+def to_grayscale(frame: np.ndarray) -> np.ndarray:
+    """Converts a BGR frame to a single channel, 1-channel frames are returned unchanged."""
+    return frame if frame.ndim == 2 else cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+
+def expand_channels(frame: np.ndarray) -> np.ndarray:
+    """Expands a 1-channel frame to 3-channel BGR as expected by the model, BGR frames are returned unchanged."""
+    return cv2.cvtColor(frame, cv2.COLOR_GRAY2BGR) if frame.ndim == 2 else frame
+
+def shard_paths(shard_dir: str, modality_str: str) -> tuple[str, str]:
+    """Returns the blob and offset index filepaths of a modality shard."""
+    return os.path.join(shard_dir, f"{modality_str}.bin"), os.path.join(shard_dir, f"{modality_str}.idx.npy")
+
+def write_shard(source_mp4: str, shard_dir: str, modality_str: str, codec: Codec = Codec.JPEG, quality: int | None = None, long_side: int | None = None, grayscale: bool = False, decoder_backend: DecoderBackend = DecoderBackend.OPENCV) -> tuple[int, tuple[int, int]]:
+    """Extract the frames from the mp4 video into a single encoded-frame blob plus offset index, downscaled to long_side if given.
+    If grayscale is set and the first frame is grayscale, all frames are stored with a single channel.
+    Returns the amount of frames extracted and the original resolution."""
+    decoder = open_decoder(source_mp4, decoder_backend)
+    width, height = decoder.width, decoder.height
+
+    blob_path, index_path = shard_paths(shard_dir, modality_str)
+    offsets = [0]
+    shape = (*resized_resolution(width, height, long_side)[::-1], 3)
+    single_channel = None
+
+    frames = decoder.frames()
+    try:
+        with open(blob_path, "wb") as blob:
+            for frame in frames:
+                frame = resize_frame(frame, long_side)
+                if single_channel is None:
+                    single_channel = grayscale and is_grayscale(frame)
+                if single_channel:
+                    frame = to_grayscale(frame)
+                shape = frame.shape
+
+                buffer = encode_frame(frame, codec, quality)
+                blob.write(buffer)
+                offsets.append(offsets[-1] + len(buffer))
+    finally:
+        frames.close()
+        decoder.close()
+
+    # offsets[i]:offsets[i+1] is the byte range of frame i
+    np.save(index_path, np.asarray(offsets, dtype=np.int64))
+
+    meta_path = os.path.join(shard_dir, SHARD_META_FILENAME)
+    meta = {}
+    if os.path.exists(meta_path):
+        with open(meta_path, "r") as f:
+            meta = json.load(f)
+
+    meta[modality_str] = {
+        "codec": codec.value,
+        "quality": quality,
+        "frames": len(offsets) - 1,
+        "shape": list(shape),
+    }
+    with open(meta_path, "w") as f:
+        json.dump(meta, f, indent=4)
+
+    return len(offsets) - 1, (width, height)
+
+def count_shard_frames(shard_dir: str) -> int | None:
+    """Returns the total amount of frames stored in a sequence shard directory, None if it is not a shard."""
+    meta_path = os.path.join(shard_dir, SHARD_META_FILENAME)
+    if not os.path.exists(meta_path):
+        return None
+
+    with open(meta_path, "r") as f:
+        meta = json.load(f)
+
+    total = 0
+    for modality_str, modality_meta in meta.items():
+        blob_path, index_path = shard_paths(shard_dir, modality_str)
+        if not os.path.exists(blob_path) or not os.path.exists(index_path):
+            return None
+        total += modality_meta["frames"]
+    return total
+
+def parse_frame_filename(filepath: str) -> tuple[str, str, int]:
+    """Parses '<sequence>-<modality>-<frame_idx>.<ext>' into (sequence, modality, frame_idx)."""
+    stem = os.path.splitext(os.path.basename(filepath))[0]
+    sequence, modality_str, frame_idx = stem.rsplit("-", 2)
+    return sequence, modality_str, int(frame_idx)
+
+
+class FrameStore:
+    """Random-access reader over per-sequence frame shards, reading each frame with a single pread."""
+    def __init__(self, images_dir: str):
+        self.images_dir = images_dir
+        self.meta = {}
+        self.indices = {}
+        self.fds = {}
+
+    def sequences(self) -> list[str]:
+        """Returns all sequences stored as shards."""
+        return sorted(
+            sequence for sequence in os.listdir(self.images_dir)
+            if os.path.exists(os.path.join(self.images_dir, sequence, SHARD_META_FILENAME))
+        )
+
+    def sequence_meta(self, sequence: str) -> dict:
+        """Returns the cached shard metadata of a sequence."""
+        if sequence not in self.meta:
+            with open(os.path.join(self.images_dir, sequence, SHARD_META_FILENAME), "r") as f:
+                self.meta[sequence] = json.load(f)
+        return self.meta[sequence]
+
+    def frame_count(self, sequence: str, modality_str: str) -> int:
+        """Returns the amount of frames of a sequence modality."""
+        return self.sequence_meta(sequence)[modality_str]["frames"]
+
+    def open(self, sequence: str, modality_str: str) -> tuple[int, np.ndarray]:
+        """Returns the cached blob file descriptor and memory-mapped offset index of a sequence modality."""
+        key = (sequence, modality_str)
+        if key not in self.fds:
+            blob_path, index_path = shard_paths(os.path.join(self.images_dir, sequence), modality_str)
+            self.indices[key] = np.load(index_path, mmap_mode="r")
+            self.fds[key] = os.open(blob_path, os.O_RDONLY)
+        return self.fds[key], self.indices[key]
+
+    def read_bytes(self, sequence: str, modality_str: str, frame_idx: int) -> bytes:
+        """Returns the encoded bytes of a single frame."""
+        fd, offsets = self.open(sequence, modality_str)
+        start, end = int(offsets[frame_idx]), int(offsets[frame_idx + 1])
+        return os.pread(fd, end - start, start)
+
+    def read(self, sequence: str, modality_str: str, frame_idx: int, bgr: bool = False) -> np.ndarray:
+        """Returns a single decoded frame as stored (1-channel for grayscale shards), or expanded to 3 channels if bgr is set."""
+        modality_meta = self.sequence_meta(sequence)[modality_str]
+        buffer = self.read_bytes(sequence, modality_str, frame_idx)
+        frame = decode_frame(buffer, Codec(modality_meta["codec"]), tuple(modality_meta["shape"]))
+        return expand_channels(frame) if bgr else frame
+
+    def materialize(self, filepath: str, target_path: str) -> None:
+        """Writes the frame addressed by a loose-file image path to target_path, without re-encoding when the codecs match."""
+        sequence, modality_str, frame_idx = parse_frame_filename(filepath)
+        codec = Codec(self.sequence_meta(sequence)[modality_str]["codec"])
+
+        if codec.value == os.path.splitext(target_path)[1][1:]:
+            with open(target_path, "wb") as f:
+                f.write(self.read_bytes(sequence, modality_str, frame_idx))
+        else:
+            cv2.imwrite(target_path, self.read(sequence, modality_str, frame_idx))
+
+    def close(self) -> None:
+        """Closes all open shard file descriptors."""
+        for fd in self.fds.values():
+            os.close(fd)
+        self.fds, self.indices = {}, {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+def benchmark_codecs(source_mp4: str, codecs: list[tuple[Codec, int | None]] | None = None, max_frames: int = 200) -> list[CodecBenchmarkResult]:
+    """Measures encoded size against encode and decode speed of each (codec, quality) on the first max_frames frames of a video."""
+    if codecs is None:
+        codecs = [(Codec.JPEG, 95), (Codec.JPEG, 85), (Codec.PNG, 3), (Codec.WEBP, 90), (Codec.RAW, None)]
+
+    frames = read_sample_frames(source_mp4, max_frames)
+
+    results = []
+    for codec, quality in codecs:
+        pre_encode = time.perf_counter()
+        buffers = [encode_frame(frame, codec, quality) for frame in frames]
+        post_encode = time.perf_counter()
+        for buffer, frame in zip(buffers, frames):
+            decode_frame(buffer, codec, frame.shape)
+        post_decode = time.perf_counter()
+
+        results.append(CodecBenchmarkResult(
+            codec=codec,
+            quality=quality,
+            frames=len(frames),
+            bytes_per_frame=sum(len(buffer) for buffer in buffers) / len(frames),
+            encode_fps=len(frames) / max(post_encode - pre_encode, 1e-9),
+            decode_fps=len(frames) / max(post_decode - post_encode, 1e-9),
+        ))
+
+    print(f"{'Codec':<8}{'Quality':>8}{'KB/frame':>12}{'Encode fps':>12}{'Decode fps':>12}")
+    for result in results:
+        print(f"{result.codec.value:<8}{str(result.quality):>8}{result.bytes_per_frame / 1024:>12.1f}{result.encode_fps:>12.1f}{result.decode_fps:>12.1f}")
+
+    return results
+
+def read_sample_frames(source_mp4: str, max_frames: int) -> list[np.ndarray]:
+    """Decodes the first max_frames frames of a video."""
+    cap = cv2.VideoCapture(source_mp4)
+    frames = []
+    while len(frames) < max_frames:
+        success, frame = cap.read()
+        if not success:
+            break
+        frames.append(frame)
+    cap.release()
+
+    if not frames:
+        raise RuntimeError(f"Could not decode any frames from '{source_mp4}'.")
+    return frames
+
+def benchmark_grayscale(source_mp4: str, codec: Codec = Codec.JPEG, quality: int | None = None, max_frames: int = 100) -> GrayscaleBenchmarkResult:
+    """Measures encoded size and encode/decode speed of the first max_frames frames of a video stored as BGR against 1-channel grayscale."""
+    frames = read_sample_frames(source_mp4, max_frames)
+    measurements = {}
+    for name, sample in [("bgr", frames), ("gray", [to_grayscale(frame) for frame in frames])]:
+        pre_encode = time.perf_counter()
+        buffers = [encode_frame(frame, codec, quality) for frame in sample]
+        post_encode = time.perf_counter()
+        for buffer, frame in zip(buffers, sample):
+            decode_frame(buffer, codec, frame.shape)
+        post_decode = time.perf_counter()
+        measurements[name] = (
+            sum(len(buffer) for buffer in buffers) / len(sample),
+            len(sample) / max(post_encode - pre_encode, 1e-9),
+            len(sample) / max(post_decode - post_encode, 1e-9),
+        )
+
+    return GrayscaleBenchmarkResult(
+        source=source_mp4,
+        grayscale=is_grayscale(frames[0]),
+        frames=len(frames),
+        bgr_bytes_per_frame=measurements["bgr"][0],
+        gray_bytes_per_frame=measurements["gray"][0],
+        bgr_encode_fps=measurements["bgr"][1],
+        gray_encode_fps=measurements["gray"][1],
+        bgr_decode_fps=measurements["bgr"][2],
+        gray_decode_fps=measurements["gray"][2],
+    )
+
+def grayscale_report(source_dir: str, codec: Codec = Codec.JPEG, quality: int | None = None, max_frames: int = 100) -> dict[str, GrayscaleBenchmarkResult]:
+    """Benchmarks 1-channel storage of the infrared video of every raw sequence and prints the size and throughput gains per sequence."""
+    results = {}
+    for subset_dirname in ["test", "train", "val"]:
+        subset_dir = os.path.join(source_dir, subset_dirname)
+        if not os.path.exists(subset_dir):
+            continue
+        for sequence_dirname in sorted(os.listdir(subset_dir)):
+            if sequence_dirname == ".DS_Store":
+                continue
+            results[sequence_dirname] = benchmark_grayscale(os.path.join(subset_dir, sequence_dirname, "infrared.mp4"), codec, quality, max_frames)
+
+    print(f"{'Sequence':<28}{'Gray':>6}{'KB/frame':>10}{'Size':>8}{'Encode':>9}{'Decode':>9}")
+    for sequence_dirname, result in results.items():
+        print(
+            f"{sequence_dirname:<28}{'yes' if result.grayscale else 'no':>6}{result.gray_bytes_per_frame / 1024:>10.1f}"
+            f"{result.gray_bytes_per_frame / result.bgr_bytes_per_frame:>8.1%}"
+            f"{result.gray_encode_fps / result.bgr_encode_fps:>8.2f}x{result.gray_decode_fps / result.bgr_decode_fps:>8.2f}x"
+        )
+    return results
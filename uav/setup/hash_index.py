@@ -0,0 +1,165 @@
+import os
+from dataclasses import dataclass
+from concurrent.futures import ProcessPoolExecutor
+
+import cv2
+import numpy as np
+from tqdm import tqdm
+
+from uav.setup.decoders import DecoderBackend, open_decoder
+from uav.setup.frame_source import MODALITY_FILES, FrameSource
+
+
+HASH_INDEX_FILENAME = "hash_index.npz"
+HASH_SIZE = 8 # 8x8 difference hash, 64 bits per frame
+POPCOUNT_TABLE = np.array([bin(i).count("1") for i in range(256)], dtype=np.uint8)
+
+
+def popcount(values: np.ndarray) -> np.ndarray:
+    """Counts the set bits of uint64 values."""
+    if hasattr(np, "bitwise_count"):
+        return np.bitwise_count(values).astype(np.int32)
+    return POPCOUNT_TABLE[values.view(np.uint8).reshape(*values.shape, 8)].sum(axis=-1, dtype=np.int32)
+
+def difference_hashes(thumbnails: np.ndarray) -> np.ndarray:
+    """Vectorized difference hash of (n, HASH_SIZE, HASH_SIZE + 1) grayscale thumbnails: one bit per horizontally adjacent pixel pair."""
+    bits = thumbnails[:, :, 1:] > thumbnails[:, :, :-1]
+    return np.packbits(bits.reshape(len(bits), -1), axis=1, bitorder="little").view(np.uint64).ravel()
+
+def thumbnail(frame: np.ndarray) -> np.ndarray:
+    """Downscales a frame to the grayscale thumbnail hashed by difference_hashes."""
+    gray = frame if frame.ndim == 2 else cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+    return cv2.resize(gray, (HASH_SIZE + 1, HASH_SIZE), interpolation=cv2.INTER_AREA)
+
+def hash_video(video_path: str, decoder_backend: DecoderBackend = DecoderBackend.OPENCV) -> np.ndarray:
+    """Returns the difference hashes of all frames of a video, decoded once in order."""
+    with open_decoder(video_path, decoder_backend) as decoder:
+        thumbnails = [thumbnail(frame) for frame in decoder.frames()]
+    if not thumbnails:
+        return np.empty(0, dtype=np.uint64)
+    return difference_hashes(np.stack(thumbnails))
+
+
+@dataclass
+class HashIndex():
+    """Perceptual hashes of the frames of one modality, one row per (sequence, frame), rows of a sequence contiguous and in frame order."""
+    sequences: np.ndarray   # sorted sequence names, indexed by the sequence column
+    sequence: np.ndarray    # int32 sequence id
+    frame: np.ndarray       # int32 frame index
+    hash: np.ndarray        # uint64 difference hash
+
+    def __len__(self) -> int:
+        return len(self.hash)
+
+    def rows(self, sequence_names: np.ndarray, frame_indices: np.ndarray) -> np.ndarray:
+        """Vectorized row lookup of (sequence, frame) pairs."""
+        sequence_ids = np.searchsorted(self.sequences, sequence_names)
+        starts = np.searchsorted(self.sequence, np.arange(len(self.sequences)))
+        return starts[sequence_ids] + np.asarray(frame_indices)
+
+    def distances(self, hash_value: int) -> np.ndarray:
+        """Returns the Hamming distance of every row to a hash."""
+        return popcount(self.hash ^ np.uint64(hash_value))
+
+    def lookup(self, hash_value: int, radius: int) -> np.ndarray:
+        """Returns the rows whose hash is within the Hamming radius of a hash."""
+        return np.flatnonzero(self.distances(hash_value) <= radius)
+
+    def near_duplicates(self, row: int, radius: int) -> np.ndarray:
+        """Returns the other rows within the Hamming radius of a row."""
+        rows = self.lookup(int(self.hash[row]), radius)
+        return rows[rows != row]
+
+def build_hash_index(sequence_hashes: dict[str, np.ndarray]) -> HashIndex:
+    """Concatenates per-sequence hash arrays into a hash index."""
+    sequences = np.asarray(sorted(sequence_hashes))
+    return HashIndex(
+        sequences,
+        np.concatenate([np.full(len(sequence_hashes[name]), i, dtype=np.int32) for i, name in enumerate(sequences)]) if len(sequences) else np.empty(0, dtype=np.int32),
+        np.concatenate([np.arange(len(sequence_hashes[name]), dtype=np.int32) for name in sequences]) if len(sequences) else np.empty(0, dtype=np.int32),
+        np.concatenate([sequence_hashes[name] for name in sequences]) if len(sequences) else np.empty(0, dtype=np.uint64),
+    )
+
+def hash_frame_source(frame_source: FrameSource, modality_str: str = "vz", num_workers: int = 1, decoder_backend: DecoderBackend = DecoderBackend.OPENCV) -> HashIndex:
+    """Hashes every frame of one modality straight from the raw videos of a frame source, one sequence per worker process."""
+    sequences = frame_source.sequences()
+    video_paths = [frame_source.probes[sequence][modality_str].path for sequence in sequences]
+
+    with ProcessPoolExecutor(max_workers=num_workers) as executor:
+        hashes = list(tqdm(executor.map(hash_video, video_paths, [decoder_backend] * len(video_paths)), total=len(video_paths), desc="Hashing videos"))
+    return build_hash_index(dict(zip(sequences, hashes)))
+
+def hash_dataset(source_dir: str, modality_str: str = "vz", num_workers: int = 1, decoder_backend: DecoderBackend = DecoderBackend.OPENCV) -> HashIndex:
+    """Hashes every frame of one modality of a raw Anti-UAV source tree."""
+    sequence_videos = {}
+    for subset_dirname in ["test", "train", "val"]:
+        subset_dir = os.path.join(source_dir, subset_dirname)
+        if not os.path.exists(subset_dir):
+            continue
+        for sequence_dirname in os.listdir(subset_dir):
+            if sequence_dirname != ".DS_Store":
+                sequence_videos[sequence_dirname] = os.path.join(subset_dir, sequence_dirname, f"{MODALITY_FILES[modality_str]}.mp4")
+
+    sequences = sorted(sequence_videos)
+    with ProcessPoolExecutor(max_workers=num_workers) as executor:
+        hashes = list(tqdm(executor.map(hash_video, [sequence_videos[name] for name in sequences], [decoder_backend] * len(sequences)), total=len(sequences), desc="Hashing videos"))
+    return build_hash_index(dict(zip(sequences, hashes)))
+
+def save_hash_index(hash_index: HashIndex, index_path: str) -> None:
+    """Saves a hash index as a single npz file."""
+    np.savez(index_path, sequences=hash_index.sequences, sequence=hash_index.sequence, frame=hash_index.frame, hash=hash_index.hash)
+
+def load_hash_index(index_path: str) -> HashIndex:
+    """Loads a hash index saved by save_hash_index."""
+    with np.load(index_path) as data:
+        return HashIndex(data["sequences"], data["sequence"], data["frame"], data["hash"])
+
+
+def sample_dissimilar(
+    sequence_ids: np.ndarray,
+    frame_indices: np.ndarray,
+    y_stratify: np.ndarray,
+    n_samples: int,
+    seed: int,
+    hashes: np.ndarray | None = None,
+    min_distance: int | None = None,
+    min_stride: int | None = None,
+) -> np.ndarray:
+    """Draws a stratified sample in which no two frames of the same sequence are within min_distance bits (Hamming) or min_stride frames of each other.
+    Candidates are visited in a seeded random order and accepted greedily until each class has its share of n_samples.
+    Returns the sorted sample indices, fewer than n_samples if the constraints exhaust a class."""
+    if min_distance is not None and hashes is None:
+        raise ValueError("min_distance requires the frame hashes.")
+
+    rng = np.random.default_rng(seed)
+    classes, counts = np.unique(y_stratify, return_counts=True)
+    quotas = dict(zip(classes, np.floor(counts / len(y_stratify) * n_samples).astype(int)))
+    # Hand out the remainder to the largest fractional shares, as the stratified splitters do
+    remainders = counts / len(y_stratify) * n_samples - np.floor(counts / len(y_stratify) * n_samples)
+    for i in np.argsort(-remainders)[:n_samples - sum(quotas.values())]:
+        quotas[classes[i]] += 1
+
+    kept_hashes, kept_frames = {}, {} # sequence id : list
+    selected = []
+    for i in rng.permutation(len(y_stratify)):
+        label = y_stratify[i]
+        if quotas[label] == 0:
+            continue
+        sequence_id = sequence_ids[i]
+
+        if min_stride is not None and sequence_id in kept_frames:
+            if np.any(np.abs(np.asarray(kept_frames[sequence_id]) - frame_indices[i]) < min_stride):
+                continue
+        if min_distance is not None and sequence_id in kept_hashes:
+            if np.any(popcount(np.asarray(kept_hashes[sequence_id], dtype=np.uint64) ^ hashes[i]) < min_distance):
+                continue
+
+        selected.append(i)
+        quotas[label] -= 1
+        kept_frames.setdefault(sequence_id, []).append(frame_indices[i])
+        if hashes is not None:
+            kept_hashes.setdefault(sequence_id, []).append(hashes[i])
+        if not any(quotas.values()):
+            break
+
+    return np.sort(np.asarray(selected, dtype=np.int64))
@@ -0,0 +1,106 @@
+import os
+import json
+
+from tqdm import tqdm
+
+from uav.setup.utils import vprint
+from uav.setup.manifest import load_manifest
+from uav.setup.label_index import LABEL_INDEX_DIRNAME, LABEL_TABLE_FILENAME, append_label_index, merge_label_tables
+from uav.setup.profile_data import PROFILE_FILENAME, load_profile, profile_label_index, save_profile
+from uav.setup.process_data import SCALES_FILENAME, ConversionOptions, convert_sequence, convert_sequences_parallel, list_pending_sequences, record_sequence, resolve_decoder
+from uav.experiments.create import extend_experiments
+
+
+def append_dataset_summary(target_dir: str, statistics: dict, new_sequences: list[str], verbose: bool) -> None:
+    """Adds new sequences to statistics.json, the label index, the profile and the scale factors without re-reading the existing ones."""
+    target_labelsdir = os.path.join(target_dir, "labels")
+
+    statistics_filepath = os.path.join(target_dir, "statistics.json")
+    with open(statistics_filepath, "w") as f:
+        json.dump({sequence_dirname: statistics[sequence_dirname] for sequence_dirname in sorted(statistics)}, f, indent=4)
+    vprint(verbose, f"Statistics successfully saved to {statistics_filepath}.")
+
+    label_index_dir = os.path.join(target_dir, LABEL_INDEX_DIRNAME)
+    if os.path.exists(label_index_dir) and all(os.path.exists(os.path.join(target_labelsdir, sequence_dirname, LABEL_TABLE_FILENAME)) for sequence_dirname in new_sequences):
+        new_index = merge_label_tables(target_labelsdir, new_sequences)
+        append_label_index(label_index_dir, new_index)
+        vprint(verbose, f"Label index successfully extended at {label_index_dir}.")
+
+        profile_filepath = os.path.join(target_dir, PROFILE_FILENAME)
+        profile = load_profile(profile_filepath) if os.path.exists(profile_filepath) else {}
+        profile.update(profile_label_index(new_index))
+        save_profile(profile, profile_filepath)
+
+    manifest = load_manifest(target_dir)
+    new_scales = {sequence_dirname: manifest[sequence_dirname].scales for sequence_dirname in new_sequences if sequence_dirname in manifest and manifest[sequence_dirname].scales is not None}
+    if new_scales:
+        scales_filepath = os.path.join(target_dir, SCALES_FILENAME)
+        scales = {}
+        if os.path.exists(scales_filepath):
+            with open(scales_filepath, "r") as f:
+                scales = json.load(f)
+        scales.update(new_scales)
+        with open(scales_filepath, "w") as f:
+            json.dump({sequence_dirname: scales[sequence_dirname] for sequence_dirname in sorted(scales)}, f, indent=4)
+
+def ingest_dataset(
+    source_dir: str,
+    target_dir: str,
+    verbose: bool,
+    remove_source: bool = False,
+    num_workers: int = 1,
+    options: ConversionOptions | None = None,
+    splits_filepaths: list[str] | None = None,
+    seed: int = 0,
+    max_new_frames: int | None = None,
+) -> list[str]:
+    """Converts the sequences of an Anti-UAV layout source directory that are not yet in the target dataset and appends them
+    to its statistics, manifest, label index and profile. Existing split files are extended with the new frames (see extend_experiments).
+    Returns the names of the ingested sequences."""
+    target_imagesdir = os.path.join(target_dir, "images")
+    target_labelsdir = os.path.join(target_dir, "labels")
+
+    statistics_filepath = os.path.join(target_dir, "statistics.json")
+    if not os.path.exists(statistics_filepath):
+        raise RuntimeError(f"'{target_dir}' is not a converted dataset, convert it with process_dataset first.")
+    with open(statistics_filepath, "r") as f:
+        statistics = {sequence_dirname: tuple(sequence_statistics) for sequence_dirname, sequence_statistics in json.load(f).items()}
+
+    sequences = list_pending_sequences(source_dir, None)
+    pending = [(subset_dir, sequence_dirname) for subset_dir, sequence_dirname in sequences if sequence_dirname not in statistics]
+    for _, sequence_dirname in sequences:
+        if sequence_dirname in statistics:
+            vprint(verbose, f"Warning: Sequence {sequence_dirname} is already part of the dataset and is skipped.")
+
+    if not pending:
+        vprint(verbose, "No new sequences to ingest.")
+        return []
+
+    vprint(verbose, f"Ingesting {len(pending)} new sequences...")
+    options = resolve_decoder(options, os.path.join(*pending[0]), verbose)
+
+    failed = {}
+    if num_workers > 1:
+        converted, failed = convert_sequences_parallel(pending, target_dir, target_imagesdir, target_labelsdir, remove_source, num_workers, options)
+    else:
+        converted = {}
+        for subset_dir, sequence_dirname in tqdm(pending, desc="Ingesting sequences"):
+            sequence_manifest = convert_sequence(subset_dir, sequence_dirname, target_imagesdir, target_labelsdir, options)
+            record_sequence(target_dir, subset_dir, sequence_manifest, remove_source)
+            converted[sequence_dirname] = tuple(sequence_manifest.statistics)
+
+    new_sequences = sorted(converted)
+    if new_sequences:
+        statistics.update(converted)
+        append_dataset_summary(target_dir, statistics, new_sequences, verbose)
+
+        for splits_filepath in splits_filepaths or []:
+            extend_experiments(splits_filepath, target_dir, new_sequences, seed, max_new_frames=max_new_frames)
+
+    if failed:
+        for sequence_dirname, error in failed.items():
+            vprint(verbose, f"Warning: Ingestion of sequence {sequence_dirname} failed: {error}")
+        raise RuntimeError(f"Ingestion failed for {len(failed)} sequences: {', '.join(sorted(failed))}. Re-run to retry them.")
+
+    vprint(verbose, f"Ingested {len(new_sequences)} sequences.")
+    return new_sequences
@@ -0,0 +1,222 @@
+import io
+import os
+import json
+from dataclasses import dataclass, field
+
+import numpy as np
+
+
+MODALITIES = ["vz", "ir"]
+MODALITY_FILES = {
+    "vz": "visible",
+    "ir": "infrared",
+}
+LABEL_TABLE_FILENAME = "labels.npz"
+LABEL_INDEX_DIRNAME = "label_index"
+LABEL_INDEX_COLUMNS = ["sequence", "modality", "frame", "exist", "xywh", "resolution"]
+
+
+@dataclass
+class LabelIndex():
+    """Columnar annotation table of a dataset, one row per (sequence, modality, frame).
+    xywh holds the normalized YOLO box and is NaN for frames without a labelled object."""
+    sequences: np.ndarray   # sequence names, indexed by the sequence column
+    sequence: np.ndarray    # int32 sequence id
+    modality: np.ndarray    # uint8 index into MODALITIES
+    frame: np.ndarray       # int32 frame index
+    exist: np.ndarray       # bool raw exist flag of the annotation
+    xywh: np.ndarray        # float64 (n, 4) normalized x_center, y_center, width, height
+    resolution: np.ndarray  # int32 (n, 2) original width, height
+    sequence_order: np.ndarray | None = field(default=None, repr=False) # argsort of sequences once appended ones follow unsorted, None while sorted
+    starts: dict | None = field(default=None, init=False, repr=False) # (sequence id, modality id) : first row
+
+    def __len__(self) -> int:
+        return len(self.frame)
+
+    def labelled(self) -> np.ndarray:
+        """Returns the mask of rows whose YOLO label file is not empty."""
+        return ~np.isnan(self.xywh[:, 0])
+
+    def sequence_id(self, sequence_name: str) -> int:
+        """Returns the id of a sequence name."""
+        if self.sequence_order is None:
+            return int(np.searchsorted(self.sequences, sequence_name))
+        return int(self.sequence_order[np.searchsorted(self.sequences, sequence_name, sorter=self.sequence_order)])
+
+    def select(self, sequence_name: str, modality_str: str) -> np.ndarray:
+        """Returns the row indices of a sequence modality in frame order."""
+        sequence_id = self.sequence_id(sequence_name)
+        mask = (self.sequence == sequence_id) & (self.modality == MODALITIES.index(modality_str))
+        return np.flatnonzero(mask)
+
+    def row(self, sequence_name: str, modality_str: str, frame_idx: int) -> int:
+        """Returns the row index of a single frame, rows of a sequence modality are contiguous and in frame order."""
+        if self.starts is None:
+            group = self.sequence.astype(np.int64) * len(MODALITIES) + self.modality
+            first_rows = np.flatnonzero(np.diff(group, prepend=-1))
+            self.starts = {(int(self.sequence[r]), int(self.modality[r])): int(r) for r in first_rows}
+
+        sequence_id = self.sequence_id(sequence_name)
+        return self.starts[(sequence_id, MODALITIES.index(modality_str))] + frame_idx
+
+    def label(self, row: int) -> str:
+        """Returns the YOLO label line of a row, empty if no object is labelled."""
+        return format_label_row(self.xywh[row])
+
+    def statistics(self) -> dict:
+        """Returns per-sequence (amount_frames_vz, amount_frames_ir, amount_annotations_vz, amount_annotations_ir) as in statistics.json."""
+        n_sequences = len(self.sequences)
+        frames = np.zeros((n_sequences, len(MODALITIES)), dtype=np.int64)
+        annotations = np.zeros((n_sequences, len(MODALITIES)), dtype=np.int64)
+        np.add.at(frames, (self.sequence, self.modality), 1)
+        np.add.at(annotations, (self.sequence, self.modality), self.exist.astype(np.int64))
+
+        return {
+            str(name): (int(frames[i, 0]), int(frames[i, 1]), int(annotations[i, 0]), int(annotations[i, 1]))
+            for i, name in enumerate(self.sequences)
+        }
+
+def format_label_row(xywh: np.ndarray) -> str:
+    """Formats a normalized box as YOLO label line, empty for a NaN box."""
+    if np.isnan(xywh[0]):
+        return ""
+    return " ".join(["0"] + [f"{value:.6f}" for value in xywh])
+
+def build_label_table(source_json: str, resolution: tuple[int, int]) -> dict[str, np.ndarray]:
+    """Vectorized conversion of an Anti-UAV annotation file into normalized YOLO boxes, matching extract_labels."""
+    with open(source_json, "r") as f:
+        data = json.load(f)
+
+    img_width, img_height = resolution
+    exist = np.asarray(data["exist"], dtype=bool)
+
+    # gt_rect entries are [x, y, w, h] or empty lists, only complete boxes with the exist flag set are labelled
+    has_box = np.fromiter((bool(bbox) and len(bbox) == 4 for bbox in data["gt_rect"]), dtype=bool, count=len(data["gt_rect"]))
+    rects = np.zeros((len(has_box), 4), dtype=np.float64)
+    if has_box.any():
+        rects[has_box] = np.asarray([bbox for bbox in data["gt_rect"] if bbox and len(bbox) == 4], dtype=np.float64)
+
+    n = min(len(exist), len(rects))
+    exist, has_box, rects = exist[:n], has_box[:n], rects[:n]
+
+    xywh = np.empty((n, 4), dtype=np.float64)
+    xywh[:, 0] = (rects[:, 0] + rects[:, 2] / 2) / img_width
+    xywh[:, 1] = (rects[:, 1] + rects[:, 3] / 2) / img_height
+    xywh[:, 2] = rects[:, 2] / img_width
+    xywh[:, 3] = rects[:, 3] / img_height
+    np.clip(xywh, 0, 1, out=xywh)
+    xywh[~(exist & has_box)] = np.nan
+
+    return {
+        "exist": exist,
+        "xywh": xywh,
+        "resolution": np.tile(np.asarray(resolution, dtype=np.int32), (n, 1)),
+    }
+
+def save_label_table(sequence_label_dir: str, tables: dict[str, dict[str, np.ndarray]]) -> None:
+    """Saves the label tables of all modalities of a sequence next to its label files."""
+    columns = {f"{modality_str}_{name}": values for modality_str, table in tables.items() for name, values in table.items()}
+    np.savez(os.path.join(sequence_label_dir, LABEL_TABLE_FILENAME), **columns)
+
+def load_label_table(sequence_label_dir: str) -> dict[str, dict[str, np.ndarray]] | None:
+    """Loads the per-modality label tables of a sequence, None if it has none."""
+    table_path = os.path.join(sequence_label_dir, LABEL_TABLE_FILENAME)
+    if not os.path.exists(table_path):
+        return None
+
+    with np.load(table_path) as data:
+        return {modality_str: {name: data[f"{modality_str}_{name}"] for name in ["exist", "xywh", "resolution"]} for modality_str in MODALITIES}
+
+def merge_label_tables(target_labelsdir: str, sequence_names: list[str]) -> LabelIndex:
+    """Concatenates the per-sequence label tables into a dataset label index."""
+    sequences = np.asarray(sorted(sequence_names))
+    columns = {name: [] for name in LABEL_INDEX_COLUMNS}
+
+    for sequence_id, sequence_name in enumerate(sequences):
+        tables = load_label_table(os.path.join(target_labelsdir, sequence_name))
+        if tables is None:
+            raise FileNotFoundError(f"Sequence {sequence_name} has no label table.")
+
+        for modality_id, modality_str in enumerate(MODALITIES):
+            table = tables[modality_str]
+            n = len(table["exist"])
+            columns["sequence"].append(np.full(n, sequence_id, dtype=np.int32))
+            columns["modality"].append(np.full(n, modality_id, dtype=np.uint8))
+            columns["frame"].append(np.arange(n, dtype=np.int32))
+            for name in ["exist", "xywh", "resolution"]:
+                columns[name].append(table[name])
+
+    return LabelIndex(sequences, **{name: np.concatenate(values) if values else np.empty(0) for name, values in columns.items()})
+
+def save_label_index(label_index: LabelIndex, index_dir: str) -> None:
+    """Saves the label index as one .npy file per column, so that it can be memory-mapped."""
+    os.makedirs(index_dir, exist_ok=True)
+    np.save(os.path.join(index_dir, "sequences.npy"), label_index.sequences)
+    save_sequence_order(label_index.sequence_order, index_dir)
+    for name in LABEL_INDEX_COLUMNS:
+        np.save(os.path.join(index_dir, f"{name}.npy"), getattr(label_index, name))
+
+def save_sequence_order(sequence_order: np.ndarray | None, index_dir: str) -> None:
+    """Saves the sort order of the sequence names, removing it if they are sorted."""
+    order_path = os.path.join(index_dir, "sequence_order.npy")
+    if sequence_order is not None:
+        np.save(order_path, sequence_order)
+    elif os.path.exists(order_path):
+        os.remove(order_path)
+
+def load_label_index(index_dir: str, mmap: bool = True) -> LabelIndex:
+    """Loads a label index, memory-mapping its columns by default."""
+    mmap_mode = "r" if mmap else None
+    order_path = os.path.join(index_dir, "sequence_order.npy")
+    return LabelIndex(
+        np.load(os.path.join(index_dir, "sequences.npy")),
+        **{name: np.load(os.path.join(index_dir, f"{name}.npy"), mmap_mode=mmap_mode) for name in LABEL_INDEX_COLUMNS},
+        sequence_order=np.load(order_path) if os.path.exists(order_path) else None,
+    )
+
+def append_npy(filepath: str, values: np.ndarray) -> bool:
+    """Appends rows to a C-ordered .npy file in place: the data goes to the end of the file and the header gets the new length.
+    Returns False without writing if the new header would not fit into the old one."""
+    with open(filepath, "r+b") as f:
+        version = np.lib.format.read_magic(f)
+        read_header = np.lib.format.read_array_header_1_0 if version == (1, 0) else np.lib.format.read_array_header_2_0
+        shape, fortran_order, dtype = read_header(f)
+        header_length = f.tell()
+        if fortran_order or tuple(shape[1:]) != tuple(values.shape[1:]):
+            raise ValueError(f"Rows of shape {values.shape[1:]} cannot be appended to {filepath} of shape {shape}.")
+
+        header = io.BytesIO()
+        write_header = np.lib.format.write_array_header_1_0 if version == (1, 0) else np.lib.format.write_array_header_2_0
+        write_header(header, {"descr": np.lib.format.dtype_to_descr(dtype), "fortran_order": False, "shape": (shape[0] + len(values), *shape[1:])})
+        if len(header.getvalue()) != header_length:
+            return False
+
+        f.seek(0, os.SEEK_END)
+        f.write(np.ascontiguousarray(values, dtype=dtype).tobytes())
+        f.seek(0)
+        f.write(header.getvalue())
+    return True
+
+def append_label_index(index_dir: str, new_index: LabelIndex) -> LabelIndex:
+    """Appends the rows of new sequences to a saved label index. The new sequences get the next ids and their rows are appended
+    to the column files in place, so the cost only depends on the new data. The sequence names are the only file rewritten,
+    together with their sort order for name lookups. Returns the extended index, memory-mapped."""
+    existing = load_label_index(index_dir)
+    overlap = np.intersect1d(existing.sequences, new_index.sequences)
+    if len(overlap):
+        raise ValueError(f"Sequences {', '.join(map(str, overlap))} are already in the label index.")
+
+    new_ids = len(existing.sequences) + np.arange(len(new_index.sequences), dtype=np.int32)
+    new_columns = {name: getattr(new_index, name) for name in LABEL_INDEX_COLUMNS}
+    new_columns["sequence"] = new_ids[new_index.sequence]
+    for name in LABEL_INDEX_COLUMNS:
+        filepath = os.path.join(index_dir, f"{name}.npy")
+        if not append_npy(filepath, new_columns[name]):
+            # numpy reserves header space for a longer first axis, this only happens for files written by other tools
+            np.save(filepath, np.concatenate([np.load(filepath), new_columns[name]]))
+
+    sequences = np.concatenate([existing.sequences, new_index.sequences])
+    sequence_order = np.argsort(sequences, kind="stable")
+    np.save(os.path.join(index_dir, "sequences.npy"), sequences)
+    save_sequence_order(None if np.array_equal(sequence_order, np.arange(len(sequences))) else sequence_order, index_dir)
+    return load_label_index(index_dir)
@@ -0,0 +1,167 @@
+import os
+import json
+import hashlib
+from dataclasses import dataclass, asdict
+from concurrent.futures import ThreadPoolExecutor
+
+from tqdm import tqdm
+
+
+MANIFEST_FILENAME = "manifest.jsonl"
+HASH_SAMPLE_BYTES = 64 * 1024
+
+
+@dataclass
+class ShardSpec():
+    """Shard index of count for multi-host conversion, sequences are assigned by a stable hash of their name."""
+    index: int
+    count: int
+
+    def __post_init__(self):
+        if not 0 <= self.index < self.count:
+            raise ValueError(f"Shard index {self.index} is out of range for {self.count} shards.")
+
+    def contains(self, sequence_name: str) -> bool:
+        """Returns whether a sequence belongs to this shard, independent of host, process and Python hash seed."""
+        return shard_of(sequence_name, self.count) == self.index
+
+    @property
+    def manifest_filename(self) -> str:
+        return f"manifest.shard-{self.index}-of-{self.count}.jsonl"
+
+    @property
+    def statistics_filename(self) -> str:
+        return f"statistics.shard-{self.index}-of-{self.count}.json"
+
+def shard_of(sequence_name: str, shard_count: int) -> int:
+    """Returns the shard a sequence is assigned to."""
+    return int.from_bytes(hashlib.blake2b(sequence_name.encode(), digest_size=8).digest(), "little") % shard_count
+
+@dataclass
+class SequenceManifest():
+    """Record of a converted sequence, written once its conversion completed."""
+    sequence: str
+    statistics: list[int]       # amount_frames_vz, amount_frames_ir, amount_annotations_vz, amount_annotations_ir
+    image_count: int
+    image_bytes: int
+    image_mtime_ns: int         # latest file modification time
+    images_dir_mtime_ns: int    # changes whenever a file is added or removed
+    label_count: int
+    label_bytes: int
+    label_mtime_ns: int
+    labels_dir_mtime_ns: int
+    image_hash: str | None = None
+    label_hash: str | None = None
+    scales: dict | None = None  # modality : [width, height] factor from original to stored frames, None at full resolution
+
+def scan_directory(directory: str) -> tuple[int, int, int, list[os.DirEntry]]:
+    """Returns file count, total bytes, latest modification time and the entries of a directory in a single pass."""
+    entries = sorted((entry for entry in os.scandir(directory) if entry.is_file()), key=lambda entry: entry.name)
+    total_bytes, latest_mtime_ns = 0, 0
+    for entry in entries:
+        stat = entry.stat()
+        total_bytes += stat.st_size
+        latest_mtime_ns = max(latest_mtime_ns, stat.st_mtime_ns)
+    return len(entries), total_bytes, latest_mtime_ns, entries
+
+def fast_hash(entries: list[os.DirEntry]) -> str:
+    """Hashes names, sizes and the first bytes of each file, catching truncated or replaced files without reading everything."""
+    digest = hashlib.blake2b(digest_size=16)
+    for entry in entries:
+        digest.update(entry.name.encode())
+        digest.update(entry.stat().st_size.to_bytes(8, "little"))
+        with open(entry.path, "rb") as f:
+            digest.update(f.read(HASH_SAMPLE_BYTES))
+    return digest.hexdigest()
+
+def build_sequence_manifest(sequence_dirname: str, target_imagesdir: str, target_labelsdir: str, statistics: tuple[int, int, int, int], hash_files: bool = False, scales: dict | None = None) -> SequenceManifest:
+    """Records file counts, sizes, modification times and optionally fast hashes of a converted sequence."""
+    sequence_image_dir = os.path.join(target_imagesdir, sequence_dirname)
+    sequence_label_dir = os.path.join(target_labelsdir, sequence_dirname)
+
+    image_count, image_bytes, image_mtime_ns, image_entries = scan_directory(sequence_image_dir)
+    label_count, label_bytes, label_mtime_ns, label_entries = scan_directory(sequence_label_dir)
+
+    return SequenceManifest(
+        sequence=sequence_dirname,
+        statistics=list(statistics),
+        image_count=image_count,
+        image_bytes=image_bytes,
+        image_mtime_ns=image_mtime_ns,
+        images_dir_mtime_ns=os.stat(sequence_image_dir).st_mtime_ns,
+        label_count=label_count,
+        label_bytes=label_bytes,
+        label_mtime_ns=label_mtime_ns,
+        labels_dir_mtime_ns=os.stat(sequence_label_dir).st_mtime_ns,
+        image_hash=fast_hash(image_entries) if hash_files else None,
+        label_hash=fast_hash(label_entries) if hash_files else None,
+        scales=scales,
+    )
+
+def append_manifest(target_dir: str, sequence_manifest: SequenceManifest, manifest_filename: str = MANIFEST_FILENAME) -> None:
+    """Appends a sequence record to the manifest, durable once this returns so that a crashed conversion can resume from it."""
+    with open(os.path.join(target_dir, manifest_filename), "a") as f:
+        f.write(json.dumps(asdict(sequence_manifest)) + "\n")
+        f.flush()
+        os.fsync(f.fileno())
+
+def write_manifest(target_dir: str, records: list[SequenceManifest], manifest_filename: str = MANIFEST_FILENAME) -> None:
+    """Atomically replaces the manifest with the given records."""
+    manifest_path = os.path.join(target_dir, manifest_filename)
+    with open(manifest_path + ".tmp", "w") as f:
+        for sequence_manifest in records:
+            f.write(json.dumps(asdict(sequence_manifest)) + "\n")
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(manifest_path + ".tmp", manifest_path)
+
+def load_manifest(target_dir: str, manifest_filename: str = MANIFEST_FILENAME) -> dict[str, SequenceManifest]:
+    """Loads the latest record of every sequence from the manifest, ignoring a torn last line."""
+    manifest_path = os.path.join(target_dir, manifest_filename)
+    manifest = {}
+    if not os.path.exists(manifest_path):
+        return manifest
+
+    with open(manifest_path, "r") as f:
+        for line in f:
+            try:
+                record = SequenceManifest(**json.loads(line))
+            except (json.JSONDecodeError, TypeError):
+                continue
+            manifest[record.sequence] = record
+    return manifest
+
+def quick_check(sequence_manifest: SequenceManifest, target_imagesdir: str, target_labelsdir: str) -> bool:
+    """Checks a sequence against its record with two stat calls, any file added or removed since changes the directory mtimes."""
+    try:
+        images_dir_mtime_ns = os.stat(os.path.join(target_imagesdir, sequence_manifest.sequence)).st_mtime_ns
+        labels_dir_mtime_ns = os.stat(os.path.join(target_labelsdir, sequence_manifest.sequence)).st_mtime_ns
+    except FileNotFoundError:
+        return False
+    return images_dir_mtime_ns == sequence_manifest.images_dir_mtime_ns and labels_dir_mtime_ns == sequence_manifest.labels_dir_mtime_ns
+
+def deep_check(sequence_manifest: SequenceManifest, target_imagesdir: str, target_labelsdir: str) -> bool:
+    """Rescans a sequence and compares counts, sizes, modification times and, if recorded, hashes with its record."""
+    try:
+        current = build_sequence_manifest(sequence_manifest.sequence, target_imagesdir, target_labelsdir, sequence_manifest.statistics, hash_files=sequence_manifest.image_hash is not None, scales=sequence_manifest.scales)
+    except FileNotFoundError:
+        return False
+    return current == sequence_manifest
+
+def validate_with_manifest(sequence_names: list[str], target_dir: str, target_imagesdir: str, target_labelsdir: str, deep_verify: bool = False, num_workers: int = 1, manifest_filename: str = MANIFEST_FILENAME) -> tuple[dict, list[str]]:
+    """Validate already converted sequences against the manifest instead of rescanning them.
+    Returns statistics dict and list of validated sequence names."""
+    manifest = load_manifest(target_dir, manifest_filename)
+    candidates = [manifest[sequence] for sequence in sequence_names if sequence in manifest]
+
+    check = deep_check if deep_verify else quick_check
+    with ThreadPoolExecutor(max_workers=max(1, num_workers)) as executor:
+        results = list(tqdm(
+            executor.map(lambda sequence_manifest: check(sequence_manifest, target_imagesdir, target_labelsdir), candidates),
+            total=len(candidates),
+            desc="Verifying sequences" if deep_verify else "Validating sequences",
+        ))
+
+    validated = [sequence_manifest.sequence for sequence_manifest, valid in zip(candidates, results) if valid]
+    statistics = {sequence: tuple(manifest[sequence].statistics) for sequence in validated}
+    return statistics, validated
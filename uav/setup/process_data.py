@@ -3,64 +3,136 @@ import cv2
 from tqdm import tqdm
 import json
 import shutil
+import threading
+from queue import Queue
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from dataclasses import dataclass, replace
+
+import numpy as np
 
 from uav.setup.utils import vprint
+from uav.setup.frame_store import Codec, write_shard, count_shard_frames, resize_frame, resized_resolution, is_grayscale, to_grayscale
+from uav.setup.decoders import DecoderBackend, open_decoder, select_backend
+from uav.setup.manifest import MANIFEST_FILENAME, SequenceManifest, ShardSpec, build_sequence_manifest, append_manifest, write_manifest, load_manifest, quick_check, validate_with_manifest
+from uav.setup.label_index import LABEL_INDEX_DIRNAME, LABEL_TABLE_FILENAME, build_label_table, format_label_row, save_label_table, load_label_table, merge_label_tables, save_label_index
+from uav.setup.profile_data import PROFILE_FILENAME, profile_label_index, save_profile
 
 
-def extract_frames(source_mp4: str, sequence_dirname: str, modality_str: str, target_dir: str) -> tuple[int, tuple[int, int]]:
-    """Extract the frames from the mp4 video and create jpg files at the target directory. Returns the amount of frames extracted."""
-    cap = cv2.VideoCapture(source_mp4)
-    frame_count = 0
-    success = True
+SCALES_FILENAME = "scales.json"
+
+
+@dataclass
+class ConversionOptions():
+    """Per-sequence conversion options of format_dataset."""
+    num_writers: int = 0                # encoder/writer threads per video, 0 writes on the decoding thread
+    codec: Codec | None = None          # pack frames into shards with this codec instead of loose JPEG files
+    quality: int | None = None          # codec quality, None for the OpenCV default
+    write_label_files: bool = True      # materialize one YOLO .txt file per frame next to the label index
+    hash_files: bool = False            # record fast content hashes in the manifest for deep verification
+    long_side: int | None = None        # downscale frames to this long side (e.g. the training imgsz) instead of storing them at full resolution
+    grayscale_ir: bool = False          # store infrared frames with a single channel if the video is grayscale
+    decoder: DecoderBackend = DecoderBackend.OPENCV # video decoder, AUTO benchmarks the available backends on the first sequence
+    exact_frame_counts: bool = False    # validate existing sequences against decoded frame counts with OpenCV too, instead of the container's estimate
 
-    width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
-    height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
 
-    while success:
-        success, frame = cap.read()
-        if not success:
+def write_frames(frame_queue: Queue, errors: list[str]) -> None:
+    """Encode and write (image_path, frame) items from the queue until a None sentinel is received."""
+    while True:
+        item = frame_queue.get()
+        if item is None:
             break
+        if errors:
+            continue # keep draining so the decoder never blocks on a full queue
 
-        image_name = f"{sequence_dirname}-{modality_str}-{frame_count:08d}.jpg"
-        cv2.imwrite(os.path.join(target_dir, image_name), frame)
-        frame_count += 1
+        image_path, frame = item
+        try:
+            written = cv2.imwrite(image_path, frame)
+        except cv2.error:
+            written = False
+        if not written:
+            errors.append(image_path)
+
+def extract_frames(source_mp4: str, sequence_dirname: str, modality_str: str, target_dir: str, num_writers: int = 0, queue_size: int = 64, long_side: int | None = None, grayscale: bool = False, decoder_backend: DecoderBackend = DecoderBackend.OPENCV) -> tuple[int, tuple[int, int]]:
+    """Extract the frames from the mp4 video and create jpg files at the target directory. Returns the amount of frames extracted and the original resolution.
+    If num_writers > 0 the calling thread only decodes and hands frames to a pool of encoder/writer threads over a queue bounded to queue_size frames.
+    If long_side is given, frames larger than it are downscaled to it before encoding.
+    If grayscale is set and the first frame is grayscale, all frames are written as 1-channel images."""
+    decoder = open_decoder(source_mp4, decoder_backend)
+    frame_count = 0
+    width, height = decoder.width, decoder.height
+
+    single_channel = None
+    frame_queue, errors, writers = None, [], []
+    if num_writers > 0:
+        frame_queue = Queue(maxsize=queue_size)
+        writers = [threading.Thread(target=write_frames, args=(frame_queue, errors), daemon=True) for _ in range(num_writers)]
+        for writer in writers:
+            writer.start()
+
+    frames = decoder.frames()
+    try:
+        for frame in frames:
+            if errors:
+                break
+            frame = resize_frame(frame, long_side)
+            if single_channel is None:
+                single_channel = grayscale and is_grayscale(frame)
+            if single_channel:
+                frame = to_grayscale(frame)
+
+            image_name = f"{sequence_dirname}-{modality_str}-{frame_count:08d}.jpg"
+            if frame_queue is not None:
+                frame_queue.put((os.path.join(target_dir, image_name), frame))
+            else:
+                cv2.imwrite(os.path.join(target_dir, image_name), frame)
+            frame_count += 1
+    finally:
+        frames.close()
+        decoder.close()
+        for _ in writers:
+            frame_queue.put(None)
+        for writer in writers:
+            writer.join()
+
+    if errors:
+        raise IOError(f"Could not write {len(errors)} frames of {source_mp4}, first: {errors[0]}")
 
-    cap.release()
     return frame_count, (width, height)
 
-def extract_labels(source_json: str, sequence_dirname: str, modality_str: str, target_dir: str, resolution: tuple[int, int]) -> int:
-    """Extract the labels from the json file and create txt files at the target directory. Returns the amount of annotated labels extracted."""
-    with open(source_json, "r") as f:
-        data = json.load(f)
-    
+def format_label(exists: int, bbox: list, resolution: tuple[int, int]) -> str:
+    """Convert a single Anti-UAV annotation into a YOLO label line, empty if no object is present."""
     img_width, img_height = resolution
-    
-    for idx, (exists, bbox) in enumerate(zip(data["exist"], data["gt_rect"])):
-        label_name = f"{sequence_dirname}-{modality_str}-{idx:08d}.txt"
+
+    if exists and bbox and len(bbox) == 4:
+        x, y, w, h = bbox[:4]
         
-        if exists and bbox and len(bbox) == 4:
-            x, y, w, h = bbox[:4]
-            
-            # Normalize coordinates
-            x_center = (x + w / 2) / img_width
-            y_center = (y + h / 2) / img_height
-            w_norm = w / img_width
-            h_norm = h / img_height
-            
-            # Ensure coordinates are within [0, 1] range
-            x_center = max(0, min(1, x_center))
-            y_center = max(0, min(1, y_center))
-            w_norm = max(0, min(1, w_norm))
-            h_norm = max(0, min(1, h_norm))
-            
-            label_content = " ".join(["0", f"{x_center:.6f}", f"{y_center:.6f}", f"{w_norm:.6f}", f"{h_norm:.6f}"])
-        else:
-            label_content = ""
+        # Normalize coordinates
+        x_center = (x + w / 2) / img_width
+        y_center = (y + h / 2) / img_height
+        w_norm = w / img_width
+        h_norm = h / img_height
+        
+        # Ensure coordinates are within [0, 1] range
+        x_center = max(0, min(1, x_center))
+        y_center = max(0, min(1, y_center))
+        w_norm = max(0, min(1, w_norm))
+        h_norm = max(0, min(1, h_norm))
+        
+        return " ".join(["0", f"{x_center:.6f}", f"{y_center:.6f}", f"{w_norm:.6f}", f"{h_norm:.6f}"])
+    return ""
+
+def extract_labels(source_json: str, sequence_dirname: str, modality_str: str, target_dir: str, resolution: tuple[int, int], write_files: bool = True) -> tuple[int, dict[str, np.ndarray]]:
+    """Extract the labels from the json file into a columnar label table and optionally create txt files at the target directory.
+    Returns the amount of annotated labels extracted and the label table."""
+    table = build_label_table(source_json, resolution)
 
-        with open(os.path.join(target_dir, label_name), "w") as f:
-            f.write(label_content)
+    if write_files:
+        for idx, xywh in enumerate(table["xywh"]):
+            label_name = f"{sequence_dirname}-{modality_str}-{idx:08d}.txt"
+            with open(os.path.join(target_dir, label_name), "w") as f:
+                f.write(format_label_row(xywh))
 
-    return sum(1 for exists in data["exist"] if exists)
+    return int(np.count_nonzero(table["exist"])), table
 
 def get_target_sequence_count(source_dir: str) -> int:
     """Count all sequences in source directory."""
@@ -79,8 +151,10 @@ def remove_sourcedir(source_dir: str, verbose: bool) -> None:
         except OSError as e:
             vprint(verbose, f"Warning: Could not remove source directory {source_dir}: {e}")
 
-def validate_existing_sequences(source_dir: str, target_imagesdir: str, target_labelsdir: str, verbose: bool) -> tuple[dict, list[str]]:
-    """Check if sequences have already been extracted by comparing file counts. Returns statistics dict and list of validated sequence names."""
+def validate_existing_sequences(source_dir: str, target_imagesdir: str, target_labelsdir: str, verbose: bool, decoder_backend: DecoderBackend = DecoderBackend.OPENCV, exact_counts: bool = False) -> tuple[dict, list[str]]:
+    """Check if sequences have already been extracted by comparing file counts against the frame counts of the videos.
+    Backends that count packets give exact counts, OpenCV only decodes every frame for them with exact_counts and otherwise reads the container's estimate.
+    Returns statistics dict and list of validated sequence names."""
     validated_sequences = []
     statistics = {}
     if not os.path.exists(target_imagesdir) or not os.path.exists(target_labelsdir):
@@ -106,23 +180,32 @@ def validate_existing_sequences(source_dir: str, target_imagesdir: str, target_l
             visible_video_path = os.path.join(subset_dir, sequence_dirname, "visible.mp4")
             infrared_video_path = os.path.join(subset_dir, sequence_dirname, "infrared.mp4")
             
-            cap_vz = cv2.VideoCapture(visible_video_path)
-            expected_frames_vz = int(cap_vz.get(cv2.CAP_PROP_FRAME_COUNT))
-            cap_vz.release()
-            
-            cap_ir = cv2.VideoCapture(infrared_video_path)
-            expected_frames_ir = int(cap_ir.get(cv2.CAP_PROP_FRAME_COUNT))
-            cap_ir.release()
+            with open_decoder(visible_video_path, decoder_backend) as decoder:
+                expected_frames_vz = decoder.frame_count(exact_counts)
+
+            with open_decoder(infrared_video_path, decoder_backend) as decoder:
+                expected_frames_ir = decoder.frame_count(exact_counts)
             
-            # Count actual amount of files
-            actual_images = len([f for f in os.listdir(sequence_image_dir) if f.endswith('.jpg')])
+            # Count actual amount of files, or frames when the sequence was packed into a shard
+            actual_images = count_shard_frames(sequence_image_dir)
+            if actual_images is None:
+                actual_images = len([f for f in os.listdir(sequence_image_dir) if f.endswith('.jpg')])
             actual_labels = len([f for f in os.listdir(sequence_label_dir) if f.endswith('.txt')])
+
+            # Sequences converted with a label table carry their annotation counts, label files are optional then
+            label_tables = load_label_table(sequence_label_dir)
+            if label_tables is not None and actual_labels == 0:
+                actual_labels = sum(len(table["exist"]) for table in label_tables.values())
             
             expected_total_images = expected_frames_vz + expected_frames_ir
             expected_total_labels = expected_frames_vz + expected_frames_ir  # Same as frames
             
             if actual_images == expected_total_images and actual_labels == expected_total_labels:
                 validated_sequences.append(sequence_dirname)
+                if label_tables is not None:
+                    statistics[sequence_dirname] = (expected_frames_vz, expected_frames_ir, int(np.count_nonzero(label_tables["vz"]["exist"])), int(np.count_nonzero(label_tables["ir"]["exist"])))
+                    continue
+
                 with open(os.path.join(subset_dir, sequence_dirname, "visible.json"), "r") as f:
                     data_vz = json.load(f)
                 amount_annotations_vz = sum(1 for exists in data_vz["exist"] if exists)
@@ -133,6 +216,11 @@ def validate_existing_sequences(source_dir: str, target_imagesdir: str, target_l
                 
                 statistics[sequence_dirname] = (expected_frames_vz, expected_frames_ir, amount_annotations_vz, amount_annotations_ir)
     
+    finish_validation(source_dir, validated_sequences, verbose)
+    return statistics, validated_sequences
+
+def finish_validation(source_dir: str, validated_sequences: list[str], verbose: bool) -> None:
+    """Report the validation result and stop if the entire dataset is already extracted."""
     amount_validated_sequences = len(validated_sequences)
     target_amount_sequences = get_target_sequence_count(source_dir=source_dir)
 
@@ -143,71 +231,312 @@ def validate_existing_sequences(source_dir: str, target_imagesdir: str, target_l
 
     vprint(verbose, f"Sucessfully validated {amount_validated_sequences} sequences.")
     vprint(verbose, f"Continuing extraction for {target_amount_sequences - amount_validated_sequences} remaining sequences...")
-    return statistics, validated_sequences
 
-def format_dataset(source_dir: str, target_dir: str, verbose: bool, remove_source: bool) -> None:
-    """Converts Anti-UAV300 raw MP4 videos and JSON annotations to YOLO format."""
-    target_imagesdir = os.path.join(target_dir, "images")
-    target_labelsdir = os.path.join(target_dir, "labels")
+def remove_partial_sequence(sequence_dirname: str, target_imagesdir: str, target_labelsdir: str) -> None:
+    """Remove the image and label directories of a partially extracted sequence."""
+    for target_sequencedir in [os.path.join(target_imagesdir, sequence_dirname), os.path.join(target_labelsdir, sequence_dirname)]:
+        if os.path.exists(target_sequencedir):
+            shutil.rmtree(target_sequencedir, ignore_errors=True)
 
-    if os.path.exists(target_dir):
-        vprint(verbose, "Detected Target Directory. Validating...\n")
-        statistics, validated = validate_existing_sequences(source_dir, target_imagesdir, target_labelsdir, verbose)
-    else:
-        vprint(verbose, "Starting Extraction of Data...\n")
-        os.makedirs(target_dir)
-        statistics = {} # sequence_name(str) : (amount_frames_vz, amount_frames_ir, amount_annotations_vz, amount_annotations_ir)(tuple[int, int, int, int])
-        validated = None
+def convert_sequence(subset_dir: str, sequence_dirname: str, target_imagesdir: str, target_labelsdir: str, options: ConversionOptions | None = None) -> SequenceManifest:
+    """Convert a single sequence to YOLO format. Returns its manifest record including the statistics.
+    The source is kept, record_sequence removes it once the record is in the manifest."""
+    options = options if options is not None else ConversionOptions()
+    try:
+        # Extract frames
+        target_image_sequencedir = os.path.join(target_imagesdir, sequence_dirname)
+        if os.path.exists(target_image_sequencedir): 
+            shutil.rmtree(target_image_sequencedir) # when it was only partially extracted
+        os.makedirs(target_image_sequencedir)
+
+        if options.codec is not None:
+            amount_frames_vz, (video_width_vz, video_height_vz) = write_shard(source_mp4=os.path.join(subset_dir, sequence_dirname, "visible.mp4"), shard_dir=target_image_sequencedir, modality_str="vz", codec=options.codec, quality=options.quality, long_side=options.long_side, decoder_backend=options.decoder)
+            amount_frames_ir, (video_width_ir, video_height_ir) = write_shard(source_mp4=os.path.join(subset_dir, sequence_dirname, "infrared.mp4"), shard_dir=target_image_sequencedir, modality_str="ir", codec=options.codec, quality=options.quality, long_side=options.long_side, grayscale=options.grayscale_ir, decoder_backend=options.decoder)
+        else:
+            amount_frames_vz, (video_width_vz, video_height_vz) = extract_frames(source_mp4=os.path.join(subset_dir, sequence_dirname, "visible.mp4"), sequence_dirname=sequence_dirname, modality_str="vz", target_dir=target_image_sequencedir, num_writers=options.num_writers, long_side=options.long_side, decoder_backend=options.decoder)
+            amount_frames_ir, (video_width_ir, video_height_ir) = extract_frames(source_mp4=os.path.join(subset_dir, sequence_dirname, "infrared.mp4"), sequence_dirname=sequence_dirname, modality_str="ir", target_dir=target_image_sequencedir, num_writers=options.num_writers, long_side=options.long_side, grayscale=options.grayscale_ir, decoder_backend=options.decoder)
+
+        # Extract labels
+        target_label_sequencedir = os.path.join(target_labelsdir, sequence_dirname)
+        if os.path.exists(target_label_sequencedir): 
+            shutil.rmtree(target_label_sequencedir) # when it was only partially extracted
+        os.makedirs(target_label_sequencedir)
+
+        amount_labels_vz, label_table_vz = extract_labels(source_json=os.path.join(subset_dir, sequence_dirname, "visible.json"), sequence_dirname=sequence_dirname, modality_str="vz", target_dir=target_label_sequencedir, resolution=(video_width_vz, video_height_vz), write_files=options.write_label_files)
+        amount_labels_ir, label_table_ir = extract_labels(source_json=os.path.join(subset_dir, sequence_dirname, "infrared.json"), sequence_dirname=sequence_dirname, modality_str="ir", target_dir=target_label_sequencedir, resolution=(video_width_ir, video_height_ir), write_files=options.write_label_files)
+        save_label_table(target_label_sequencedir, {"vz": label_table_vz, "ir": label_table_ir})
+
+        # Labels are normalized and resizing keeps the aspect ratio, so they stay valid; the scale maps stored pixels back to the original resolution
+        scales = None
+        if options.long_side is not None:
+            scales = {
+                modality_str: [stored / original for stored, original in zip(resized_resolution(*resolution, options.long_side), resolution)]
+                for modality_str, resolution in [("vz", (video_width_vz, video_height_vz)), ("ir", (video_width_ir, video_height_ir))]
+            }
+
+        statistics = (amount_frames_vz, amount_frames_ir, amount_labels_vz, amount_labels_ir)
+        sequence_manifest = build_sequence_manifest(sequence_dirname, target_imagesdir, target_labelsdir, statistics, options.hash_files, scales)
+    except BaseException:
+        # Failed or interrupted workers must not leave half-written sequences behind
+        remove_partial_sequence(sequence_dirname, target_imagesdir, target_labelsdir)
+        raise
+
+    return sequence_manifest
+
+def record_sequence(target_dir: str, subset_dir: str, sequence_manifest: SequenceManifest, remove_source: bool, manifest_filename: str = MANIFEST_FILENAME) -> None:
+    """Appends a converted sequence to the manifest and only then removes its source, so that an interrupt never loses a sequence."""
+    append_manifest(target_dir, sequence_manifest, manifest_filename)
+    if remove_source:
+        sequence_source_dir = os.path.join(subset_dir, sequence_manifest.sequence)
+        if os.path.exists(sequence_source_dir):
+            shutil.rmtree(sequence_source_dir)
+
+def resolve_decoder(options: ConversionOptions | None, sequence_dir: str, verbose: bool) -> ConversionOptions | None:
+    """Replaces DecoderBackend.AUTO by the fastest correct backend on the videos of a sample sequence."""
+    if options is None or options.decoder != DecoderBackend.AUTO:
+        return options
+
+    backend = select_backend([os.path.join(sequence_dir, "visible.mp4"), os.path.join(sequence_dir, "infrared.mp4")])
+    vprint(verbose, f"Selected the {backend.value} video decoder.")
+    return replace(options, decoder=backend)
 
+def init_conversion_worker() -> None:
+    """Limit OpenCV to a single thread per worker process to avoid oversubscribing cores."""
+    cv2.setNumThreads(1)
+
+def list_pending_sequences(source_dir: str, validated: list[str] | None) -> list[tuple[str, str]]:
+    """List (subset_dir, sequence_dirname) pairs that still need to be converted, in deterministic order."""
+    pending = []
     for subset_dirname in ["test", "train", "val"]:
         subset_dir = os.path.join(source_dir, subset_dirname)
-        for sequence_dirname in tqdm(os.listdir(subset_dir), desc=f"Extracting {subset_dirname} subset"):
+        if not os.path.exists(subset_dir):
+            continue
+        for sequence_dirname in sorted(os.listdir(subset_dir)):
             if sequence_dirname == ".DS_Store" or (sequence_dirname in validated if validated is not None else False):
                 continue
+            pending.append((subset_dir, sequence_dirname))
+    return pending
 
-            # Extract frames
-            target_image_sequencedir = os.path.join(target_imagesdir, sequence_dirname)
-            if os.path.exists(target_image_sequencedir): 
-                shutil.rmtree(target_image_sequencedir) # when it was only partially extracted
-            os.makedirs(target_image_sequencedir)
+def convert_sequences_parallel(pending: list[tuple[str, str]], target_dir: str, target_imagesdir: str, target_labelsdir: str, remove_source: bool, num_workers: int, options: ConversionOptions | None = None, manifest_filename: str = MANIFEST_FILENAME) -> tuple[dict, dict]:
+    """Convert sequences on a process pool, recording each in the manifest as it completes. Returns statistics of converted sequences and errors of failed ones.
+    Sources are only removed by the parent once their sequence is recorded."""
+    statistics, failed = {}, {}
 
-            amount_frames_vz, (video_width_vz, video_height_vz) = extract_frames(source_mp4=os.path.join(subset_dir, sequence_dirname, "visible.mp4"), sequence_dirname=sequence_dirname, modality_str="vz", target_dir=os.path.join(target_imagesdir, sequence_dirname))
-            amount_frames_ir, (video_width_ir, video_height_ir) = extract_frames(source_mp4=os.path.join(subset_dir, sequence_dirname, "infrared.mp4"), sequence_dirname=sequence_dirname, modality_str="ir", target_dir=os.path.join(target_imagesdir, sequence_dirname))
+    executor = ProcessPoolExecutor(max_workers=num_workers, initializer=init_conversion_worker)
+    futures = {
+        executor.submit(convert_sequence, subset_dir, sequence_dirname, target_imagesdir, target_labelsdir, options): (subset_dir, sequence_dirname)
+        for subset_dir, sequence_dirname in pending
+    }
 
-            # Extract labels
-            target_label_sequencedir = os.path.join(target_labelsdir, sequence_dirname)
-            if os.path.exists(target_label_sequencedir): 
-                shutil.rmtree(target_label_sequencedir) # when it was only partially extracted
-            os.makedirs(target_label_sequencedir)
+    try:
+        for future in tqdm(as_completed(futures), total=len(futures), desc=f"Extracting sequences ({num_workers} workers)"):
+            subset_dir, sequence_dirname = futures[future]
+            try:
+                sequence_manifest = future.result()
+                record_sequence(target_dir, subset_dir, sequence_manifest, remove_source, manifest_filename)
+                statistics[sequence_dirname] = tuple(sequence_manifest.statistics)
+            except Exception as e:
+                failed[sequence_dirname] = e
+                remove_partial_sequence(sequence_dirname, target_imagesdir, target_labelsdir)
+    except BaseException:
+        # Wait for running workers to stop, keep the sequences that finished meanwhile and remove what the others were writing
+        executor.shutdown(wait=True, cancel_futures=True)
+        for future, (subset_dir, sequence_dirname) in futures.items():
+            if sequence_dirname in statistics or sequence_dirname in failed:
+                continue
+            if future.done() and not future.cancelled() and future.exception() is None:
+                record_sequence(target_dir, subset_dir, future.result(), remove_source, manifest_filename)
+                statistics[sequence_dirname] = tuple(future.result().statistics)
+            else:
+                remove_partial_sequence(sequence_dirname, target_imagesdir, target_labelsdir)
+        raise
 
-            amount_labels_vz = extract_labels(source_json=os.path.join(subset_dir, sequence_dirname, "visible.json"), sequence_dirname=sequence_dirname, modality_str="vz", target_dir=os.path.join(target_labelsdir, sequence_dirname), resolution=(video_width_vz, video_height_vz) )
-            amount_labels_ir = extract_labels(source_json=os.path.join(subset_dir, sequence_dirname, "infrared.json"), sequence_dirname=sequence_dirname, modality_str="ir", target_dir=os.path.join(target_labelsdir, sequence_dirname), resolution=(video_width_ir, video_height_ir))
+    executor.shutdown(wait=True)
+    return statistics, failed
 
-            statistics[sequence_dirname] = (amount_frames_vz, amount_frames_ir, amount_labels_vz, amount_labels_ir)
+def save_dataset_summary(target_dir: str, statistics: dict, verbose: bool) -> None:
+    """Write statistics.json and the label index of all converted sequences."""
+    target_labelsdir = os.path.join(target_dir, "labels")
 
-            if remove_source:
-                sequence_source_dir = os.path.join(subset_dir, sequence_dirname)
-                if os.path.exists(sequence_source_dir):
-                    shutil.rmtree(sequence_source_dir)
+    # Merge in sequence name order so the output does not depend on worker scheduling
+    statistics = {sequence_dirname: statistics[sequence_dirname] for sequence_dirname in sorted(statistics)}
 
     statistics_filepath = os.path.join(target_dir, "statistics.json")
     with open(statistics_filepath, "w") as f:
         json.dump(statistics, f, indent=4)
     vprint(verbose, f"Statistics successfully saved to {statistics_filepath}.")
 
+    # Sequences converted before label tables existed have none, the index is then only written once they are re-converted
+    if all(os.path.exists(os.path.join(target_labelsdir, sequence_dirname, LABEL_TABLE_FILENAME)) for sequence_dirname in statistics):
+        label_index_dir = os.path.join(target_dir, LABEL_INDEX_DIRNAME)
+        label_index = merge_label_tables(target_labelsdir, list(statistics))
+        save_label_index(label_index, label_index_dir)
+        vprint(verbose, f"Label index successfully saved to {label_index_dir}.")
+
+        profile_filepath = os.path.join(target_dir, PROFILE_FILENAME)
+        save_profile(profile_label_index(label_index), profile_filepath)
+        vprint(verbose, f"Dataset profile successfully saved to {profile_filepath}.")
+
+    # Downscaled sequences record their scale factors in the manifest, collect them so that predictions can be mapped back to full resolution
+    manifest = load_manifest(target_dir)
+    scales = {sequence_dirname: manifest[sequence_dirname].scales for sequence_dirname in statistics if sequence_dirname in manifest and manifest[sequence_dirname].scales is not None}
+    if scales:
+        scales_filepath = os.path.join(target_dir, SCALES_FILENAME)
+        with open(scales_filepath, "w") as f:
+            json.dump(scales, f, indent=4)
+        vprint(verbose, f"Scale factors successfully saved to {scales_filepath}.")
+
+def format_dataset_shard(source_dir: str, target_dir: str, shard: ShardSpec, verbose: bool, remove_source: bool, num_workers: int = 1, options: ConversionOptions | None = None, deep_verify: bool = False) -> None:
+    """Converts the sequences of one shard into a target directory shared by all hosts.
+    The shard records its sequences in its own manifest and partial statistics file, merge_shards combines them once all shards are done."""
+    target_imagesdir = os.path.join(target_dir, "images")
+    target_labelsdir = os.path.join(target_dir, "labels")
+    os.makedirs(target_dir, exist_ok=True)
+
+    sequences = [(subset_dir, sequence_dirname) for subset_dir, sequence_dirname in list_pending_sequences(source_dir, None) if shard.contains(sequence_dirname)]
+    vprint(verbose, f"Shard {shard.index + 1} of {shard.count}: {len(sequences)} sequences.")
+
+    statistics, validated = {}, []
+    if os.path.exists(os.path.join(target_dir, shard.manifest_filename)):
+        statistics, validated = validate_with_manifest([sequence_dirname for _, sequence_dirname in sequences], target_dir, target_imagesdir, target_labelsdir, deep_verify, num_workers, shard.manifest_filename)
+        vprint(verbose, f"Sucessfully validated {len(validated)} sequences.")
+
+    pending = [(subset_dir, sequence_dirname) for subset_dir, sequence_dirname in sequences if sequence_dirname not in validated]
+    if pending:
+        options = resolve_decoder(options, os.path.join(*pending[0]), verbose)
+    failed = {}
+
+    if num_workers > 1:
+        converted, failed = convert_sequences_parallel(pending, target_dir, target_imagesdir, target_labelsdir, remove_source, num_workers, options, shard.manifest_filename)
+        statistics.update(converted)
+    else:
+        for subset_dir, sequence_dirname in tqdm(pending, desc="Extracting sequences"):
+            sequence_manifest = convert_sequence(subset_dir, sequence_dirname, target_imagesdir, target_labelsdir, options)
+            record_sequence(target_dir, subset_dir, sequence_manifest, remove_source, shard.manifest_filename)
+            statistics[sequence_dirname] = tuple(sequence_manifest.statistics)
+
+    statistics_filepath = os.path.join(target_dir, shard.statistics_filename)
+    with open(statistics_filepath, "w") as f:
+        json.dump({sequence_dirname: statistics[sequence_dirname] for sequence_dirname in sorted(statistics)}, f, indent=4)
+    vprint(verbose, f"Partial statistics successfully saved to {statistics_filepath}.")
+
+    if failed:
+        for sequence_dirname, error in failed.items():
+            vprint(verbose, f"Warning: Conversion of sequence {sequence_dirname} failed: {error}")
+        raise RuntimeError(f"Conversion failed for {len(failed)} sequences: {', '.join(sorted(failed))}. Re-run to retry them.")
+
+    vprint(verbose, "Shard conversion done!")
+
+def merge_shards(target_dir: str, shard_count: int, verbose: bool, source_dir: str | None = None) -> dict:
+    """Combines the partial statistics and manifests of all shards into statistics.json, manifest.jsonl and the label index.
+    Verifies that every sequence was converted by exactly one shard, the one it is assigned to, and (if source_dir is given) that none is missing."""
+    target_imagesdir = os.path.join(target_dir, "images")
+    target_labelsdir = os.path.join(target_dir, "labels")
+
+    statistics, records, owners, problems = {}, {}, {}, []
+    for shard_index in range(shard_count):
+        shard = ShardSpec(shard_index, shard_count)
+        statistics_filepath = os.path.join(target_dir, shard.statistics_filename)
+        if not os.path.exists(statistics_filepath):
+            problems.append(f"shard {shard_index} has not written {shard.statistics_filename}")
+            continue
+
+        with open(statistics_filepath, "r") as f:
+            partial = json.load(f)
+        manifest = load_manifest(target_dir, shard.manifest_filename)
+
+        for sequence_dirname, sequence_statistics in partial.items():
+            owners.setdefault(sequence_dirname, []).append(shard_index)
+            statistics[sequence_dirname] = tuple(sequence_statistics)
+            if not shard.contains(sequence_dirname):
+                problems.append(f"{sequence_dirname} was converted by shard {shard_index} but belongs to another shard")
+            if sequence_dirname not in manifest:
+                problems.append(f"{sequence_dirname} has no record in {shard.manifest_filename}")
+            elif not quick_check(manifest[sequence_dirname], target_imagesdir, target_labelsdir):
+                problems.append(f"{sequence_dirname} changed since shard {shard_index} converted it")
+            else:
+                records[sequence_dirname] = manifest[sequence_dirname]
+
+    for sequence_dirname, shard_indices in owners.items():
+        if len(shard_indices) > 1:
+            problems.append(f"{sequence_dirname} was converted by shards {shard_indices}")
+    if source_dir is not None:
+        missing = {sequence_dirname for _, sequence_dirname in list_pending_sequences(source_dir, None)} - set(statistics)
+        problems.extend(f"{sequence_dirname} was not converted by any shard" for sequence_dirname in sorted(missing))
+
+    if problems:
+        for problem in problems:
+            vprint(verbose, f"Warning: {problem}")
+        raise RuntimeError(f"Merging {shard_count} shards failed with {len(problems)} problems, first: {problems[0]}")
+
+    write_manifest(target_dir, [records[sequence_dirname] for sequence_dirname in sorted(records)])
+    save_dataset_summary(target_dir, statistics, verbose)
+    vprint(verbose, f"Merged {len(statistics)} sequences from {shard_count} shards.")
+    return statistics
+
+def format_dataset(source_dir: str, target_dir: str, verbose: bool, remove_source: bool, num_workers: int = 1, options: ConversionOptions | None = None, deep_verify: bool = False, shard: ShardSpec | None = None) -> None:
+    """Converts Anti-UAV300 raw MP4 videos and JSON annotations to YOLO format and a columnar label index.
+    Sequences are converted on a process pool if num_workers > 1, see ConversionOptions for the per-sequence options.
+    Completed sequences are recorded in a manifest, against which a re-run validates existing sequences (rescanning them if deep_verify is set).
+    With a shard spec only the sequences of that shard are converted, see format_dataset_shard."""
+    if shard is not None:
+        return format_dataset_shard(source_dir, target_dir, shard, verbose, remove_source, num_workers, options, deep_verify)
+
+    target_imagesdir = os.path.join(target_dir, "images")
+    target_labelsdir = os.path.join(target_dir, "labels")
+
+    sequences = list_pending_sequences(source_dir, None)
+
+    if os.path.exists(target_dir):
+        vprint(verbose, "Detected Target Directory. Validating...\n")
+        if os.path.exists(os.path.join(target_dir, MANIFEST_FILENAME)):
+            sequence_names = [sequence_dirname for _, sequence_dirname in sequences]
+            statistics, validated = validate_with_manifest(sequence_names, target_dir, target_imagesdir, target_labelsdir, deep_verify, num_workers)
+            finish_validation(source_dir, validated, verbose)
+        else:
+            # AUTO is only resolved for the pending sequences, its benchmark is not worth it for counting
+            decoder_backend = options.decoder if options is not None and options.decoder != DecoderBackend.AUTO else DecoderBackend.OPENCV
+            statistics, validated = validate_existing_sequences(source_dir, target_imagesdir, target_labelsdir, verbose, decoder_backend, options is not None and options.exact_frame_counts)
+    else:
+        vprint(verbose, "Starting Extraction of Data...\n")
+        os.makedirs(target_dir)
+        statistics = {} # sequence_name(str) : (amount_frames_vz, amount_frames_ir, amount_annotations_vz, amount_annotations_ir)(tuple[int, int, int, int])
+        validated = None
+
+    pending = list_pending_sequences(source_dir, validated)
+    if pending:
+        options = resolve_decoder(options, os.path.join(*pending[0]), verbose)
+    failed = {}
+
+    if num_workers > 1:
+        converted, failed = convert_sequences_parallel(pending, target_dir, target_imagesdir, target_labelsdir, remove_source, num_workers, options)
+        statistics.update(converted)
+    else:
+        for subset_dir, sequence_dirname in tqdm(pending, desc="Extracting sequences"):
+            sequence_manifest = convert_sequence(subset_dir, sequence_dirname, target_imagesdir, target_labelsdir, options)
+            record_sequence(target_dir, subset_dir, sequence_manifest, remove_source)
+            statistics[sequence_dirname] = tuple(sequence_manifest.statistics)
+
+    save_dataset_summary(target_dir, statistics, verbose)
+
+    if failed:
+        for sequence_dirname, error in failed.items():
+            vprint(verbose, f"Warning: Conversion of sequence {sequence_dirname} failed: {error}")
+        raise RuntimeError(f"Conversion failed for {len(failed)} sequences: {', '.join(sorted(failed))}. Re-run to retry them.")
+
     if remove_source:
         remove_sourcedir(source_dir, verbose)
 
     vprint(verbose, "Conversion done!")
 
-def process_dataset(source_dir: str, target_dir: str, verbose: bool, remove_source: bool) -> bool:
+def process_dataset(source_dir: str, target_dir: str, verbose: bool, remove_source: bool, num_workers: int = 1, options: ConversionOptions | None = None, deep_verify: bool = False, shard: ShardSpec | None = None) -> bool:
     """Processes dataset with error handling, returns True on success."""
     print(source_dir)
     if not os.path.exists(source_dir):
         raise RuntimeError(f"Source directory '{source_dir}' does not exist.")
     
     try:
-        format_dataset(source_dir, target_dir, verbose, remove_source)
+        format_dataset(source_dir, target_dir, verbose, remove_source, num_workers, options, deep_verify, shard)
     except KeyboardInterrupt:
         print("Data processing aborted.")
         return False
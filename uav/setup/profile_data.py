@@ -0,0 +1,178 @@
+import os
+import json
+from concurrent.futures import ProcessPoolExecutor
+
+import cv2
+import numpy as np
+from tqdm import tqdm
+
+from uav.setup.label_index import MODALITIES, MODALITY_FILES, LabelIndex, build_label_table, load_label_index
+
+
+PROFILE_FILENAME = "profile.json"
+AREA_BINS = [0, 8**2, 16**2, 32**2, 64**2, 96**2, 128**2, 256**2, np.inf] # pixel areas, 32² and 96² are the COCO small/medium limits
+ASPECT_BINS = [0, 0.25, 0.5, 0.75, 1.0, 1.33, 2.0, 4.0, np.inf] # width / height
+SMALL_OBJECT_AREA = 32**2
+
+
+def presence_runs(flags: np.ndarray) -> np.ndarray:
+    """Returns the lengths of all consecutive runs of set flags."""
+    padded = np.concatenate([[0], flags.astype(np.int8), [0]])
+    changes = np.flatnonzero(np.diff(padded))
+    return changes[1::2] - changes[::2]
+
+def profile_modality(exist: np.ndarray, xywh: np.ndarray, resolution: tuple[int, int], fps: float | None) -> dict:
+    """Profiles the annotations of a single sequence modality."""
+    width, height = resolution
+    labelled = ~np.isnan(xywh[:, 0])
+
+    box_width = xywh[labelled, 2] * width
+    box_height = xywh[labelled, 3] * height
+    area = box_width * box_height
+    aspect = np.divide(box_width, box_height, out=np.full_like(box_width, np.inf), where=box_height > 0)
+
+    runs = presence_runs(exist)
+    gaps = presence_runs(~exist)
+
+    return {
+        "frames": int(len(exist)),
+        "annotated": int(np.count_nonzero(exist)),
+        "labelled": int(np.count_nonzero(labelled)),
+        "resolution": [int(width), int(height)],
+        "fps": fps,
+        "area_histogram": np.histogram(area, bins=AREA_BINS)[0].tolist(),
+        "aspect_histogram": np.histogram(aspect, bins=ASPECT_BINS)[0].tolist(),
+        "area_median": float(np.median(area)) if len(area) else None,
+        "small_objects": int(np.count_nonzero(area < SMALL_OBJECT_AREA)),
+        "presence_runs": int(len(runs)),
+        "presence_run_mean": float(runs.mean()) if len(runs) else 0.0,
+        "presence_run_max": int(runs.max()) if len(runs) else 0,
+        "absence_run_max": int(gaps.max()) if len(gaps) else 0,
+    }
+
+def profile_agreement(exist_vz: np.ndarray, exist_ir: np.ndarray) -> dict:
+    """Compares the VZ and IR exist flags of a sequence over their common frames."""
+    n = min(len(exist_vz), len(exist_ir))
+    exist_vz, exist_ir = exist_vz[:n], exist_ir[:n]
+    return {
+        "frames": int(n),
+        "both": int(np.count_nonzero(exist_vz & exist_ir)),
+        "vz_only": int(np.count_nonzero(exist_vz & ~exist_ir)),
+        "ir_only": int(np.count_nonzero(~exist_vz & exist_ir)),
+        "neither": int(np.count_nonzero(~exist_vz & ~exist_ir)),
+    }
+
+def profile_sequence(tables: dict[str, dict[str, np.ndarray]], fps: dict[str, float | None]) -> dict:
+    """Profiles both modalities of a sequence from their label tables."""
+    profile = {}
+    for modality_str in MODALITIES:
+        table = tables[modality_str]
+        resolution = tuple(table["resolution"][0]) if len(table["resolution"]) else (0, 0)
+        profile[modality_str] = profile_modality(table["exist"], table["xywh"], resolution, fps[modality_str])
+    profile["agreement"] = profile_agreement(tables["vz"]["exist"], tables["ir"]["exist"])
+    return profile
+
+def profile_raw_sequence(sequence_dir: str) -> dict:
+    """Profiles a raw Anti-UAV sequence directory from its annotation JSONs and video metadata."""
+    tables, fps = {}, {}
+    for modality_str, file_stem in MODALITY_FILES.items():
+        cap = cv2.VideoCapture(os.path.join(sequence_dir, f"{file_stem}.mp4"))
+        resolution = (int(cap.get(cv2.CAP_PROP_FRAME_WIDTH)), int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT)))
+        fps[modality_str] = float(cap.get(cv2.CAP_PROP_FPS))
+        cap.release()
+        tables[modality_str] = build_label_table(os.path.join(sequence_dir, f"{file_stem}.json"), resolution)
+    return profile_sequence(tables, fps)
+
+def profile_label_index(label_index: LabelIndex) -> dict[str, dict]:
+    """Profiles all sequences of a label index, fps is unknown there."""
+    order = np.lexsort((label_index.modality, label_index.sequence))
+    group = label_index.sequence[order].astype(np.int64) * len(MODALITIES) + label_index.modality[order]
+    bounds = np.flatnonzero(np.diff(group, prepend=-1, append=-1))
+
+    tables = {}
+    for start, end in zip(bounds[:-1], bounds[1:]):
+        rows = order[start:end]
+        sequence_name = str(label_index.sequences[label_index.sequence[rows[0]]])
+        modality_str = MODALITIES[label_index.modality[rows[0]]]
+        tables.setdefault(sequence_name, {})[modality_str] = {
+            "exist": np.asarray(label_index.exist[rows]),
+            "xywh": np.asarray(label_index.xywh[rows]),
+            "resolution": np.asarray(label_index.resolution[rows]),
+        }
+
+    return {sequence_name: profile_sequence(sequence_tables, {modality_str: None for modality_str in MODALITIES}) for sequence_name, sequence_tables in tables.items()}
+
+def profile_dataset(profile_path: str, source_dir: str | None = None, label_index_dir: str | None = None, num_workers: int = 1) -> dict[str, dict]:
+    """Profiles the dataset from the raw annotations (parallel across sequences) or from a label index, and caches the result at profile_path."""
+    if label_index_dir is not None:
+        profile = profile_label_index(load_label_index(label_index_dir))
+    elif source_dir is not None:
+        sequence_dirs = {}
+        for subset_dirname in ["test", "train", "val"]:
+            subset_dir = os.path.join(source_dir, subset_dirname)
+            if not os.path.exists(subset_dir):
+                continue
+            for sequence_dirname in os.listdir(subset_dir):
+                if sequence_dirname != ".DS_Store":
+                    sequence_dirs[sequence_dirname] = os.path.join(subset_dir, sequence_dirname)
+
+        sequence_names = sorted(sequence_dirs)
+        with ProcessPoolExecutor(max_workers=num_workers) as executor:
+            profiles = list(tqdm(executor.map(profile_raw_sequence, [sequence_dirs[name] for name in sequence_names], chunksize=4), total=len(sequence_names), desc="Profiling sequences"))
+        profile = dict(zip(sequence_names, profiles))
+    else:
+        raise ValueError("Either source_dir or label_index_dir must be given.")
+
+    save_profile(profile, profile_path)
+    return profile
+
+def save_profile(profile: dict[str, dict], profile_path: str) -> None:
+    """Caches a dataset profile, sequences in name order."""
+    with open(profile_path, "w") as f:
+        json.dump({sequence_name: profile[sequence_name] for sequence_name in sorted(profile)}, f)
+
+def load_profile(profile_path: str) -> dict[str, dict]:
+    """Loads a cached dataset profile."""
+    with open(profile_path, "r") as f:
+        return json.load(f)
+
+def print_profile(profile: dict[str, dict]) -> None:
+    """Prints the dataset-wide summary of a cached profile."""
+    print(f"Dataset Profile ({len(profile)} sequences)\n")
+
+    for modality_str, name in [("vz", "Visible Spectrum"), ("ir", "Infrared")]:
+        modality_profiles = [sequence_profile[modality_str] for sequence_profile in profile.values()]
+        labelled = sum(p["labelled"] for p in modality_profiles)
+        area_histogram = np.sum([p["area_histogram"] for p in modality_profiles], axis=0)
+        aspect_histogram = np.sum([p["aspect_histogram"] for p in modality_profiles], axis=0)
+        runs = sum(p["presence_runs"] for p in modality_profiles)
+        run_frames = sum(p["presence_run_mean"] * p["presence_runs"] for p in modality_profiles)
+
+        resolutions, fps = {}, {}
+        for p in modality_profiles:
+            resolutions[tuple(p["resolution"])] = resolutions.get(tuple(p["resolution"]), 0) + 1
+            if p["fps"] is not None:
+                fps[round(p["fps"], 2)] = fps.get(round(p["fps"], 2), 0) + 1
+
+        print(f"{name}:")
+        print(f"  Resolutions:        {', '.join(f'{w}x{h} ({n})' for (w, h), n in sorted(resolutions.items(), key=lambda item: -item[1]))}")
+        if fps:
+            print(f"  Frame Rates:        {', '.join(f'{value:g} ({n})' for value, n in sorted(fps.items(), key=lambda item: -item[1]))}")
+        print(f"  Small Objects:      {sum(p['small_objects'] for p in modality_profiles) / max(labelled, 1):.2%} (< {SMALL_OBJECT_AREA} px²)")
+        print(f"  Presence Runs:      {runs:,}, mean length {run_frames / max(runs, 1):.1f} frames, longest {max(p['presence_run_max'] for p in modality_profiles):,}")
+        print(f"  Longest Absence:    {max(p['absence_run_max'] for p in modality_profiles):,} frames")
+        print("  Box Area (px²):")
+        for low, high, count in zip(AREA_BINS[:-1], AREA_BINS[1:], area_histogram):
+            print(f"    {low:>8g} - {high:<8g} {count / max(labelled, 1):>8.2%}")
+        print("  Box Aspect (w/h):")
+        for low, high, count in zip(ASPECT_BINS[:-1], ASPECT_BINS[1:], aspect_histogram):
+            print(f"    {low:>8g} - {high:<8g} {count / max(labelled, 1):>8.2%}")
+        print()
+
+    agreement = {key: sum(sequence_profile["agreement"][key] for sequence_profile in profile.values()) for key in ["frames", "both", "vz_only", "ir_only", "neither"]}
+    frames = max(agreement["frames"], 1)
+    print("VZ/IR Annotation Agreement:")
+    print(f"  Agreeing Frames:    {(agreement['both'] + agreement['neither']) / frames:.2%}")
+    print(f"  Both Annotated:     {agreement['both'] / frames:.2%}")
+    print(f"  Only VZ:            {agreement['vz_only'] / frames:.2%}")
+    print(f"  Only IR:            {agreement['ir_only'] / frames:.2%}\n")
@@ -0,0 +1,190 @@
+import os
+import re
+import shutil
+import tempfile
+import threading
+import zipfile
+from queue import Queue, Empty, Full
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+
+from tqdm import tqdm
+
+from uav.setup.utils import vprint
+from uav.setup.manifest import MANIFEST_FILENAME, append_manifest, validate_with_manifest
+from uav.setup.process_data import ConversionOptions, convert_sequence, init_conversion_worker, remove_partial_sequence, resolve_decoder, save_dataset_summary
+
+
+SEQUENCE_FILES = ["visible.mp4", "visible.json", "infrared.mp4", "infrared.json"]
+MEMBER_PATTERN = re.compile(r"(?:.*/)?(test|train|val)/([^/]+)/(" + "|".join(re.escape(f) for f in SEQUENCE_FILES) + r")$")
+
+
+def group_archive_sequences(zip_ref: zipfile.ZipFile) -> dict[tuple[str, str], list[zipfile.ZipInfo]]:
+    """Group the archive members by (subset, sequence), in archive order so that reading stays sequential."""
+    sequences = {}
+    for member in zip_ref.infolist():
+        match = MEMBER_PATTERN.match(member.filename)
+        if match is None:
+            continue
+        subset_dirname, sequence_dirname, _ = match.groups()
+        sequences.setdefault((subset_dirname, sequence_dirname), []).append(member)
+    return sequences
+
+def spool_sequence(zip_ref: zipfile.ZipFile, members: list[zipfile.ZipInfo], sequence_scratch_dir: str) -> None:
+    """Decompress the MP4/JSON members of a single sequence into the scratch directory."""
+    os.makedirs(sequence_scratch_dir, exist_ok=True)
+    for member in members:
+        with zip_ref.open(member) as source, open(os.path.join(sequence_scratch_dir, os.path.basename(member.filename)), "wb") as target:
+            shutil.copyfileobj(source, target, length=1024 * 1024)
+
+def spool_sequences(zip_path: str, sequences: list[tuple[tuple[str, str], list[zipfile.ZipInfo]]], scratch_dir: str, spooled: Queue, stop: threading.Event, errors: list) -> None:
+    """Producer thread: spools one sequence after the other and hands (subset_scratch_dir, sequence_dirname) to the converter.
+    The queue is bounded, so decompression only runs ahead of the conversion by its size."""
+    try:
+        with zipfile.ZipFile(zip_path, "r") as zip_ref:
+            for (subset_dirname, sequence_dirname), members in sequences:
+                if stop.is_set():
+                    return
+                subset_scratch_dir = os.path.join(scratch_dir, subset_dirname)
+                spool_sequence(zip_ref, members, os.path.join(subset_scratch_dir, sequence_dirname))
+
+                while not stop.is_set():
+                    try:
+                        spooled.put((subset_scratch_dir, sequence_dirname), timeout=0.5)
+                        break
+                    except Full:
+                        continue
+    except BaseException as e:
+        errors.append(e)
+    finally:
+        # Once stopped, nobody waits for the sentinel and the queue may stay full
+        while not stop.is_set():
+            try:
+                spooled.put(None, timeout=0.5)
+                break
+            except Full:
+                continue
+
+def format_dataset_from_zip(zip_path: str, target_dir: str, verbose: bool, num_workers: int = 1, options: ConversionOptions | None = None, scratch_dir: str | None = None, prefetch: int = 1) -> None:
+    """Converts the Anti-UAV300 ZIP archive to YOLO format without extracting the raw tree.
+    Each sequence is decompressed into a scratch directory while the previous ones are converted, and its scratch files are removed right after its conversion,
+    so at most num_workers + prefetch sequences are spooled at any time."""
+    target_imagesdir = os.path.join(target_dir, "images")
+    target_labelsdir = os.path.join(target_dir, "labels")
+    os.makedirs(target_dir, exist_ok=True)
+
+    with zipfile.ZipFile(zip_path, "r") as zip_ref:
+        sequences = group_archive_sequences(zip_ref)
+
+    statistics, validated = {}, []
+    if os.path.exists(os.path.join(target_dir, MANIFEST_FILENAME)):
+        vprint(verbose, "Detected Manifest. Validating...\n")
+        statistics, validated = validate_with_manifest([sequence_dirname for _, sequence_dirname in sequences], target_dir, target_imagesdir, target_labelsdir)
+        vprint(verbose, f"Sucessfully validated {len(validated)} sequences.")
+
+    pending = [(key, members) for key, members in sequences.items() if key[1] not in validated]
+    vprint(verbose, f"Streaming {len(pending)} remaining sequences from {zip_path}...")
+
+    scratch_dir = scratch_dir if scratch_dir is not None else tempfile.mkdtemp(prefix="anti-uav-scratch-", dir=os.path.dirname(os.path.abspath(target_dir)))
+    spooled = Queue(maxsize=prefetch)
+    stop = threading.Event()
+    spool_errors, failed = [], {}
+    producer = threading.Thread(target=spool_sequences, args=(zip_path, pending, scratch_dir, spooled, stop, spool_errors), daemon=True)
+
+    executor = ProcessPoolExecutor(max_workers=num_workers, initializer=init_conversion_worker) if num_workers > 1 else None
+    in_flight = {} # future : (subset_scratch_dir, sequence_dirname)
+
+    def collect(future) -> None:
+        """Record a finished conversion and drop its scratch files."""
+        subset_scratch_dir, sequence_dirname = in_flight.pop(future)
+        try:
+            sequence_manifest = future.result()
+            append_manifest(target_dir, sequence_manifest)
+            statistics[sequence_dirname] = tuple(sequence_manifest.statistics)
+        except Exception as e:
+            failed[sequence_dirname] = e
+            remove_partial_sequence(sequence_dirname, target_imagesdir, target_labelsdir)
+        shutil.rmtree(os.path.join(subset_scratch_dir, sequence_dirname), ignore_errors=True)
+        progress.update(1)
+
+    progress = tqdm(total=len(pending), desc="Converting streamed sequences")
+    producer.start()
+    try:
+        while True:
+            item = spooled.get()
+            if item is None:
+                break
+            subset_scratch_dir, sequence_dirname = item
+            options = resolve_decoder(options, os.path.join(subset_scratch_dir, sequence_dirname), verbose)
+
+            if executor is None:
+                try:
+                    sequence_manifest = convert_sequence(subset_scratch_dir, sequence_dirname, target_imagesdir, target_labelsdir, options)
+                    append_manifest(target_dir, sequence_manifest)
+                    statistics[sequence_dirname] = tuple(sequence_manifest.statistics)
+                except Exception as e:
+                    failed[sequence_dirname] = e
+                shutil.rmtree(os.path.join(subset_scratch_dir, sequence_dirname), ignore_errors=True)
+                progress.update(1)
+                continue
+
+            future = executor.submit(convert_sequence, subset_scratch_dir, sequence_dirname, target_imagesdir, target_labelsdir, options)
+            in_flight[future] = item
+            while len(in_flight) >= num_workers:
+                done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                for future in done:
+                    collect(future)
+
+        while in_flight:
+            done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in done:
+                collect(future)
+    except BaseException:
+        stop.set()
+        if executor is not None:
+            executor.shutdown(wait=True, cancel_futures=True)
+            for _, sequence_dirname in in_flight.values():
+                remove_partial_sequence(sequence_dirname, target_imagesdir, target_labelsdir)
+        raise
+    finally:
+        stop.set()
+        # Keep unblocking the producer until it exited, then drop all scratch files
+        while producer.is_alive():
+            try:
+                while True:
+                    spooled.get_nowait()
+            except Empty:
+                pass
+            producer.join(timeout=0.1)
+        progress.close()
+        if executor is not None:
+            executor.shutdown(wait=True)
+        shutil.rmtree(scratch_dir, ignore_errors=True)
+
+    if spool_errors:
+        raise RuntimeError(f"Reading the archive {zip_path} failed: {spool_errors[0]}")
+
+    save_dataset_summary(target_dir, statistics, verbose)
+
+    if failed:
+        for sequence_dirname, error in failed.items():
+            vprint(verbose, f"Warning: Conversion of sequence {sequence_dirname} failed: {error}")
+        raise RuntimeError(f"Conversion failed for {len(failed)} sequences: {', '.join(sorted(failed))}. Re-run to retry them.")
+
+    vprint(verbose, "Conversion done!")
+
+def process_archive(zip_path: str, target_dir: str, verbose: bool, remove_zip: bool, num_workers: int = 1, options: ConversionOptions | None = None) -> bool:
+    """Streams the dataset archive into the target format with error handling, returns True on success."""
+    if not os.path.exists(zip_path):
+        raise RuntimeError(f"Archive '{zip_path}' does not exist.")
+
+    try:
+        format_dataset_from_zip(zip_path, target_dir, verbose, num_workers, options)
+    except KeyboardInterrupt:
+        print("Data processing aborted.")
+        return False
+
+    if remove_zip:
+        os.remove(zip_path)
+        vprint(verbose, "Zip removed successfully")
+
+    return True